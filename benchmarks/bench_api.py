@@ -0,0 +1,38 @@
+# Per-call cost of the OISRankingAPI accessors as the number of teams grows.
+# Run from the repository root: python -m benchmarks.bench_api
+from random import Random
+from timeit import timeit
+
+from modules.api import OISRankingAPI, Snapshot
+from benchmarks.synthetic import contest
+
+SIZES = [100, 1000, 10000]
+TASKS = 8
+CALLS = 20000
+
+
+def loadedApi(teamCount: int) -> OISRankingAPI:
+    api = OISRankingAPI.__new__(OISRankingAPI)
+    api.oldSnapshot = Snapshot(contest(teamCount, TASKS, seed=1))
+    api.snapshot = Snapshot(contest(teamCount, TASKS, seed=2))
+    return api
+
+
+def main():
+    print(f"{'teams':>6} {'build ms':>9} {'teams() ns':>11} {'teamInfo ns':>12} {'partial ns':>11}")
+    for size in SIZES:
+        data = contest(size, TASKS)
+        build = timeit(lambda: Snapshot(data), number=5) / 5
+        api = loadedApi(size)
+        rng = Random(size)
+        names = [rng.choice(api.teams()) for _ in range(CALLS)]
+        quest = api.questions()[-1]
+        it = iter(names * 3)
+        teamsCall = timeit(api.teams, number=CALLS) / CALLS
+        infoCall = timeit(lambda: api.teamInfo(next(it)), number=CALLS) / CALLS
+        partialCall = timeit(lambda: api.getTeamPartial(next(it), quest, oldData=True), number=CALLS) / CALLS
+        print(f"{size:>6} {build*1e3:>9.2f} {teamsCall*1e9:>11.0f} {infoCall*1e9:>12.0f} {partialCall*1e9:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
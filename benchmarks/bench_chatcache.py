@@ -0,0 +1,104 @@
+# SQL statements per bot command, reading chat settings from the database on every message (as tgbot did) against
+# going through ChatCache. Runs on a throwaway database; commands follow a contest-time mix, mostly reads.
+# Run from the repository root: python -m benchmarks.bench_chatcache --chats 2000 --commands 20000
+import os
+from argparse import ArgumentParser
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+
+from pony.orm import db_session
+from modules.database import db, TGUser, connect
+from modules import subscriptions
+from modules.chatcache import ChatCache
+
+MIX = (("/leaderboard", 50), ("/team", 30), ("/top", 10), ("/support", 5), ("news", 5))
+FLUSH_EVERY = 500
+
+
+class StatementCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, sql: str) -> None:
+        if sql.lstrip().split(" ", 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            self.count += 1
+
+
+def legacyCommand(chatId: int, command: str) -> None:
+    with db_session:
+        if not TGUser.exists(lambda u: u.chatId == chatId):
+            TGUser(chatId=chatId)
+        user = TGUser.get(chatId=chatId)
+        if command in ("/team", "/top"):
+            _ = user.teamName
+        elif command == "/support":
+            user.status = "normal" if user.status == "calling_support" else "calling_support"
+        elif command == "news":
+            subscriptions.setNews(user, "rankChanged", "rankChanged" not in subscriptions.newsOf(user))
+
+
+def cachedCommand(chats: ChatCache, chatId: int, command: str) -> None:
+    with db_session:
+        user = chats.get(chatId)
+        if command in ("/team", "/top"):
+            _ = user.teamName
+        elif command == "/support":
+            user.status = "normal" if user.status == "calling_support" else "calling_support"
+        elif command == "news":
+            user.setNews("rankChanged", "rankChanged" not in user.news)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--commands", type=int, default=20000)
+    args = parser.parse_args()
+    connect(os.path.join(mkdtemp(), "bench.db"))
+
+    rng = Random(0)
+    with db_session:
+        db.get_connection().executemany(
+            'INSERT INTO "TGUser" ("chatId", "status", "teamName", "news") VALUES (?, ?, ?, ?)',
+            [(chatId, "normal", f"team{chatId % 300}", '["eventStart","rankChanged","pointsChanged"]')
+             for chatId in range(args.chats)])
+    subscriptions.migrateNews("telegram")
+    # A few chats that write to the bot for the first time
+    commands = [(rng.randrange(args.chats + args.chats // 20), rng.choices(*zip(*MIX))[0])
+                for _ in range(args.commands)]
+
+    counter = StatementCounter()
+    with db_session:
+        db.get_connection().set_trace_callback(counter)
+
+    start = perf_counter()
+    for chatId, command in commands:
+        legacyCommand(chatId, command)
+    legacyTime = perf_counter() - start
+    legacyStatements = counter.count
+
+    print(f"{args.commands} commands from {args.chats} chats, flushing every {FLUSH_EVERY} commands")
+    print(f"{'':>17} {'statements':>11} {'per command':>12} {'us per command':>15} {'in flushes':>11}")
+    print(f"{'database':>17} {legacyStatements:>11} {legacyStatements/args.commands:>12.2f} "
+          f"{legacyTime/args.commands*1e6:>15.0f}")
+
+    # The same commands twice: first with an empty cache, then with every chat already loaded
+    chats = ChatCache("telegram", flushInterval=3600)
+    for label in ("ChatCache, cold", "ChatCache, warm"):
+        counter.count = 0
+        flushStatements = 0
+        start = perf_counter()
+        for num, (chatId, command) in enumerate(commands, 1):
+            cachedCommand(chats, chatId, command)
+            if num % FLUSH_EVERY == 0 or num == len(commands):
+                before = counter.count
+                chats.flush()
+                flushStatements += counter.count - before
+        cachedTime = perf_counter() - start
+        print(f"{label:>17} {counter.count:>11} {counter.count/args.commands:>12.2f} "
+              f"{cachedTime/args.commands*1e6:>15.0f} {flushStatements:>11}")
+    print(f"cache: {chats.stats}")
+
+
+if __name__ == "__main__":
+    main()
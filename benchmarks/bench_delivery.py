@@ -0,0 +1,49 @@
+# Throughput and end-to-end latency of the Telegram delivery queue against a fake Bot transport.
+# Run from the repository root: python -m benchmarks.bench_delivery
+from random import Random
+from statistics import quantiles
+from time import monotonic, sleep
+
+from telepotpro.exception import TelegramError
+from modules.delivery import DeliveryQueue, DeliveryBatch
+
+MESSAGES = 600
+RTT = 0.05
+
+
+class FakeBot:
+    def __init__(self, rateLimitEvery: int=200) -> None:
+        self.calls = 0
+        self.rateLimitEvery = rateLimitEvery
+        self.rng = Random(0)
+
+    def sendMessage(self, chatId, text, **kwargs):
+        self.calls += 1
+        sleep(RTT * (0.5 + self.rng.random()))
+        if self.rateLimitEvery and self.calls % self.rateLimitEvery == 0:
+            raise TelegramError("Too Many Requests: retry after 1", 429, {"parameters": {"retry_after": 1}})
+
+
+def run(workers: int, globalRate: float) -> None:
+    queue = DeliveryQueue(FakeBot(), workers=workers, globalRate=globalRate)
+    batch = DeliveryBatch()
+    start = monotonic()
+    for chatId in range(MESSAGES):
+        queue.send(chatId, "📊 <b>Nuovi punteggi!</b>", batch, parse_mode="HTML")
+    enqueued = monotonic() - start
+    sent, failed = batch.wait()
+    elapsed = monotonic() - start
+    p50, p99 = (quantiles(queue.latencies, n=100)[i] for i in (49, 98))
+    print(f"{workers:>7} {globalRate:>6.0f} {enqueued*1e3:>11.1f} {sent/elapsed:>7.1f} "
+          f"{p50:>7.2f} {p99:>7.2f} {queue.stats['retried']:>7} {failed:>6}")
+
+
+def main():
+    print(f"{'workers':>7} {'rate':>6} {'enqueue ms':>11} {'msg/s':>7} {'p50 s':>7} {'p99 s':>7} {'retries':>7} {'failed':>6}")
+    print(f"serial baseline: {1/RTT:.1f} msg/s")
+    for workers, rate in [(1, 30), (4, 30), (8, 30), (16, 30)]:
+        run(workers, rate)
+
+
+if __name__ == "__main__":
+    main()
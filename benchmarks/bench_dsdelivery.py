@@ -0,0 +1,55 @@
+# Serial sends vs. ChannelFanout against mocked Discord channels with one slow channel and one deleted channel.
+# Run from the repository root: python -m benchmarks.bench_dsdelivery
+from asyncio import run, sleep
+from random import Random
+from time import perf_counter
+
+from modules.dsdelivery import ChannelFanout
+
+CHANNELS = 500
+LATENCY = 0.02
+SLOW = 2.0
+
+
+class MockChannel:
+    def __init__(self, chatId: int, latency: float) -> None:
+        self.id = chatId
+        self.latency = latency
+
+    async def send(self, content=None, embed=None):
+        await sleep(self.latency)
+
+
+class MockBot:
+    def __init__(self) -> None:
+        rng = Random(0)
+        self.channels = {chatId: MockChannel(chatId, LATENCY * (0.5 + rng.random())) for chatId in range(1, CHANNELS + 1)}
+        self.channels[1].latency = SLOW
+        del self.channels[2]
+
+    def get_channel(self, chatId: int):
+        return self.channels.get(chatId)
+
+
+async def serial(bot: MockBot) -> None:
+    for chatId in range(1, CHANNELS + 1):
+        chat = bot.get_channel(chatId)
+        if chat is not None:
+            await chat.send(content="📢")
+
+
+async def main():
+    bot = MockBot()
+    start = perf_counter()
+    await serial(bot)
+    print(f"serial:          {perf_counter() - start:6.2f} s")
+    for concurrency in (5, 10, 25, 50):
+        fanout = ChannelFanout(bot, concurrency=concurrency)
+        start = perf_counter()
+        sent, failed = await fanout.sendAll((str(chatId), {"content": "📢"}) for chatId in range(1, CHANNELS + 1))
+        print(f"fanout x{concurrency:<3}:     {perf_counter() - start:6.2f} s  sent={sent} failed={failed} "
+              f"missing={fanout.stats['missing']}")
+
+
+if __name__ == "__main__":
+    run(main())
@@ -0,0 +1,96 @@
+# Event-loop lag and command latency in the Discord bot while it refreshes against a slow judge:
+#   blocking: OISRankingAPI.refresh() called on the event loop, as dsbot did before AsyncOISRankingAPI
+#   async:    await AsyncOISRankingAPI.refresh(), as dsbot does now
+# A ticker wakes up every --tick seconds and records how late it runs; a stand-in command renders the first
+# leaderboard page every --every seconds and records the time from being due to being answered. Every refresh
+# fetches all four endpoints in full, the worst case for the loop.
+# Run from the repository root: python -m benchmarks.bench_eventloop --teams 10000 --tasks 20 --latency 1
+from argparse import ArgumentParser
+from asyncio import new_event_loop, gather, sleep as asleep
+from statistics import median
+from time import perf_counter
+
+from modules import render
+from modules.api import OISRankingAPI
+from modules.asyncapi import AsyncOISRankingAPI
+from benchmarks.judge import StandInJudge
+from benchmarks.synthetic import SyntheticContest
+
+
+async def ticker(tick: float, lags: list, stop: list) -> None:
+    while not stop:
+        due = perf_counter() + tick
+        await asleep(tick)
+        lags.append(perf_counter() - due)
+
+
+async def command(api, every: float, latencies: list, stop: list) -> None:
+    due = perf_counter()
+    while not stop:
+        due += every
+        await asleep(max(0.0, due - perf_counter()))
+        render.leaderboard(api, 1)
+        latencies.append(perf_counter() - due)
+
+
+async def refreshes(args, api, blocking: bool, stop: list) -> list:
+    spent = []
+    for _ in range(args.cycles):
+        await asleep(args.gap)
+        api.staticFetched = None
+        api.validators = {endpoint: {} for endpoint in api.endpoints}
+        api.digests = {}
+        start = perf_counter()
+        if blocking:
+            api.refresh()
+        else:
+            await api.refresh()
+        spent.append(perf_counter() - start)
+    await asleep(args.gap)
+    stop.append(True)
+    return spent
+
+
+async def run(args, mode: str, baseUrl: str) -> tuple[list, list, list]:
+    blocking = mode == "blocking"
+    api = OISRankingAPI(baseUrl=baseUrl) if blocking else AsyncOISRankingAPI(baseUrl=baseUrl)
+    if not blocking:
+        await api.refresh()
+    lags, latencies, stop = [], [], []
+    spent, _, _ = await gather(refreshes(args, api, blocking, stop), ticker(args.tick, lags, stop),
+                               command(api, args.every, latencies, stop))
+    if blocking:
+        api.executor.shutdown()
+    else:
+        await api.close()
+    return lags, latencies, spent
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds the judge takes to answer")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between two refreshes")
+    parser.add_argument("--tick", type=float, default=0.01)
+    parser.add_argument("--every", type=float, default=0.05, help="seconds between two commands")
+    args = parser.parse_args()
+
+    judge = StandInJudge(SyntheticContest(args.teams, args.tasks, 6000), speed=60, latency=args.latency)
+    baseUrl = judge.serve()
+    print(f"{args.teams} teams x {args.tasks} tasks, judge answering after {args.latency:.2f} s, "
+          f"{args.cycles} full refreshes")
+    print(f"{'':>9} {'max lag ms':>11} {'median lag ms':>14} {'max command ms':>15} {'median command ms':>18} "
+          f"{'refresh ms':>11}")
+    for mode in ("blocking", "async"):
+        loop = new_event_loop()
+        lags, latencies, spent = loop.run_until_complete(run(args, mode, baseUrl))
+        loop.close()
+        print(f"{mode:>9} {max(lags)*1e3:>11.1f} {median(lags)*1e3:>14.1f} {max(latencies)*1e3:>15.1f} "
+              f"{median(latencies)*1e3:>18.1f} {median(spent)*1e3:>11.0f}")
+    judge.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Write amplification and reconstruction time of the score history over a simulated five-hour contest.
+# Run from the repository root: python -m benchmarks.bench_history
+import os
+from json import dumps
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+
+from modules.api import Snapshot
+from modules.history import HistoryStore
+from benchmarks.synthetic import contest
+
+TEAMS = 3000
+TASKS = 8
+REFRESHES = 300
+SUBMISSIONS_PER_MINUTE = 40
+
+
+def main():
+    rng = Random(0)
+    data = contest(TEAMS, TASKS)
+    data["scores"] = {}
+    path = os.path.join(mkdtemp(), "history.bin")
+    store = HistoryStore(path)
+    tasks = list(data["tasks"])
+    teams = list(data["users"])
+
+    fullBytes = 0
+    changedCells = 0
+    recordTime = 0.0
+    for minute in range(REFRESHES):
+        for _ in range(SUBMISSIONS_PER_MINUTE):
+            team = rng.choice(teams)
+            task = rng.choice(tasks)
+            current = data["scores"].setdefault(team, {}).get(task, 0)
+            data["scores"][team][task] = max(current, float(rng.choice([10, 30, 50, 70, 100])))
+        fullBytes += len(dumps(data["scores"]))
+        snapshot = Snapshot(data, minute + 1)
+        start = perf_counter()
+        changedCells += store.record(snapshot, timestamp=minute * 60.0)
+        recordTime += perf_counter() - start
+    store.close()
+
+    size = os.path.getsize(path)
+    print(f"refreshes: {REFRESHES}, teams: {TEAMS}, tasks: {TASKS}, changed cells: {changedCells}")
+    print(f"history file: {size/1024:.1f} KiB ({size/REFRESHES:.0f} B per refresh)")
+    print(f"full /scores JSON per refresh: {fullBytes/REFRESHES/1024:.1f} KiB, "
+          f"write amplification vs. storing full snapshots: {size/fullBytes:.4f}")
+    print(f"record(): {recordTime/REFRESHES*1e3:.2f} ms per refresh")
+
+    store = HistoryStore(path)
+    for minute in (1, REFRESHES // 2, REFRESHES - 1):
+        start = perf_counter()
+        snapshot = store.at(minute * 60.0)
+        print(f"rebuild at minute {minute:>3}: {(perf_counter()-start)*1e3:7.2f} ms, leader {snapshot.teams[0]} "
+              f"with {snapshot.totals[snapshot.teams[0]]}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
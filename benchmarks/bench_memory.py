@@ -0,0 +1,114 @@
+# Memory held between refreshes and peaking during one, on a large contest and without the network: the judge
+# bodies are prepared up front and fed to RankingView._store() / _publish() as if they had just been fetched.
+#   before: every endpoint parsed into nested dicts and kept, the snapshot built from them
+#   after:  user and task names only, /scores parsed straight into a ScoreTable
+# Each mode runs in its own process, so the RSS high-water marks do not mix. Held and peak bytes come from
+# tracemalloc (numpy reports its buffers to it), the RSS growth over all the refreshes from getrusage. The publish
+# peak is mostly the change set: a few teams scoring move the rank of most of the others.
+# Run from the repository root: python -m benchmarks.bench_memory --teams 10000 --tasks 20 --cycles 5
+import gc
+import resource
+import subprocess
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from json import dumps, loads
+from random import Random
+from time import perf_counter
+
+from modules.api import RankingView, Snapshot
+from benchmarks.synthetic import contest
+
+
+class DictView(RankingView):
+    # Parses and builds the way refresh() did before /scores got its compact form
+    @staticmethod
+    def _parse(endpoint: str, body: bytes):
+        return loads(body)
+
+    def _build(self, version: int) -> Snapshot:
+        return Snapshot(self.payloads, version)
+
+
+def cycles(args) -> list:
+    # The judge bodies of each refresh: a full contest, then a few teams scoring between one refresh and the next.
+    # Only /scores is fetched after the first refresh, as the static endpoints are cached.
+    rng = Random(0)
+    data = contest(args.teams, args.tasks)
+    results = [{endpoint: (dumps(payload).encode(), {}) for endpoint, payload in data.items()}]
+    teams, tasks = list(data["users"]), list(data["tasks"])
+    for _ in range(args.cycles):
+        for team in rng.sample(teams, args.changes):
+            data["scores"].setdefault(team, {})[rng.choice(tasks)] = float(rng.choice([10, 30, 50, 70, 100]))
+        results.append({"scores": (dumps(data["scores"]).encode(), {})})
+    return results
+
+
+def maxRss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(args, mode: str) -> None:
+    View = DictView if mode == "before" else RankingView
+    bodies = cycles(args)
+    gc.collect()
+
+    # Untraced first: tracemalloc slows allocations down and keeps its own bookkeeping in the RSS
+    rssBefore = maxRss()
+    view = View()
+    start = perf_counter()
+    for results in bodies:
+        view._publish(view._store(results))
+    elapsed = (perf_counter() - start) / len(bodies)
+    rssGrowth = maxRss() - rssBefore
+    del view
+    gc.collect()
+
+    # Held: what the view keeps between refreshes. Peaks: the most allocated at once on top of that while parsing
+    # (_store) and while building and diffing the snapshot (_publish), in the refreshes that parse /scores only.
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    view = View()
+    parsePeak = publishPeak = 0
+    for cycle, results in enumerate(bodies):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        changed = view._store(results)
+        if cycle > 0:
+            parsePeak = max(parsePeak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.reset_peak()
+        view._publish(changed)
+        if cycle > 0:
+            publishPeak = max(publishPeak, tracemalloc.get_traced_memory()[1] - before)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(held, parsePeak, publishPeak, rssGrowth, elapsed)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--changes", type=int, default=100, help="teams scoring between two refreshes")
+    parser.add_argument("--mode", choices=("before", "after"))
+    args = parser.parse_args()
+    if args.mode:
+        measure(args, args.mode)
+        return
+
+    print(f"{args.teams} teams x {args.tasks} tasks, {args.cycles} refreshes (only /scores changes after the first)")
+    print(f"{'':>7} {'held MiB':>9} {'parse peak':>11} {'publish peak':>13} {'RSS growth MiB':>15} "
+          f"{'refresh ms':>11}")
+    for mode in ("before", "after"):
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_memory", "--mode", mode,
+                                 "--teams", str(args.teams), "--tasks", str(args.tasks), "--cycles", str(args.cycles),
+                                 "--changes", str(args.changes)], capture_output=True, text=True, check=True).stdout
+        held, parsePeak, publishPeak, rss, elapsed = map(float, output.split())
+        print(f"{mode:>7} {held/2**20:>9.1f} {parsePeak/2**20:>11.1f} {publishPeak/2**20:>13.1f} "
+              f"{rss/2**20:>15.1f} {elapsed*1e3:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Rank-change notifications over a replayed contest: the old ranking (ordinal positions from a sort on the total,
+# ties left in the judge's user order) against the competition ranking of Snapshot. "avoided" are the notifications
+# the old ranking sent for a team whose rank did not actually change.
+# Replays a synthetic contest by default, or a recorded one with --history.
+# Run from the repository root: python -m benchmarks.bench_ranking --teams 3000 --minutes 300
+from argparse import ArgumentParser
+from random import Random
+
+from modules.api import Snapshot, diffSnapshots
+from benchmarks.judge import HistoryReplay
+from benchmarks.synthetic import SyntheticContest
+
+
+def ordinalRanks(data: dict) -> dict:
+    # Ranking as it was computed before Snapshot handled ties
+    scores = data.get("scores", {})
+    totals = {team: sum(scores.get(team, {}).values()) for team in data.get("users", {})}
+    return {team: pos + 1 for pos, team in enumerate(sorted(totals, key=totals.__getitem__, reverse=True))}
+
+
+def rankChanges(old: dict, new: dict) -> set:
+    return {team for team, rank in new.items() if team in old and old[team] != rank}
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=3000)
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=40, help="submissions per contest minute")
+    parser.add_argument("--minutes", type=int, default=300, help="contest length, one refresh per minute")
+    parser.add_argument("--history", help="replay a HistoryStore file instead of a synthetic contest")
+    args = parser.parse_args()
+
+    source = HistoryReplay(args.history) if args.history else SyntheticContest(args.teams, args.tasks, args.rate)
+    rng = Random(0)
+    oldSnapshot = Snapshot({})
+    oldOrdinal = {}
+    totals = {"ordinal": 0, "competition": 0, "avoided": 0, "added": 0, "points": 0}
+    print(f"{'minute':>6} {'ordinal':>8} {'competition':>12} {'avoided':>8} {'added':>6} {'points':>7}")
+    for minute in range(1, args.minutes + 1):
+        # The judge gives no guarantee on the order of its users: shuffle it on every refresh
+        data = source.state(minute * 60.0)
+        users = list(data["users"])
+        rng.shuffle(users)
+        data = dict(data, users=dict.fromkeys(users))
+
+        newOrdinal = ordinalRanks(data)
+        snapshot = Snapshot(data, minute)
+        changes = diffSnapshots(oldSnapshot, snapshot)
+        ordinal = rankChanges(oldOrdinal, newOrdinal)
+        competition = {team for team, change in changes.items() if change["rankGained"]}
+        cycle = {"ordinal": len(ordinal), "competition": len(competition),
+                 "avoided": len(ordinal - competition), "added": len(competition - ordinal),
+                 "points": sum(1 for change in changes.values() if change["scores"])}
+        for key, value in cycle.items():
+            totals[key] += value
+        if minute in (1, 2, 5, 10, 30) or minute % 60 == 0:
+            print(f"{minute:>6} {cycle['ordinal']:>8} {cycle['competition']:>12} {cycle['avoided']:>8} "
+                  f"{cycle['added']:>6} {cycle['points']:>7}")
+        oldSnapshot, oldOrdinal = snapshot, newOrdinal
+
+    # Counted once per team, before the fan-out to the chats following it
+    print(f"rank-change notifications over {args.minutes} refreshes: ordinal {totals['ordinal']}, "
+          f"competition {totals['competition']}")
+    print(f"avoided (ordinal position moved, competition rank did not): {totals['avoided']} "
+          f"({totals['avoided'] / max(totals['ordinal'], 1):.1%})")
+    print(f"added (competition rank moved, ordinal position did not): {totals['added']}")
+    print(f"score notifications, for comparison: {totals['points']}")
+
+
+if __name__ == "__main__":
+    main()
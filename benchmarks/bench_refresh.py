@@ -0,0 +1,75 @@
+# Bytes on the wire and parse time per refresh cycle on a large contest served by the stand-in judge:
+#   before:          all four endpoints every cycle, uncompressed, with conditional GETs
+#   before, no ETag: the same against a judge that ignores If-None-Match (every body sent in full)
+#   after:           /scores only with gzip, static endpoints cached (refetched when /scores names an unknown
+#                    user or task)
+# Halfway through, a late contestant is added to /users and /scores to check the invalidation.
+# Run from the repository root: python -m benchmarks.bench_refresh --teams 10000 --tasks 20 --cycles 10
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+
+from modules.api import OISRankingAPI
+from benchmarks.judge import StandInJudge
+from benchmarks.synthetic import SyntheticContest
+
+LATE_TEAM = "lateTeam"
+
+
+def run(args, mode: str) -> dict:
+    judge = StandInJudge(SyntheticContest(args.teams, args.tasks, args.rate), args.speed)
+    baseUrl = judge.serve()
+    # Let some submissions in, so /scores is not empty on the first fetch
+    sleep(args.interval)
+    api = OISRankingAPI(baseUrl=baseUrl)
+    if mode != "after":
+        api.staticInterval = 0
+        api.session.headers["Accept-Encoding"] = "identity"
+
+    totals = {"bytes": 0, "requests": 0, "parse": 0.0, "refresh": 0.0, "changed": 0}
+    lateSeen = None
+    for cycle in range(args.cycles):
+        if cycle == args.cycles // 2:
+            with judge.lock:
+                judge.source.base["users"][LATE_TEAM] = {"f_name": "Late", "l_name": "", "team": None}
+                judge.source.base["scores"][LATE_TEAM] = {judge.source.tasks[0]: 100.0}
+        sleep(args.interval)
+        if mode == "before, no ETag":
+            api.validators = {endpoint: {} for endpoint in api.endpoints}
+        bytesSent, requests, parse = judge.bytesSent, judge.requests, api.parseSeconds
+        start = perf_counter()
+        changed = api.refresh()
+        totals["refresh"] += perf_counter() - start
+        totals["bytes"] += judge.bytesSent - bytesSent
+        totals["requests"] += judge.requests - requests
+        totals["parse"] += api.parseSeconds - parse
+        totals["changed"] += changed
+        if lateSeen is None and LATE_TEAM in api.snapshot.teamIndex:
+            lateSeen = cycle - args.cycles // 2
+    judge.shutdown()
+    totals["lateSeen"] = lateSeen
+    return totals
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=600, help="submissions per contest minute")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0, help="real seconds between refreshes")
+    parser.add_argument("--speed", type=float, default=300.0, help="contest seconds per real second")
+    args = parser.parse_args()
+
+    print(f"{args.teams} teams x {args.tasks} tasks, {args.cycles} cycles, averages per cycle")
+    print(f"{'':>15} {'requests':>9} {'KiB on wire':>12} {'parse ms':>9} {'refresh ms':>11} {'changed':>8} "
+          f"{'late team seen':>15}")
+    for label in ("before", "before, no ETag", "after"):
+        totals = run(args, label)
+        late = "never" if totals["lateSeen"] is None else f"+{totals['lateSeen']} cycles"
+        print(f"{label:>15} {totals['requests']/args.cycles:>9.1f} {totals['bytes']/args.cycles/1024:>12.0f} "
+              f"{totals['parse']/args.cycles*1e3:>9.1f} {totals['refresh']/args.cycles*1e3:>11.1f} "
+              f"{totals['changed']:>8} {late:>15}")
+
+
+if __name__ == "__main__":
+    main()
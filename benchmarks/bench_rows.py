@@ -0,0 +1,106 @@
+# Allocations of the team rows behind teamInfo(), per command, on a fresh snapshot (first reader after a refresh)
+# and on a warm one (every later reader):
+#   dict:    a read-only view on a fresh dict per team, as before TeamRow
+#   TeamRow: one slotted, immutable object per team
+# The commands read the same rows as the renderers: a leaderboard page, /top with the user's team, the team card
+# with its partials, and a pass over every team. TeamRow is read both through the row["field"] compatibility shim,
+# like the dict rows, and through attributes, like modules/render.py.
+# Run from the repository root: python -m benchmarks.bench_rows --teams 10000 --tasks 20
+import gc
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from time import perf_counter
+from types import MappingProxyType
+
+from modules.api import OISRankingAPI, Snapshot, _TeamView
+from benchmarks.synthetic import contest
+
+
+class DictRowSnapshot(Snapshot):
+    __slots__ = ()
+    def _index(self, names: tuple, matrix) -> None:
+        super()._index(names, matrix)
+        self.partials = _TeamView(self, lambda row: tuple(self.matrix[row].tolist()))
+        self.rows = _TeamView(self, lambda row: MappingProxyType({
+            "rank": int(self.rankArray[row]),
+            "name": names[row],
+            "partialScores": tuple(self.matrix[row].tolist()),
+            "totalScore": float(self.totalsArray[row])
+        }))
+
+
+def readItems(api: OISRankingAPI, names) -> None:
+    for name in names:
+        team = api.teamInfo(name)
+        team["rank"], team["name"], team["totalScore"], team["partialScores"]
+
+
+def readAttributes(api: OISRankingAPI, names) -> None:
+    for name in names:
+        team = api.teamInfo(name)
+        team.rank, team.name, team.totalScore, team.partialScores
+
+
+KINDS = (("dict", DictRowSnapshot, readItems), ("TeamRow, row[...]", Snapshot, readItems),
+         ("TeamRow, row.field", Snapshot, readAttributes))
+COMMANDS = ("leaderboard page", "top + own team", "team + partials", "every team")
+
+
+def command(api: OISRankingAPI, name: str, read):
+    teams = api.teams()
+    middle = teams[len(teams) // 2]
+    names = {
+        "leaderboard page": teams[10:20],
+        "top + own team": teams[:3] + (middle,),
+        "team + partials": (middle,),
+        "every team": teams,
+    }[name]
+    return lambda: read(api, names)
+
+
+def measure(api: OISRankingAPI, data: dict, kind, read, name: str) -> tuple:
+    # Blocks and bytes still allocated after the command on a fresh snapshot, then its time cold and warm
+    api.snapshot = kind(data)
+    run = command(api, name, read)
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    base = tracemalloc.get_traced_memory()[0]
+    run()
+    held = tracemalloc.get_traced_memory()[0] - base
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    api.snapshot = kind(data)
+    run = command(api, name, read)
+    start = perf_counter()
+    run()
+    cold = perf_counter() - start
+    runs = 20
+    start = perf_counter()
+    for _ in range(runs):
+        run()
+    warm = (perf_counter() - start) / runs
+    return blocks, held, cold, warm
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=20)
+    args = parser.parse_args()
+
+    data = contest(args.teams, args.tasks)
+    api = OISRankingAPI.__new__(OISRankingAPI)
+    api.oldSnapshot = Snapshot(data)
+    print(f"{args.teams} teams x {args.tasks} tasks; blocks and KiB left allocated by the first reader of a snapshot")
+    print(f"{'':>16} {'':>18} {'blocks':>8} {'KiB':>9} {'cold us':>10} {'warm us':>10}")
+    for name in COMMANDS:
+        for label, kind, read in KINDS:
+            blocks, held, cold, warm = measure(api, data, kind, read, name)
+            print(f"{name:>16} {label:>18} {blocks:>8} {held/1024:>9.1f} {cold*1e6:>10.1f} {warm*1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
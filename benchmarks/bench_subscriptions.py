@@ -0,0 +1,83 @@
+# Notification targeting at 100k Telegram chats: the old StrArray scan against the subscription table.
+# Works on a throwaway database, seeded with the old `news` arrays and then migrated with migrateNews().
+# Run from the repository root: python -m benchmarks.bench_subscriptions --chats 100000 --teams 3000
+import os
+from argparse import ArgumentParser
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+
+from pony.orm import db_session, select
+from modules.database import db, TGUser, connect
+from modules import subscriptions
+
+TEAM_COUNTS = [1, 10, 100, 500, 1000]
+REPEAT = 5
+
+
+def seed(chatCount: int, teams: list, rng: Random) -> None:
+    rows = []
+    for chatId in range(chatCount):
+        news = [newsType for newsType in subscriptions.NEWS_TYPES if rng.random() < 0.8]
+        rows.append((chatId, "normal", rng.choice(teams), "[" + ",".join(f'"{n}"' for n in news) + "]"))
+    with db_session:
+        db.get_connection().executemany(
+            'INSERT INTO "TGUser" ("chatId", "status", "teamName", "news") VALUES (?, ?, ?, ?)', rows)
+
+
+def legacyFollowers(newsType: str, teams: list) -> list:
+    return select((user.chatId, user.teamName) for user in TGUser
+                  if (newsType in user.news) and (user.teamName in teams))[:]
+
+
+def timed(fn) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(REPEAT):
+        with db_session:
+            start = perf_counter()
+            result = fn()
+            best = min(best, perf_counter() - start)
+    return best, len(result)
+
+
+def plan(sql: str) -> str:
+    with db_session:
+        return "; ".join(row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + sql).fetchall())
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--chats", type=int, default=100000)
+    parser.add_argument("--teams", type=int, default=3000)
+    args = parser.parse_args()
+    connect(os.path.join(mkdtemp(), "bench.db"))
+
+    rng = Random(0)
+    teams = [f"team{num}" for num in range(args.teams)]
+    seed(args.chats, teams, rng)
+    samples = {count: rng.sample(teams, min(count, len(teams))) for count in TEAM_COUNTS + [len(teams)]}
+
+    print(f"{args.chats} chats following {args.teams} teams, best of {REPEAT}")
+    print(f"{'changed teams':>13} {'StrArray ms':>12} {'table ms':>9} {'rows':>7}")
+    legacy = {count: timed(lambda: legacyFollowers("pointsChanged", sample)) for count, sample in samples.items()}
+
+    start = perf_counter()
+    migrated = subscriptions.migrateNews("telegram")
+    migration = perf_counter() - start
+
+    for count, sample in samples.items():
+        legacyTime, legacyRows = legacy[count]
+        tableTime, tableRows = timed(lambda: subscriptions.followers("telegram", "pointsChanged", sample))
+        assert legacyRows == tableRows
+        print(f"{count:>13} {legacyTime*1e3:>12.2f} {tableTime*1e3:>9.2f} {tableRows:>7}")
+    eventStart, rows = timed(lambda: subscriptions.followers("telegram", "eventStart"))
+    print(f"eventStart, every chat: {eventStart*1e3:.2f} ms for {rows} rows")
+    print(f"migrateNews(): {migrated} chats in {migration:.2f} s")
+    print("plan, StrArray:", plan('SELECT "chatId" FROM "TGUser" WHERE py_array_contains("news", \'pointsChanged\') '
+                                  'AND "teamName" IN (\'team1\', \'team2\')'))
+    print("plan, table:   ", plan('SELECT "chat" FROM "TGSubscription" WHERE "newsType" = \'pointsChanged\' '
+                                  'AND "teamName" IN (\'team1\', \'team2\')'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Checks of both judge clients (OISRankingAPI and AsyncOISRankingAPI) against the local stand-in judge, with every
+# response delayed by --latency seconds:
+#   - a full refresh fetches the four endpoints concurrently: about one latency, not four
+#   - a failing endpoint is named in EndpointError; a static endpoint that is already cached is kept instead
+#   - a 200 whose body does not parse fails like a fetch error, and the next good cycle recovers
+# Exits with status 1 if any check fails.
+# Run from the repository root: python -m benchmarks.check_fetch
+from argparse import ArgumentParser
+from asyncio import new_event_loop
+from sys import exit
+from time import perf_counter
+
+from modules.api import OISRankingAPI, EndpointError
+from modules.asyncapi import AsyncOISRankingAPI
+from benchmarks.judge import StandInJudge
+from benchmarks.synthetic import SyntheticContest
+
+
+class BlockingClient:
+    def __init__(self, baseUrl: str) -> None:
+        self.api = OISRankingAPI(baseUrl=baseUrl)
+
+    def refresh(self) -> bool:
+        return self.api.refresh()
+
+    def close(self) -> None:
+        self.api.executor.shutdown()
+
+
+class AsyncClient:
+    def __init__(self, baseUrl: str) -> None:
+        self.loop = new_event_loop()
+        self.api = AsyncOISRankingAPI(baseUrl=baseUrl)
+
+    def refresh(self) -> bool:
+        return self.loop.run_until_complete(self.api.refresh())
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.api.close())
+        self.loop.close()
+
+
+def refreshError(client) -> EndpointError:
+    try:
+        client.refresh()
+    except EndpointError as error:
+        return error
+    return None
+
+
+def checks(Client, judge: StandInJudge, baseUrl: str, args):
+    # Yields (description, passed, detail)
+    client = Client(baseUrl)
+    client.api.staticFetched = None
+    requests = judge.requests
+    start = perf_counter()
+    error = refreshError(client)
+    elapsed = perf_counter() - start
+    yield "full refresh succeeds", error is None, error and error.message
+    yield "full refresh asks for every endpoint", judge.requests - requests == len(client.api.endpoints), \
+        f"{judge.requests - requests} requests"
+    yield "endpoints fetched concurrently", elapsed < 2 * args.latency, \
+        f"{elapsed:.2f} s for {len(client.api.endpoints)} endpoints at {args.latency:.2f} s each"
+
+    judge.failing["users"] = (500, b"")
+    client.api.staticFetched = None
+    error = refreshError(client)
+    yield "cached /users kept when its fetch fails", error is None and len(client.api.teams()) == args.teams, \
+        error and error.message
+    del judge.failing["users"]
+
+    judge.failing["scores"] = (500, b"")
+    error = refreshError(client)
+    yield "failing /scores named in EndpointError", error is not None and set(error.errors) == {"scores"}, \
+        error and error.message
+
+    judge.failing["scores"] = (200, b"<html>Bad gateway</html>")
+    error = refreshError(client)
+    yield "unparsable /scores named in EndpointError", error is not None and set(error.errors) == {"scores"} \
+        and isinstance(error.errors["scores"], ValueError), error and error.message
+    del judge.failing["scores"]
+
+    error = refreshError(client)
+    yield "next good cycle recovers", error is None and len(client.api.teams()) == args.teams, \
+        error and error.message
+    client.close()
+
+    # Nothing cached yet: a failing static endpoint fails the refresh, and only that endpoint is reported
+    judge.failing["tasks"] = (503, b"")
+    client = Client(baseUrl)
+    error = refreshError(client)
+    yield "failing /tasks with nothing cached named in EndpointError", \
+        error is not None and set(error.errors) == {"tasks"}, error and error.message
+    del judge.failing["tasks"]
+    client.close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds added to every judge response")
+    args = parser.parse_args()
+
+    judge = StandInJudge(SyntheticContest(args.teams, args.tasks, 600), speed=60, latency=args.latency)
+    baseUrl = judge.serve()
+    failed = 0
+    for Client in (BlockingClient, AsyncClient):
+        for description, passed, detail in checks(Client, judge, baseUrl, args):
+            failed += not passed
+            detail = f" ({detail})" if detail else ""
+            print(f"{'ok' if passed else 'FAIL':>4}  {Client.__name__}: {description}{detail}")
+    judge.shutdown()
+    print(f"{failed} check(s) failed")
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Checks of the competition ranking computed by Snapshot: ties share a rank and the next rank skips (1, 1, 3, 4),
+# tied teams are listed in name order whatever order the judge uses, totals that differ only by float rounding tie,
+# and a snapshot built with Snapshot.fromTable() from the parsed judge bodies ranks exactly like Snapshot(data).
+# Exits with status 1 if any check fails.
+# Run from the repository root: python -m benchmarks.check_ranking
+from json import dumps
+from random import Random
+from sys import exit
+
+from modules.api import Snapshot, parseScores
+from benchmarks.synthetic import contest
+
+
+def contestOf(scores: dict, users=None, tasks=("t1", "t2", "t3")) -> dict:
+    users = list(scores) if users is None else users
+    return {"users": dict.fromkeys(users, {}), "tasks": {task: {"order": pos} for pos, task in enumerate(tasks)},
+            "scores": scores}
+
+
+def ranking(snapshot: Snapshot) -> list:
+    return [(team, snapshot.ranks[team], snapshot.totals[team]) for team in snapshot.teams]
+
+
+def fromBodies(data: dict, version: int=0) -> Snapshot:
+    # The way RankingView builds it: user names sorted, tasks in order, /scores through parseScores()
+    tasks = data["tasks"]
+    return Snapshot.fromTable(tuple(sorted(data["users"])), tuple(sorted(tasks, key=lambda x: tasks[x]["order"])),
+                              parseScores(dumps(data["scores"]).encode()), version)
+
+
+def checks():
+    # Yields (description, passed, detail)
+    snapshot = Snapshot(contestOf({"d": {"t1": 1}, "b": {"t1": 10}, "c": {"t1": 5}, "a": {"t2": 10}}))
+    expected = [("a", 1, 10.0), ("b", 1, 10.0), ("c", 3, 5.0), ("d", 4, 1.0)]
+    yield "ties share a rank, the next one skips (1, 1, 3, 4)", ranking(snapshot) == expected, ranking(snapshot)
+
+    snapshot = Snapshot(contestOf({"x": {"t1": 7}, "y": {"t1": 5}, "z": {"t1": 5}, "w": {"t1": 5}}))
+    expected = [("x", 1, 7.0), ("w", 2, 5.0), ("y", 2, 5.0), ("z", 2, 5.0)]
+    yield "a tie below the leader (1, 2, 2, 2)", ranking(snapshot) == expected, ranking(snapshot)
+
+    users = ["zeta", "alpha", "mu", "beta"]
+    snapshot = Snapshot(contestOf({}, users))
+    expected = [(team, 1, 0.0) for team in sorted(users)]
+    yield "all teams at 0 share rank 1, in name order", ranking(snapshot) == expected, ranking(snapshot)
+
+    # 0.1 + 0.2 != 0.3 in floating point; the totals are rounded so these still tie
+    snapshot = Snapshot(contestOf({"p": {"t1": 0.1, "t2": 0.2}, "q": {"t1": 0.3}, "r": {"t2": 0.2, "t3": 0.1},
+                                   "s": {"t1": 0.29}}))
+    ranks = {team: snapshot.ranks[team] for team in snapshot.teams}
+    yield "float-sum ties share a rank", ranks == {"p": 1, "q": 1, "r": 1, "s": 4}, ranks
+
+    snapshot = Snapshot(contestOf({"a": {"t1": 3}}, ["c", "a", "b"]))
+    expected = [("a", 1, 3.0), ("b", 2, 0.0), ("c", 2, 0.0)]
+    yield "users without scores rank as 0", ranking(snapshot) == expected, ranking(snapshot)
+
+    # The judge's user order must not matter
+    data = contest(300, 6, seed=4)
+    users = list(data["users"])
+    Random(4).shuffle(users)
+    shuffled = dict(data, users={user: data["users"][user] for user in users})
+    yield "user order does not change the ranking", ranking(Snapshot(data)) == ranking(Snapshot(shuffled)), None
+
+    for seed in range(5):
+        data = contest(500, 8, seed=seed)
+        # A few exact ties on non-zero totals, and a score for a user /users does not list (left out by both)
+        for team in list(data["users"])[:20]:
+            data["scores"][team] = {"task0": 50.0, "task1": 20.0}
+        data["scores"]["ghost"] = {"task0": 100.0}
+        expected, built = Snapshot(data), fromBodies(data)
+        same = ranking(expected) == ranking(built) and expected.questions == built.questions \
+            and (expected.matrix == built.matrix).all()
+        yield f"fromTable ranks like Snapshot(data), seed {seed}", same, None
+
+
+def main():
+    failed = 0
+    for description, passed, detail in checks():
+        failed += not passed
+        detail = f" ({detail})" if detail is not None and not passed else ""
+        print(f"{'ok' if passed else 'FAIL':>4}  {description}{detail}")
+    print(f"{failed} check(s) failed")
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
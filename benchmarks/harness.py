@@ -0,0 +1,157 @@
+# End-to-end run of refresh -> diff -> notification fan-out against the local stand-in judge, with fake Telegram and
+# Discord transports. Reports refresh time (diff included, as in the bots), diff time, messages per cycle and
+# delivery latency. The messages are the bots' sendLeaderboardNews ones: a rank message for every team whose rank
+# moved and a points message for every team whose scores did, each to the chats subscribed to that kind of news.
+# Run from the repository root: python -m benchmarks.harness --teams 3000 --tasks 8 --cycles 10
+from argparse import ArgumentParser
+from asyncio import new_event_loop, sleep as asleep
+from random import Random
+from statistics import quantiles, mean
+from time import perf_counter, sleep
+
+from modules.api import OISRankingAPI, DIFF_SECONDS
+from modules.delivery import DeliveryQueue
+from modules.dsdelivery import ChannelFanout
+from modules.profiler import SamplingProfiler, formatSummary
+from benchmarks.judge import StandInJudge
+from benchmarks.synthetic import SyntheticContest
+
+
+class FakeTelegramBot:
+    def __init__(self, rtt: float) -> None:
+        self.rtt = rtt
+        self.sent = 0
+
+    def sendMessage(self, chatId, text, **kwargs):
+        sleep(self.rtt)
+        self.sent += 1
+
+
+class FakeDiscordChannel:
+    def __init__(self, chatId: int, rtt: float) -> None:
+        self.id = chatId
+        self.rtt = rtt
+
+    async def send(self, content=None, embed=None):
+        await asleep(self.rtt)
+
+
+class FakeDiscordBot:
+    def __init__(self, rtt: float) -> None:
+        self.rtt = rtt
+
+    def get_channel(self, chatId: int):
+        return FakeDiscordChannel(chatId, self.rtt)
+
+
+def subscribers(teams, count: int, share: float, seed: int=0) -> dict:
+    # newsType -> team -> chat ids, as sendTeamNews would select them with subscriptions.followers(): every chat
+    # follows one team and turns each kind of news on with probability `share`
+    rng = Random(seed)
+    following = {"rankChanged": {}, "pointsChanged": {}}
+    for chatId in range(count):
+        team = rng.choice(teams)
+        for byTeam in following.values():
+            if rng.random() < share:
+                byTeam.setdefault(team, []).append(chatId)
+    return following
+
+
+def rankMessages(changes) -> dict:
+    # As tgbot's sendLeaderboardNews: only teams whose rank moved
+    messages = {}
+    for team, change in changes.items():
+        gained = change["rankGained"]
+        if gained > 0:
+            messages[team] = f"📈 La squadra <b>{team}</b> è salita di <b>{gained}</b> posizioni!\n" \
+                             f"📊 Rank attuale: {change['rank']}"
+        elif gained < 0:
+            messages[team] = f"📉 La squadra <b>{team}</b> è scesa di <b>{-gained}</b> posizioni.\n" \
+                             f"📊 Rank attuale: {change['rank']}"
+    return messages
+
+
+def pointsMessages(changes) -> dict:
+    # As tgbot's sendLeaderboardNews: only teams whose scores changed
+    messages = {}
+    for team, change in changes.items():
+        message = ""
+        for quest, score, gained in change["scores"]:
+            if gained > 0:
+                message += f"🟢 <code>{quest}</code>: {score}/100 (+{gained})\n"
+            elif gained < 0:
+                message += f"🔴 <code>{quest}</code>: {score}/100 ({gained})\n"
+        if message != "":
+            messages[team] = f"📊 <b>Nuovi punteggi!</b>\n\n{message}"
+    return messages
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--teams", type=int, default=3000)
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=60, help="submissions per contest minute")
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--news-share", type=float, default=0.5,
+                        help="share of the chats subscribed to each kind of news (rank, points)")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=2.0, help="real seconds between refreshes")
+    parser.add_argument("--speed", type=float, default=30.0, help="contest seconds per real second")
+    parser.add_argument("--rtt", type=float, default=0.03, help="fake transport round trip")
+    parser.add_argument("--tg-rate", type=float, default=30, help="Telegram global messages per second")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="sample the first cycles x interval seconds into a collapsed-stack file in DIR")
+    args = parser.parse_args()
+
+    judge = StandInJudge(SyntheticContest(args.teams, args.tasks, args.rate), args.speed)
+    api = OISRankingAPI(baseUrl=judge.serve())
+    following = subscribers(api.teams() or list(judge.source.base["users"]), args.subscribers, args.news_share)
+    telegram = DeliveryQueue(FakeTelegramBot(args.rtt), globalRate=args.tg_rate)
+    discord = ChannelFanout(FakeDiscordBot(args.rtt), concurrency=25)
+    loop = new_event_loop()
+
+    if args.profile:
+        # The main loop and the Telegram delivery workers play the bot's handlers
+        profiler = SamplingProfiler(("main", "_deliver"), args.profile)
+        profiler.start(args.cycles * args.interval, lambda path, summary: print(
+            f"{formatSummary(summary, args.cycles * args.interval)}\n{path}"))
+    print(f"{'cycle':>5} {'refresh ms':>10} {'diff ms':>8} {'changed':>8} {'messages':>8} {'tg drain s':>10} {'ds send s':>9}")
+    for cycle in range(args.cycles):
+        sleep(args.interval)
+        start = perf_counter()
+        diffSpent = DIFF_SECONDS.sum
+        api.refresh()
+        refreshTime = perf_counter() - start
+        diffTime = DIFF_SECONDS.sum - diffSpent
+        changes = api.changes()
+
+        # Rank messages first, then points, as sendLeaderboardNews sends them
+        jobs = [(chatId, text) for newsType, messages in (("rankChanged", rankMessages(changes)),
+                                                          ("pointsChanged", pointsMessages(changes)))
+                for team, text in messages.items() for chatId in following[newsType].get(team, ())]
+        start = perf_counter()
+        for chatId, text in jobs:
+            telegram.send(chatId, text, parse_mode="HTML")
+        telegram.join()
+        drain = perf_counter() - start
+        start = perf_counter()
+        loop.run_until_complete(discord.sendAll((str(chatId), {"content": text}) for chatId, text in jobs))
+        dsTime = perf_counter() - start
+        print(f"{cycle:>5} {refreshTime*1e3:>10.1f} {diffTime*1e3:>8.2f} {len(changes):>8} {len(jobs):>8} "
+              f"{drain:>10.2f} {dsTime:>9.2f}")
+
+    if telegram.latencies:
+        latencies = list(telegram.latencies)
+        p50, p99 = (quantiles(latencies, n=100)[i] for i in (49, 98)) if len(latencies) > 1 else (latencies[0],) * 2
+        print(f"telegram delivery latency: mean {mean(latencies):.2f} s, p50 {p50:.2f} s, p99 {p99:.2f} s")
+    print(f"judge: {judge.requests} requests, {judge.bytesSent/1024:.0f} KiB sent; "
+          f"client: {api.cyclesSkipped} cycles skipped, {api.bytesSaved/1024:.0f} KiB saved")
+    if args.profile:
+        while profiler.running:
+            sleep(0.1)
+    judge.shutdown()
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Local stand-in for judge.science.unitn.it/ranking: serves /teams, /users, /tasks and /scores for a synthetic
+# contest or for one recorded with HistoryStore, with contest time running `speed` times faster than real time.
+# Point the bots at it with "api": {"baseUrl": "http://127.0.0.1:8080"} in settings.json.
+#   python -m benchmarks.judge --teams 3000 --tasks 8 --rate 60 --speed 10
+#   python -m benchmarks.judge --history ../history.bin --speed 30
+from argparse import ArgumentParser
+from gzip import compress
+from hashlib import blake2b
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import dumps
+from threading import Thread, Lock
+from time import monotonic, sleep
+
+from benchmarks.synthetic import SyntheticContest
+
+ENDPOINTS = ("teams", "users", "tasks", "scores")
+
+
+class HistoryReplay:
+    def __init__(self, path: str) -> None:
+        from modules.history import HistoryStore
+        self.store = HistoryStore(path)
+        self.start = self.store.span()[0]
+
+    def state(self, seconds: float) -> dict:
+        snapshot = self.store.at(self.start + seconds)
+        scores = {team: dict(zip(snapshot.questions, partials)) for team, partials in snapshot.partials.items()}
+        return {"teams": {}, "users": dict.fromkeys(snapshot.partials, {}),
+                "tasks": {quest: {"name": quest, "order": pos} for pos, quest in enumerate(snapshot.questions)},
+                "scores": scores}
+
+
+class StandInJudge:
+    def __init__(self, source, speed: float=1.0, latency: float=0.0) -> None:
+        self.source = source
+        self.speed = speed
+        self.latency = latency
+        self.started = monotonic()
+        self.lock = Lock()
+        self.gzipped = {}  # endpoint -> (etag, compressed body) of the last gzip response
+        self.failing = {}  # endpoint -> (status, body) answered instead of the real response
+        self.requests = 0
+        self.bytesSent = 0
+
+    def contestTime(self) -> float:
+        return (monotonic() - self.started) * self.speed
+
+    def body(self, endpoint: str) -> tuple[bytes, str]:
+        with self.lock:
+            payload = self.source.state(self.contestTime())[endpoint]
+            body = dumps(payload).encode()
+            return body, '"' + blake2b(body, digest_size=8).hexdigest() + '"'
+
+    def compressed(self, endpoint: str, body: bytes, etag: str) -> bytes:
+        with self.lock:
+            if self.gzipped.get(endpoint, (None,))[0] != etag:
+                self.gzipped[endpoint] = (etag, compress(body, compresslevel=6))
+            return self.gzipped[endpoint][1]
+
+    def serve(self, host: str="127.0.0.1", port: int=0) -> str:
+        judge = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+                if endpoint not in ENDPOINTS:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if judge.latency:
+                    sleep(judge.latency)
+                if endpoint in judge.failing:
+                    status, body = judge.failing[endpoint]
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body, etag = judge.body(endpoint)
+                judge.requests += 1
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+                if gzip:
+                    body = judge.compressed(endpoint, body, etag)
+                judge.bytesSent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                if gzip:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_port}"
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+
+
+def main():
+    parser = ArgumentParser(description="Local stand-in for the OIS ranking server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--teams", type=int, default=3000)
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=60, help="submissions per contest minute")
+    parser.add_argument("--speed", type=float, default=1.0, help="contest seconds per real second")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--history", help="replay a file written by HistoryStore instead of a synthetic contest")
+    args = parser.parse_args()
+
+    source = HistoryReplay(args.history) if args.history else SyntheticContest(args.teams, args.tasks, args.rate)
+    judge = StandInJudge(source, args.speed, args.latency)
+    print(f"Serving on {judge.serve(args.host, args.port)}")
+    while True:
+        sleep(3600)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# Replays 10k synthetic updates at RATE updates/s (a contest-start burst of /team and /leaderboard plus settings flows)
+# into tgbot.reply and tgbot.button_press, through thread-per-update and through the Dispatcher, reporting peak
+# thread count, p99 latency and ordering violations.
+# tgbot is imported from a temporary directory with its own settings.json: a fresh SQLite database, and the ranking
+# read through SharedRankingAPI from a snapshot published for a synthetic contest, so the judge is never asked. Its
+# Bot is replaced by a fake one that waits RTT per Telegram call; everything else is the real handler path
+# (db_session, ChatCache lookups and flushes, rendering). Every mode uses its own chat ids and a cold ChatCache and
+# RenderCache, like a bot that just started.
+# Latency depends on the pool size: the burst keeps about 35 handlers in flight, and chats pinned to a busy worker
+# wait for it even while others are idle. The p99 is about 5x that of thread-per-update with 32 workers and about
+# 1.5x with 128, the default, which still caps the threads where thread-per-update grows with the burst.
+# Run from the repository root: python -m benchmarks.load_dispatcher
+import importlib
+import os
+import tempfile
+from json import dump, dumps
+from random import Random
+from statistics import quantiles
+from threading import Thread, Lock, active_count
+from time import monotonic, sleep
+
+from modules import render
+from modules.api import RankingView
+from modules.chatcache import ChatCache
+from modules.dispatcher import Dispatcher
+from modules.shared import SnapshotPublisher
+from benchmarks.synthetic import contest
+
+UPDATES = 10000
+CHATS = 2000
+TEAMS = 3000
+TASKS = 8
+RTT = 0.02
+RATE = 1000
+
+
+class FakeTelegram:
+    # The Bot methods the handlers call, each taking one round trip
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.messageId = 0
+
+    def _call(self) -> dict:
+        sleep(RTT)
+        with self.lock:
+            self.messageId += 1
+            return {"message_id": self.messageId}
+
+    def sendMessage(self, chatId, text, **kwargs) -> dict:
+        return self._call()
+
+    def editMessageText(self, msgId, text, **kwargs) -> dict:
+        return self._call()
+
+    def editMessageReplyMarkup(self, msgId, **kwargs) -> dict:
+        return self._call()
+
+
+def loadBot(directory: str):
+    # Publishes the contest where SharedRankingAPI reads it and imports tgbot with settings pointing there
+    data = contest(TEAMS, TASKS)
+    view = RankingView()
+    view._publish(view._store({endpoint: (dumps(payload).encode(), {}) for endpoint, payload in data.items()}))
+    snapshotPath = os.path.join(directory, "snapshot")
+    SnapshotPublisher(snapshotPath).publish(view, running=True)
+    with open(os.path.join(directory, "settings.json"), "w") as file:
+        dump({"telegram": {"token": "0:load-test", "admins": []},
+              "database": {"path": os.path.join(directory, "load.db")},
+              "poller": {"path": snapshotPath}}, file)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        tgbot = importlib.import_module("tgbot")
+    finally:
+        os.chdir(cwd)
+    tgbot.bot = FakeTelegram()
+    tgbot.api.refresh()
+    tgbot.roundStarted = True
+    return tgbot
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.baseline = active_count() - 1
+        self.lock = Lock()
+        self.seen = {}
+        self.outOfOrder = 0
+        self.errors = 0
+        self.latencies = []
+        self.peakThreads = 0
+
+    def handle(self, handler, chatId: int, seq: int, msg: dict, queuedAt: float) -> None:
+        self.peakThreads = max(self.peakThreads, active_count() - self.baseline)
+        with self.lock:
+            if seq < self.seen.get(chatId, -1):
+                self.outOfOrder += 1
+            self.seen[chatId] = seq
+        try:
+            handler(msg)
+        except Exception:
+            self.errors += 1
+        self.latencies.append(monotonic() - queuedAt)
+
+
+def updates(tgbot, firstChat: int):
+    # (handler, chatId, seq, msg): mostly /team and /leaderboard, and the two steps of changing team
+    rng = Random(0)
+    teams = tgbot.api.teams()
+    counters = {}
+    start = monotonic()
+    for num in range(UPDATES):
+        ahead = start + num / RATE - monotonic()
+        if ahead > 0:
+            sleep(ahead)
+        chatId = firstChat + rng.randrange(CHATS)
+        counters[chatId] = counters.get(chatId, 0) + 1
+        kind = rng.choice(["/team", "/leaderboard", "/leaderboard", "/partials", "settings_changeTeam", "team"])
+        if kind == "settings_changeTeam":
+            yield tgbot.button_press, chatId, counters[chatId], {
+                "id": str(num), "from": {"id": chatId}, "data": kind,
+                "message": {"message_id": num, "chat": {"id": chatId}}}
+        else:
+            text = rng.choice(teams) if kind == "team" else kind
+            yield tgbot.reply, chatId, counters[chatId], {
+                "message_id": num, "chat": {"id": chatId}, "from": {"id": chatId, "first_name": "Load"},
+                "text": text}
+
+
+def coldCaches(tgbot) -> None:
+    tgbot.chats.close()
+    tgbot.chats = ChatCache("telegram")
+    tgbot.renders = render.RenderCache()
+
+
+def report(name: str, recorder: Recorder, elapsed: float) -> None:
+    p50, p99 = (quantiles(recorder.latencies, n=100)[i] for i in (49, 98))
+    print(f"{name:<18} {recorder.peakThreads:>12} {p50*1e3:>9.1f} {p99*1e3:>9.1f} {elapsed:>9.2f} "
+          f"{recorder.outOfOrder:>13} {recorder.errors:>7}")
+
+
+def threadPerUpdate(tgbot, firstChat: int) -> None:
+    coldCaches(tgbot)
+    recorder = Recorder()
+    start = monotonic()
+    threads = []
+    for handler, chatId, seq, msg in updates(tgbot, firstChat):
+        thread = Thread(target=recorder.handle, args=[handler, chatId, seq, msg, monotonic()])
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    report("thread-per-update", recorder, monotonic() - start)
+
+
+def pooled(tgbot, firstChat: int, workers: int) -> None:
+    coldCaches(tgbot)
+    recorder = Recorder()
+    dispatcher = Dispatcher(workers=workers)
+    start = monotonic()
+    for handler, chatId, seq, msg in updates(tgbot, firstChat):
+        dispatcher.submit(chatId, recorder.handle, handler, chatId, seq, msg, monotonic())
+    dispatcher.join()
+    report(f"dispatcher x{workers}", recorder, monotonic() - start)
+    print(f"{'':<18} blocked submits={dispatcher.stats['blocked']} max queue depth={dispatcher.stats['maxDepth']}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        tgbot = loadBot(directory)
+        print(f"{UPDATES} updates from {CHATS} chats at {RATE}/s, {TEAMS} teams x {TASKS} tasks, "
+              f"{RTT*1e3:.0f} ms per Telegram call")
+        print(f"{'mode':<18} {'peak threads':>12} {'p50 ms':>9} {'p99 ms':>9} {'total s':>9} {'out of order':>13} "
+              f"{'errors':>7}")
+        threadPerUpdate(tgbot, 0)
+        for num, workers in enumerate((32, 64, 96, 128), 1):
+            pooled(tgbot, num * CHATS, workers)
+        tgbot.chats.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# PollScheduler on a simulated clock: a day with one contest, whose leaderboard changes at a rate that climbs
+# towards the end. Compares the old fixed 60 s loop with the scheduler and reports judge requests outside and during
+# the event, how late the start is noticed, and how stale the leaderboard is when a change is picked up. Checks
+# that no rolling `budgetWindow` ever holds more requests than the budget (plus the initial burst).
+# Run from the repository root: python -m benchmarks.sim_polling --days 1
+from argparse import ArgumentParser
+from bisect import bisect_right
+from collections import deque
+from random import Random
+from statistics import quantiles
+
+from modules.scheduler import PollScheduler
+
+HOUR = 3600
+START = 9 * HOUR + 7 * 60 + 13  # not on a round minute, like a real start
+LENGTH = 5 * HOUR
+FINAL = 30 * 60
+REQUEST_COST = 4
+STATIC_INTERVAL = 900  # RankingView.staticInterval
+
+
+class SimClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FixedInterval:
+    # The old loop: sleep(60) whatever happened
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+
+    def record(self, running: bool, changed: bool=False, requests: int=None) -> float:
+        return self.interval
+
+
+def changeTimes(days: int, rng: Random) -> list:
+    # Leaderboard changes as a Poisson process: 1 per minute for most of the contest, 6 per minute in the final stretch
+    times = []
+    for day in range(days):
+        now = day * 24 * HOUR + START
+        end = now + LENGTH
+        while True:
+            rate = 6 / 60 if now >= end - FINAL else 1 / 60
+            now += rng.expovariate(rate)
+            if now >= end:
+                break
+            times.append(now)
+    return times
+
+
+def running(now: float) -> bool:
+    return START <= now % (24 * HOUR) < START + LENGTH
+
+
+def simulate(scheduler, clock: SimClock, days: int, changes: list, staticCached: bool=False) -> dict:
+    # staticCached: polls during an event fetch /scores only, with all four endpoints every STATIC_INTERVAL (and
+    # whenever no event is running, as the judge fails /scores then)
+    polls, costs = [], []
+    seen = 0  # changes picked up so far
+    lastFull = None
+    while clock.now < days * 24 * HOUR:
+        polls.append(clock.now)
+        event = running(clock.now)
+        cost = REQUEST_COST
+        if not event:
+            lastFull = None
+        elif staticCached and lastFull is not None and clock.now - lastFull < STATIC_INTERVAL:
+            cost = 1
+        else:
+            lastFull = clock.now
+        costs.append(cost)
+        picked = bisect_right(changes, clock.now)
+        delay = scheduler.record(running=event, changed=picked > seen, requests=cost)
+        seen = picked
+        clock.now += delay
+
+    stale, finalStale, detections = [], [], []
+    for change in changes:
+        pickedAt = polls[bisect_right(polls, change)] if bisect_right(polls, change) < len(polls) else clock.now
+        (finalStale if (change - START) % (24 * HOUR) >= LENGTH - FINAL else stale).append(pickedAt - change)
+    for day in range(days):
+        start = day * 24 * HOUR + START
+        detections.append(polls[bisect_right(polls, start - 1e-9)] - start)
+
+    inside = sum(cost for poll, cost in zip(polls, costs) if running(poll))
+    window, inWindow, peak = deque(), 0, 0
+    for poll, cost in zip(polls, costs):
+        window.append((poll, cost))
+        inWindow += cost
+        while window[0][0] <= poll - HOUR:
+            inWindow -= window.popleft()[1]
+        peak = max(peak, inWindow)
+    return {"idleRequests": sum(costs) - inside, "eventRequests": inside, "peakHour": peak,
+            "detection": max(detections), "stale": stale, "finalStale": finalStale}
+
+
+def percentile(values: list, pct: int) -> float:
+    return quantiles(values, n=100)[pct - 1] if len(values) > 1 else 0.0
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    changes = changeTimes(args.days, Random(args.seed))
+    print(f"{args.days} day(s), contest of {LENGTH // HOUR} h, {len(changes)} leaderboard "
+          f"changes, {REQUEST_COST} requests per poll unless /scores only")
+    print(f"{'':>24} {'idle req':>9} {'event req':>10} {'peak req/h':>11} {'start s':>8} {'stale p50':>10} "
+          f"{'p95':>6} {'final p50':>10} {'p95':>6}")
+
+    cases = [("fixed 60 s", None, False), ("adaptive", {}, False), ("adaptive, budget 480/h", {"budget": 480}, False),
+             ("adaptive, fast 5 s", {"fastInterval": 5}, False), ("adaptive, /scores only", {}, True)]
+    for label, options, staticCached in cases:
+        clock = SimClock()
+        if options is None:
+            scheduler = FixedInterval(60)
+        else:
+            scheduler = PollScheduler(requestCost=REQUEST_COST, clock=clock, **options)
+        result = simulate(scheduler, clock, args.days, changes, staticCached)
+        if options is not None:
+            assert result["peakHour"] <= scheduler.rate * HOUR + scheduler.burst + REQUEST_COST, result["peakHour"]
+        print(f"{label:>24} {result['idleRequests']:>9} {result['eventRequests']:>10} {result['peakHour']:>11} "
+              f"{result['detection']:>8.0f} {percentile(result['stale'], 50):>10.1f} "
+              f"{percentile(result['stale'], 95):>6.1f} {percentile(result['finalStale'], 50):>10.1f} "
+              f"{percentile(result['finalStale'], 95):>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
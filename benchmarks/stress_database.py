@@ -0,0 +1,174 @@
+# Concurrency stress test for the SQLite storage layer: two processes (tgbot and dsbot sharing the database file),
+# each with handler threads that read a chat and sometimes change its status, threads that run notification
+# targeting queries, and a broadcast-style writer. Runs the same load three times:
+#   rollback: the old setup (rollback journal, default synchronous, 5 s busy timeout), one transaction per write
+#   wal:      PRAGMAS from modules/database.py, one transaction per write
+#   wal+cache: PRAGMAS, status writes grouped by ChatCache's flush
+# and reports write latency (time to commit, including waiting for locks) and "database is locked" errors.
+# Run from the repository root: python -m benchmarks.stress_database --seconds 10
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from random import Random
+from statistics import quantiles
+from tempfile import mkdtemp
+from threading import Thread, Event, Lock
+from time import perf_counter, sleep
+
+MODES = ("rollback", "wal", "wal+cache")
+CHATS = 20000
+TEAMS = 300
+
+
+def configure(mode: str, path: str) -> None:
+    from modules import database
+    if mode == "rollback":
+        database.PRAGMAS = {"journal_mode": "DELETE"}
+        database.BUSY_TIMEOUT = 5
+    database.connect(path)
+
+
+def seed(mode: str, path: str) -> None:
+    configure(mode, path)
+    from pony.orm import db_session
+    from modules.database import db, BroadcastJob
+    from modules import subscriptions
+    with db_session:
+        db.get_connection().executemany(
+            'INSERT INTO "TGUser" ("chatId", "status", "teamName", "news") VALUES (?, ?, ?, ?)',
+            [(chatId, "normal", f"team{chatId % TEAMS}", '["eventStart","rankChanged","pointsChanged"]')
+             for chatId in range(CHATS)])
+        # One job per bot process, like tgbot and dsbot each advancing their own broadcast
+        for platform in ("telegram", "discord"):
+            BroadcastJob(platform=platform, text="stress", adminChat="0", cursor=0)
+    subscriptions.migrateNews("telegram")
+
+
+def worker(mode: str, path: str, seconds: float, seed: int) -> dict:
+    configure(mode, path)
+    from pony.orm import db_session
+    from modules.database import TGUser, BroadcastJob
+    from modules import subscriptions
+    from modules.chatcache import ChatCache
+
+    stop = Event()
+    lock = Lock()
+    result = {"writes": [], "errors": 0, "reads": 0, "targeting": 0}
+    chats = ChatCache("telegram", flushInterval=2.0) if mode == "wal+cache" else None
+
+    def timedWrite(fn) -> None:
+        start = perf_counter()
+        try:
+            fn()
+        except Exception as error:
+            with lock:
+                result["errors"] += 1
+            if "locked" not in str(error):
+                raise
+            return
+        with lock:
+            result["writes"].append(perf_counter() - start)
+
+    def handler(num: int) -> None:
+        rng = Random(seed * 100 + num)
+        while not stop.is_set():
+            chatId = rng.randrange(CHATS)
+            if chats is not None:
+                user = chats.get(chatId)
+                if rng.random() < 0.3:
+                    user.status = "calling_support" if user.status == "normal" else "normal"
+            else:
+                with db_session:
+                    status = TGUser[chatId].status
+                if rng.random() < 0.3:
+                    @db_session
+                    def write():
+                        user = TGUser[chatId]
+                        user.status = "calling_support" if status == "normal" else "normal"
+                    timedWrite(write)
+            with lock:
+                result["reads"] += 1
+            sleep(0.002)
+
+    def targeting(num: int) -> None:
+        rng = Random(seed * 1000 + num)
+        while not stop.is_set():
+            subscriptions.followers("telegram", "pointsChanged", [f"team{rng.randrange(TEAMS)}" for _ in range(50)])
+            with lock:
+                result["targeting"] += 1
+            sleep(0.01)
+
+    def broadcaster() -> None:
+        @db_session
+        def advance():
+            job = BroadcastJob[seed % 2 + 1]
+            job.cursor += 1
+            job.sent += 1
+        while not stop.is_set():
+            timedWrite(advance)
+            sleep(0.05)
+
+    threads = [Thread(target=handler, args=[num]) for num in range(8)]
+    threads += [Thread(target=targeting, args=[num]) for num in range(2)]
+    threads.append(Thread(target=broadcaster))
+    for thread in threads:
+        thread.start()
+    sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if chats is not None:
+        # Each flush is one grouped write: time it like the others
+        timedWrite(chats.flush)
+        result["flushed"] = chats.stats["written"]
+    return result
+
+
+def run(mode: str, seconds: float, processes: int) -> dict:
+    path = os.path.join(mkdtemp(), "stress.db")
+    command = [sys.executable, "-m", "benchmarks.stress_database"]
+    subprocess.run(command + ["--seed", mode, path], check=True)
+    children = [subprocess.Popen(command + ["--worker", mode, path, str(seconds), str(num)], stdout=subprocess.PIPE)
+                for num in range(processes)]
+    merged = {"writes": [], "errors": 0, "reads": 0, "targeting": 0, "flushed": 0}
+    for child in children:
+        output, _ = child.communicate()
+        for key, value in json.loads(output).items():
+            merged[key] += value
+    return merged
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--processes", type=int, default=2, choices=[1, 2])
+    parser.add_argument("--seed", nargs=2, metavar=("MODE", "PATH"))
+    parser.add_argument("--worker", nargs=4, metavar=("MODE", "PATH", "SECONDS", "SEED"))
+    args = parser.parse_args()
+    if args.seed:
+        seed(*args.seed)
+        return
+    if args.worker:
+        mode, path, seconds, num = args.worker
+        print(json.dumps(worker(mode, path, float(seconds), int(num))))
+        return
+
+    print(f"{args.processes} processes x (8 handler threads, 2 targeting threads, 1 broadcast writer), "
+          f"{args.seconds:.0f} s per mode")
+    print(f"{'mode':>10} {'reads':>7} {'targeting':>9} {'writes':>7} {'locked':>7} {'p50 ms':>7} {'p99 ms':>8} "
+          f"{'max ms':>8} {'>1 s':>5}")
+    for mode in MODES:
+        result = run(mode, args.seconds, args.processes)
+        writes = sorted(result["writes"])
+        p50, p99 = (quantiles(writes, n=100)[i] for i in (49, 98)) if len(writes) > 1 else (0.0, 0.0)
+        print(f"{mode:>10} {result['reads']:>7} {result['targeting']:>9} {len(writes):>7} {result['errors']:>7} "
+              f"{p50*1e3:>7.1f} {p99*1e3:>8.1f} {max(writes, default=0)*1e3:>8.1f} "
+              f"{sum(1 for write in writes if write > 1):>5}")
+        if mode == "wal+cache":
+            print(f"{'':>10} status changes written by ChatCache flushes: {result['flushed']}")
+
+
+if __name__ == "__main__":
+    main()
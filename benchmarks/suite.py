@@ -0,0 +1,132 @@
+# Microbenchmarks for the hot paths of modules/api.py, the message renderers and the helpers, on synthetic contests.
+# Run from the repository root:
+#   python -m benchmarks.suite --output results.json          # run and save
+#   python -m benchmarks.suite --compare base.json new.json   # flag regressions between two runs
+from argparse import ArgumentParser
+from copy import deepcopy
+from datetime import datetime
+from json import dump, load
+from platform import python_version
+from random import Random
+from sys import exit
+from timeit import Timer
+
+from modules import helpers, render, metrics
+from modules.api import OISRankingAPI, Snapshot, diffSnapshots
+from benchmarks.synthetic import contest
+
+TEAMS = [100, 1000, 10000]
+TASKS = [5, 15, 30]
+
+
+def loadedApi(data: dict) -> OISRankingAPI:
+    changed = deepcopy(data)
+    rng = Random(1)
+    for team in rng.sample(list(changed["users"]), max(1, len(changed["users"]) // 50)):
+        changed["scores"].setdefault(team, {})[rng.choice(list(changed["tasks"]))] = 100.0
+    api = OISRankingAPI.__new__(OISRankingAPI)
+    api.oldSnapshot = Snapshot(data, 1)
+    api.snapshot = Snapshot(changed, 2)
+    return api
+
+
+def timed(histogram: metrics.Histogram) -> None:
+    with histogram.time():
+        pass
+
+
+def cases(data: dict):
+    api = loadedApi(data)
+    teams = api.teams()
+    middle = teams[len(teams) // 2]
+    quest = api.questions()[-1]
+    midPage = max(1, len(teams) // 20)
+    renders = render.RenderCache()
+    counter = metrics.counter("suite_total", "Benchmark counter")
+    histogram = metrics.histogram("suite_seconds", "Benchmark histogram")
+    return {
+        "snapshot.build": lambda: Snapshot(data),
+        "snapshot.diff": lambda: diffSnapshots(api.oldSnapshot, api.snapshot),
+        "api.teams": lambda: api.teams(),
+        "api.questions": lambda: api.questions(),
+        "api.teamInfo": lambda: api.teamInfo(middle),
+        "api.teamInfo.old": lambda: api.teamInfo(middle, oldData=True),
+        "api.getTeamPartial": lambda: api.getTeamPartial(middle, quest),
+        "render.leaderboard": lambda: render.leaderboard(api, 1),
+        "render.leaderboard.mid": lambda: render.leaderboard(api, midPage),
+        "render.leaderboardColumns": lambda: render.leaderboardColumns(api, 1),
+        "render.top": lambda: render.top(api, middle),
+        "render.topColumns": lambda: render.topColumns(api, middle),
+        "render.team": lambda: render.team(api, middle),
+        "render.partials": lambda: render.partials(api, middle),
+        "render.partialsColumns": lambda: render.partialsColumns(api, middle),
+        "renderCache.leaderboard": lambda: renders.get(api, render.leaderboard, midPage),
+        "renderCache.partials": lambda: renders.get(api, render.partials, middle),
+        "helpers.getStatIcon": lambda: helpers.getStatIcon(75.0),
+        "helpers.getRankIcon": lambda: helpers.getRankIcon(42),
+        # Cost of recording one event, to compare against the work it measures
+        "metrics.counter": counter.inc,
+        "metrics.observe": lambda: histogram.observe(0.003),
+        "metrics.timer": lambda: timed(histogram),
+    }
+
+
+def measure(fn, repeat: int=5) -> float:
+    # Best of `repeat` runs, in nanoseconds per call
+    timer = Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def run(teamSizes, taskSizes) -> dict:
+    results = {}
+    for teamCount in teamSizes:
+        for taskCount in taskSizes:
+            data = contest(teamCount, taskCount)
+            for name, fn in cases(data).items():
+                key = f"{name}|{teamCount}|{taskCount}"
+                results[key] = {"case": name, "teams": teamCount, "tasks": taskCount, "ns": measure(fn)}
+                print(f"{name:<28} {teamCount:>6} teams {taskCount:>3} tasks {results[key]['ns']:>14.0f} ns")
+    return results
+
+
+def compare(basePath: str, newPath: str, threshold: float) -> int:
+    with open(basePath) as file:
+        base = load(file)["results"]
+    with open(newPath) as file:
+        new = load(file)["results"]
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        ratio = new[key]["ns"] / base[key]["ns"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "faster"
+        print(f"{key:<44} {base[key]['ns']:>14.0f} {new[key]['ns']:>14.0f} {ratio:>7.2f}x {flag}")
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--teams", type=int, nargs="+", default=TEAMS)
+    parser.add_argument("--tasks", type=int, nargs="+", default=TASKS)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        exit(compare(*args.compare, args.threshold))
+
+    results = run(args.teams, args.tasks)
+    with open(args.output, "w") as file:
+        dump({"python": python_version(), "date": datetime.now().isoformat(timespec="seconds"),
+              "results": results}, file, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from random import Random
+
+
+def contest(teamCount: int, taskCount: int, seed: int=0) -> dict:
+    rng = Random(seed)
+    tasks = {f"task{t}": {"name": f"task{t}", "order": t, "max_score": 100} for t in range(taskCount)}
+    users = {f"team{u}": {"f_name": f"Team {u}", "l_name": "", "team": None} for u in range(teamCount)}
+    scores = {}
+    for user in users:
+        solved = {task: float(rng.choice([0, 10, 30, 50, 70, 100])) for task in tasks if rng.random() < 0.7}
+        if solved:
+            scores[user] = solved
+    return {"teams": {}, "users": users, "tasks": tasks, "scores": scores}
+
+
+class SyntheticContest:
+    # A contest that starts with every team at 0 and evolves with a steady submission rate.
+    # state(seconds) is deterministic: the same contest time always gives the same leaderboard.
+    def __init__(self, teamCount: int, taskCount: int, submissionsPerMinute: float=60, seed: int=0) -> None:
+        self.base = contest(teamCount, taskCount, seed)
+        self.base["scores"] = {}
+        self.submissionsPerMinute = submissionsPerMinute
+        self.rng = Random(seed)
+        self.applied = 0
+        self.teams = list(self.base["users"])
+        self.tasks = list(self.base["tasks"])
+
+    def state(self, seconds: float) -> dict:
+        target = int(seconds / 60 * self.submissionsPerMinute)
+        scores = self.base["scores"]
+        while self.applied < target:
+            team = self.rng.choice(self.teams)
+            task = self.rng.choice(self.tasks)
+            scores.setdefault(team, {})[task] = max(scores.get(team, {}).get(task, 0.0),
+                                                    float(self.rng.choice([10, 20, 30, 50, 70, 100])))
+            self.applied += 1
+        return self.base
@@ -1,24 +1,61 @@
 # Python Libraries
 import discord
-from discord.ext import commands, tasks
-from pony.orm import db_session, select
+from discord.ext import commands
+from pony.orm import db_session
 from json import load as jsload
+from functools import wraps
+from asyncio import Lock, sleep as asleep, run_coroutine_threadsafe
+from time import perf_counter
+from traceback import print_exc
 
 # Custom Modules
-from modules import helpers
-from modules.database import DSChat
-from modules.api import OISRankingAPI, NoEventRunning, TeamNameError
+from modules import broadcast as broadcasts, render, subscriptions, metrics
+from modules.database import connect
+from modules.api import NoEventRunning, TeamNameError
+from modules.asyncapi import AsyncOISRankingAPI
+from modules.history import HistoryStore
+from modules.shared import AsyncSharedRankingAPI
+from modules.dsdelivery import ChannelFanout
+from modules.chatcache import ChatCache
+from modules.scheduler import PollScheduler
+from modules.profiler import SamplingProfiler, formatSummary, MAX_SECONDS
 
 with open("settings.json") as settings_file:
     js_settings = jsload(settings_file)
 
+connect(js_settings.get("database", {}).get("path"))
 bot = commands.Bot(command_prefix='!')
 bot.remove_command("help")
 adminIds = js_settings["discord"]["admins"]
-api = OISRankingAPI()
+if "poller" in js_settings:
+    api = AsyncSharedRankingAPI(js_settings["poller"]["path"])
+else:
+    history = HistoryStore(js_settings["history"]["path"]) if "history" in js_settings else None
+    api = AsyncOISRankingAPI(history, js_settings.get("api", {}).get("baseUrl"))
+# Each poll is charged the judge requests its refresh made (api.requestsMade): none when reading the poller's file
+scheduler = PollScheduler(**js_settings.get("polling", {}))
+fanout = ChannelFanout(bot)
+renders = render.RenderCache()
+chats = ChatCache("discord")
+runningBroadcasts = set()
 roundStarted = False
+refreshing = Lock()
+pollTask = None
+REFRESH_SECONDS = metrics.histogram("refresh_seconds", "Time for api.refresh()")
+
+if "discord" in js_settings.get("metrics", {}):
+    metrics.gauges("delivery", "Discord fan-out counters", lambda: fanout.stats, "outcome")
+    metrics.gauges("render_cache", "Rendered message cache counters", renders.stats, "stat")
+    metrics.gauges("chat_cache", "Chat settings cache counters", lambda: chats.stats, "stat")
+    metrics.gauges("scheduler", "Refresh scheduler counters", lambda: scheduler.stats, "stat")
+    metrics.gauges("api", "Refresh counters", lambda: {"version": api.snapshot.version,
+                                                       "cyclesSkipped": api.cyclesSkipped,
+                                                       "bytesSaved": api.bytesSaved}, "stat")
+    metrics.serve(js_settings["metrics"]["discord"], js_settings["metrics"].get("host", "127.0.0.1"))
 
 def async_db_session(fn):
+    # wraps: the profiler tells the commands apart by the name of command.callback
+    @wraps(fn)
     async def callback(*args, **kwargs):
         with db_session():
             return await fn(*args, **kwargs)
@@ -32,114 +69,218 @@ def parseHTML(text: str):
     text = text.replace("<code>", "`").replace("</code>", "`")
     return text
 
-@db_session
+# Views cached by `renders`: what leaderboard, top, team and partials send, as an embed or as Markdown text
+def leaderboardEmbed(api):
+    leftColumn, rightColumn = render.leaderboardColumns(api)
+    embedVar = discord.Embed(title="🏆 Leaderboard", color=0x277ecd)
+    embedVar.add_field(name="Team", value=leftColumn, inline=True)
+    embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
+    return embedVar
+
+def topEmbed(api, teamName: str):
+    leftColumn, rightColumn = render.topColumns(api, teamName)
+    embedVar = discord.Embed(title="🏆 Top Teams", color=0x277ecd)
+    embedVar.add_field(name="Team", value=leftColumn, inline=True)
+    embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
+    return embedVar
+
+def teamEmbed(api, teamName: str):
+    leftColumn, rightColumn = render.teamColumns(api, teamName)
+    embedVar = discord.Embed(title="👥 Info Team", color=0x277ecd)
+    embedVar.add_field(name="Info", value=leftColumn, inline=True)
+    embedVar.add_field(name="Value", value=rightColumn, inline=True)
+    embedVar.add_field(name="Punteggi problemi",
+                       value="Usa !partials per vedere i punteggi singoli dei quesiti.", inline=False)
+    return embedVar
+
+def partialsEmbed(api, teamName: str):
+    leftColumn, rightColumn = render.partialsColumns(api, teamName)
+    embedVar = discord.Embed(title="👥 Team: {}".format(teamName), color=0x277ecd)
+    embedVar.add_field(name="Problemi", value=leftColumn, inline=True)
+    embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
+    return embedVar
+
+def leaderboardText(api):
+    return parseHTML(render.leaderboard(api))
+
+def topText(api, teamName: str):
+    return parseHTML(render.top(api, teamName))
+
+def teamText(api, teamName: str):
+    return parseHTML(render.team(api, teamName, prefix="!"))
+
+def partialsText(api, teamName: str):
+    return parseHTML(render.partials(api, teamName))
+
+def notifyTimer(newsType: str) -> metrics.Timer:
+    return metrics.histogram("notification_seconds",
+                             "Time to select the recipients of one kind of notification and send it",
+                             type=newsType).time()
+
 def parseContext(ctx):
     server = ctx.guild
     channel = ctx.channel
     user = ctx.author
     message = ctx.message
+    dbChat = chats.get(str(channel.id))
 
-    if not DSChat.exists(lambda c: c.chatId == str(channel.id)):
-        DSChat(chatId=str(channel.id))
-    dbChatId = DSChat.get(chatId=str(channel.id)).id
-
-    return server, channel, user, message, dbChatId
+    return server, channel, user, message, dbChat
 
 @async_db_session
 async def sendRoundStarted():
     if not api.debug:
-        channels = select(ch for ch in DSChat if "eventStart" in ch.news)[:]
-        for channel in channels:
-            chat = bot.get_channel(int(channel.chatId))
-            await chat.send(parseHTML("🔔 <b>Gara iniziata!</b>\n"
-                                      "La classifica è attiva, puoi visualizzare le informazioni della tua squadra con !team.\n"
-                                      "Buona fortuna!"))
+        with notifyTimer("eventStart"):
+            channels = subscriptions.followers("discord", "eventStart")
+            text = parseHTML("🔔 <b>Gara iniziata!</b>\n"
+                             "La classifica è attiva, puoi visualizzare le informazioni della tua squadra con !team.\n"
+                             "Buona fortuna!")
+            await fanout.sendAll((chatId, {"content": text}) for chatId, _, _ in channels)
 
 @async_db_session
 async def sendLeaderboardNews():
+    changes = api.changes()
+    if not changes:
+        return
+
     # Send team rank changed
-    teams = api.teams()
-    channels = select(ch for ch in DSChat if ("rankChanged" in ch.news) and (ch.teamName in teams))[:]
-    for channel in channels:
-        teamInfo = api.teamInfo(channel.teamName)
-        prevTeamInfo = api.teamInfo(channel.teamName, oldData=True)
-        newRank = teamInfo["rank"]
-        oldRank = prevTeamInfo["rank"]
-        gained = oldRank - newRank
-        chat = bot.get_channel(int(channel.chatId))
+    messages = {}
+    for team, change in changes.items():
+        gained = change["rankGained"]
         if gained > 0:
-            if channel.viewEmbed:
-                embedVar = discord.Embed(title="📊 Nuova posizione in classifica!",
-                                         description="📈 La squadra {} è salita di {} posizioni!\n"
-                                                     "📊 Rank attuale: {}".format(teamInfo["name"], gained, newRank),
-                                         color=0x277ecd)
-                await chat.send(embed=embedVar)
-            else:
-                await chat.send(parseHTML("📈 La squadra <b>{}</b> è salita di <b>{}</b> posizioni!\n"
-                                          "📊 Rank attuale: {}".format(teamInfo["name"], gained, newRank)))
+            description = "📈 La squadra {} è salita di {} posizioni!\n" \
+                          "📊 Rank attuale: {}".format(team, gained, change["rank"])
+            text = "📈 La squadra <b>{}</b> è salita di <b>{}</b> posizioni!\n" \
+                   "📊 Rank attuale: {}".format(team, gained, change["rank"])
         elif gained < 0:
-            if channel.viewEmbed:
-                embedVar = discord.Embed(title="📊 Nuova posizione in classifica!",
-                                         description="📉 La squadra {} è scesa di {} posizioni.\n"
-                                                     "📊 Rank attuale: {}".format(teamInfo["name"], -gained, newRank),
-                                         color=0x277ecd)
-                await chat.send(embed=embedVar)
-            else:
-                await chat.send(parseHTML("📉 La squadra <b>{}</b> è scesa di <b>{}</b> posizioni.\n"
-                                          "📊 Rank attuale: {}".format(teamInfo["name"], -gained, newRank)))
+            description = "📉 La squadra {} è scesa di {} posizioni.\n" \
+                          "📊 Rank attuale: {}".format(team, -gained, change["rank"])
+            text = "📉 La squadra <b>{}</b> è scesa di <b>{}</b> posizioni.\n" \
+                   "📊 Rank attuale: {}".format(team, -gained, change["rank"])
+        else:
+            continue
+        messages[team] = (discord.Embed(title="📊 Nuova posizione in classifica!", description=description,
+                                        color=0x277ecd), parseHTML(text))
+    await sendTeamNews("rankChanged", messages)
 
     # Send team points changed
-    channels = select(ch for ch in DSChat if ("pointsChanged" in ch.news) and (ch.teamName in teams))[:]
-    for channel in channels:
-        if channel.viewEmbed:
-            leftColumn = ""
-            rightColumn = ""
-            for quest in api.questions():
-                score = api.getTeamPartial(channel.teamName, quest)
-                oldScore = api.getTeamPartial(channel.teamName, quest, oldData=True)
-                gained = score - oldScore
-                if gained > 0:
-                    leftColumn += "🟢 {}:\n".format(quest)
-                    rightColumn += "{}/100 (+{})\n".format(score, gained)
-                elif gained < 0:
-                    leftColumn += "🔴 {}:\n".format(quest)
-                    rightColumn += "{}/100 (-{})\n".format(score, -gained)
-            if leftColumn != "":
-                chat = bot.get_channel(int(channel.chatId))
-                embedVar = discord.Embed(title="📊 Nuovi punteggi!", color=0x277ecd)
-                embedVar.add_field(name="Quesito", value=leftColumn, inline=True)
-                embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
-                await chat.send(embed=embedVar)
-        else:
-            message = ""
-            for quest in api.questions():
-                score = api.getTeamPartial(channel.teamName, quest)
-                oldScore = api.getTeamPartial(channel.teamName, quest, oldData=True)
-                gained = score - oldScore
-                if gained > 0:
-                    message += "🟢 <code>{}:</code> {}/100 (+{})\n".format(quest, score, gained)
-                elif gained < 0:
-                    message += "🔴 <code>{}:</code> {}/100 (-{})\n".format(quest, score, -gained)
-            if message != "":
-                chat = bot.get_channel(int(channel.chatId))
-                await chat.send(parseHTML("📊 <b>Nuovi punteggi!</b>\n\n" + message))
-
-@tasks.loop(minutes=1.0)
-async def runUpdates():
-    global roundStarted
+    messages = {}
+    for team, change in changes.items():
+        leftColumn = ""
+        rightColumn = ""
+        message = ""
+        for quest, score, gained in change["scores"]:
+            if gained > 0:
+                leftColumn += "🟢 {}:\n".format(quest)
+                rightColumn += "{}/100 (+{})\n".format(score, gained)
+                message += "🟢 <code>{}:</code> {}/100 (+{})\n".format(quest, score, gained)
+            elif gained < 0:
+                leftColumn += "🔴 {}:\n".format(quest)
+                rightColumn += "{}/100 (-{})\n".format(score, -gained)
+                message += "🔴 <code>{}:</code> {}/100 (-{})\n".format(quest, score, -gained)
+        if message != "":
+            embedVar = discord.Embed(title="📊 Nuovi punteggi!", color=0x277ecd)
+            embedVar.add_field(name="Quesito", value=leftColumn, inline=True)
+            embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
+            messages[team] = (embedVar, parseHTML("📊 <b>Nuovi punteggi!</b>\n\n" + message))
+    await sendTeamNews("pointsChanged", messages)
+
+async def sendTeamNews(newsType: str, messages: dict):
+    # Fan out the (embed, text) pair rendered once per changed team to the channels following it
+    if not messages:
+        return
+    with notifyTimer(newsType):
+        channels = subscriptions.followers("discord", newsType, messages)
+        await fanout.sendAll((chatId, {"embed": messages[teamName][0]} if viewEmbed else {"content": messages[teamName][1]})
+                             for chatId, teamName, viewEmbed in channels)
+
+async def runBroadcast(jobId: int):
+    # Pages through the recipients, saving the cursor after each page so a restart resumes where it stopped
+    if jobId in runningBroadcasts:
+        return
+    runningBroadcasts.add(jobId)
     try:
-        api.refresh()
-        # At this point, an event is running
-        if not roundStarted:
-            await sendRoundStarted()
-        else:
-            await sendLeaderboardNews()
-        roundStarted = True
-    except NoEventRunning:
-        roundStarted = False
+        await broadcastPages(jobId)
+    except Exception:
+        # Run as a bare task: nobody else would report it. The job resumes from its cursor when started again.
+        print_exc()
+    finally:
+        runningBroadcasts.discard(jobId)
+
+async def broadcastPages(jobId: int):
+    job = broadcasts.loadJob(jobId)
+    rate = broadcasts.ProgressRate(job)
+    adminChat = bot.get_channel(int(job["adminChat"]))
+    progressMessage = None
+    if adminChat is not None:
+        try:
+            if job["progressMessage"]:
+                progressMessage = await adminChat.fetch_message(int(job["progressMessage"]))
+            else:
+                progressMessage = await adminChat.send(parseHTML(broadcasts.progressText(job, 0)))
+                broadcasts.setProgressMessage(jobId, progressMessage.id)
+        except discord.HTTPException:
+            pass
+
+    page = broadcasts.nextPage(jobId)
+    while page:
+        sent, failed = await fanout.sendAll((target, {"content": job["text"]}) for _, target in page)
+        job = broadcasts.advance(jobId, page[-1][0], sent, failed)
+        await editProgress(progressMessage, job, rate)
+        page = broadcasts.nextPage(jobId)
+
+    job = broadcasts.finish(jobId)
+    await editProgress(progressMessage, job, rate)
+
+async def editProgress(progressMessage, job: dict, rate):
+    if progressMessage is not None:
+        try:
+            await progressMessage.edit(content=parseHTML(broadcasts.progressText(job, rate(job))))
+        except discord.HTTPException:
+            # Deleted or not editable: the broadcast goes on all the same
+            pass
+
+async def runUpdates() -> float:
+    # Returns how long to wait before the next refresh
+    global roundStarted
+    async with refreshing:
+        try:
+            with REFRESH_SECONDS.time():
+                changed = await api.refresh()
+            # At this point, an event is running
+            if not roundStarted:
+                await sendRoundStarted()
+            elif changed:
+                with notifyTimer("leaderboard"):
+                    await sendLeaderboardNews()
+            roundStarted = True
+        except NoEventRunning:
+            roundStarted = False
+            return scheduler.record(running=False, requests=api.requestsMade)
+        except Exception:
+            # The judge answered but notifying failed: still a poll, paced and charged like any other
+            print_exc()
+            return scheduler.record(running=True, requests=api.requestsMade)
+        return scheduler.record(running=True, changed=changed, requests=api.requestsMade)
+
+async def pollUpdates():
+    # Started once by on_ready; waits between refreshes as long as the scheduler says
+    while True:
+        try:
+            delay = await runUpdates()
+        except Exception:
+            print_exc()
+            delay = scheduler.interval
+        await asleep(delay)
 
 @bot.event
 async def on_ready():
+    global pollTask
+    subscriptions.migrateNews("discord")
+    for pendingJob in broadcasts.pendingJobs("discord"):
+        bot.loop.create_task(runBroadcast(pendingJob))
+    # on_ready runs again after every reconnect
+    if pollTask is None:
+        pollTask = bot.loop.create_task(pollUpdates())
     await bot.change_presence(
         activity=discord.Game(name="Type !help"),
         status=discord.Status.online
@@ -147,15 +288,27 @@ async def on_ready():
 
 @bot.event
 async def on_command_error(ctx, error):
+    metrics.counter("command_errors_total", "Handlers of a command that raised",
+                    command=ctx.command.name if ctx.command else "other").inc()
     await ctx.send(parseHTML("<code>An internal error occurred while running this command.</code>"))
     print(error)
 
+@bot.before_invoke
+async def startCommandTimer(ctx):
+    ctx.started = perf_counter()
+
+@bot.after_invoke
+async def stopCommandTimer(ctx):
+    # Called whether the command succeeded or raised
+    metrics.histogram("command_seconds", "Time to handle a command",
+                      command=ctx.command.name).observe(perf_counter() - ctx.started)
+
 
 ## COMMANDS ##
 
 @bot.command(name="start")
 async def start(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     statusString = "🟢 <i>La gara è iniziata! Cosa aspetti?</i>" if roundStarted else "🔴 <i>Attualmente nessuna competizione è in corso.</i>"
     await channel.send(parseHTML("Bentornato, <b>{}</b>!\n"
                                  "{}\n\n"
@@ -164,8 +317,7 @@ async def start(ctx):
 @bot.command(name="about")
 @async_db_session
 async def about(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.viewEmbed:
         embedVar = discord.Embed(title="ℹ️ Informazioni sul bot", color=0x277ecd)
         embedVar.add_field(name="Info", value="OISRankingBot è un bot creato e sviluppato da Filippo Pesavento, che ti permette "
@@ -186,8 +338,7 @@ async def about(ctx):
 @bot.command(name="help")
 @async_db_session
 async def help(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.viewEmbed:
         embedVar = discord.Embed(title="Help Menu",
                                  description="Ciao, serve aiuto? 👋🏻\n"
@@ -225,8 +376,7 @@ async def help(ctx):
 @bot.command(name="settings")
 @async_db_session
 async def settings(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.viewEmbed:
         embedVar = discord.Embed(title="🛠 Impostazioni",
                                  description="Per adesso, usa questi comandi per cambiare le impostazioni di questa chat.",
@@ -261,63 +411,64 @@ async def settings(ctx):
 
 @bot.command(name="debug")
 async def debug(ctx, *, active: bool=True):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if str(user.id) in adminIds:
         api.debug = active
         await channel.send(parseHTML("✅ Modalità debug {}!".format("attivata" if active else "disattivata")))
 
+@bot.command(name="profile")
+async def profile(ctx, seconds: int=60):
+    server, channel, user, message, dbChat = parseContext(ctx)
+    if str(user.id) in adminIds:
+        seconds = max(1, min(seconds, MAX_SECONDS))
+
+        def profiled(path: str, summary: dict):
+            # Called from the profiler thread
+            run_coroutine_threadsafe(channel.send(f"{formatSummary(summary, seconds)}\n\n📄 {path}"), bot.loop)
+
+        if profiler.start(seconds, profiled):
+            await channel.send(parseHTML(f"⏱ Profilazione in corso per {seconds} secondi..."))
+        else:
+            await channel.send(parseHTML("❌ Una profilazione è già in corso."))
+
 @bot.command(name="forcerefresh")
 async def forcerefresh(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if str(user.id) in adminIds:
-        try:
-            runUpdates.start()
-            await channel.send(parseHTML("✅ Dati classifica aggiornati!"))
-        except RuntimeError:
+        if refreshing.locked():
             await channel.send(parseHTML("❌ La classifica si stava già aggiornando."))
+        else:
+            await runUpdates()
+            await channel.send(parseHTML("✅ Dati classifica aggiornati!"))
 
 @bot.command(name="broadcast")
 @async_db_session
 async def broadcast(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     text = message.content.split(" ", 1)[1]
     if str(user.id) in adminIds:
-        channels = select(ch for ch in DSChat)[:]
-        for ch in channels:
-            chat = bot.get_channel(int(ch.chatId))
-            await chat.send(parseHTML("📢 <b>Annuncio globale</b>\n\n{}".format(text)))
+        jobId = broadcasts.createJob("discord", parseHTML("📢 <b>Annuncio globale</b>\n\n{}".format(text)), channel.id)
+        bot.loop.create_task(runBroadcast(jobId))
 
 @bot.command(name="team")
 @async_db_session
 async def team(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.teamName:
         if roundStarted:
             try:
-                teamInfo = api.teamInfo(dbChat.teamName)
+                if dbChat.viewEmbed:
+                    embedVar = renders.get(api, teamEmbed, dbChat.teamName)
+                else:
+                    message = renders.get(api, teamText, dbChat.teamName)
             except TeamNameError:
                 await channel.send(parseHTML("⚠️ La squadra che hai inserito non è presente nella classifica!\n"
                                              "Premi !settings per cambiare il nome della squadra."))
                 return
             if dbChat.viewEmbed:
-                embedVar = discord.Embed(title="👥 Info Team",
-                                         color=0x277ecd)
-                embedVar.add_field(name="Info",
-                                   value="👥 Team:\n📊 Rank:\n📈 Total Score:", inline=True)
-                embedVar.add_field(name="Value",
-                                   value="{}\n{}° / {}\n{} / {}pts.".format(teamInfo["name"], teamInfo["rank"], len(api.teams()),
-                                                       teamInfo["totalScore"], len(api.questions()) * 100), inline=True)
-                embedVar.add_field(name="Punteggi problemi",
-                                   value="Usa !partials per vedere i punteggi singoli dei quesiti.", inline=False)
                 await channel.send(embed=embedVar)
             else:
-                await channel.send(parseHTML("👥 Team: <b>{}</b>\n\n"
-                                             "📊 Rank: <b>{}°</b> / {}\n"
-                                             "📈 Total Score: <b>{}</b> / {}pts.\n\n"
-                                             "<i>Usa </i>!partials<i> per vedere i punteggi singoli dei quesiti.</i>"
-                                             "".format(teamInfo["name"], teamInfo["rank"], len(api.teams()),
-                                                       teamInfo["totalScore"], len(api.questions()) * 100)))
+                await channel.send(message)
         else:
             if dbChat.viewEmbed:
                 embedVar = discord.Embed(title="👥 La tua squadra è {}.".format(dbChat.teamName),
@@ -334,39 +485,22 @@ async def team(ctx):
 @bot.command(name="partials")
 @async_db_session
 async def partials(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.teamName:
         if roundStarted:
-            questList = api.questions()
             try:
-                teamInfo = api.teamInfo(dbChat.teamName)
+                if dbChat.viewEmbed:
+                    embedVar = renders.get(api, partialsEmbed, dbChat.teamName)
+                else:
+                    message = renders.get(api, partialsText, dbChat.teamName)
             except TeamNameError:
                 await channel.send(parseHTML("⚠️ La squadra che hai inserito non è presente nella classifica!\n"
                                              "Premi !settings per cambiare il nome della squadra."))
                 return
-            longestName = max(questList, key=len)
-            questPoints = teamInfo["partialScores"]
             if dbChat.viewEmbed:
-                leftColumn = ""
-                rightColumn = ""
-                embedVar = discord.Embed(title="👥 Team: {}".format(dbChat.teamName),
-                                         color=0x277ecd)
-                for quest, score in zip(questList, questPoints):
-                    leftColumn += "{} {}:\n".format(helpers.getStatIcon(score), quest)
-                    rightColumn += "{} pts.\n".format(score)
-                leftColumn += "\n📈 Total:"
-                rightColumn += "\n{} / {}pts.".format(teamInfo["totalScore"], len(questPoints) * 100)
-                embedVar.add_field(name="Problemi", value=leftColumn, inline=True)
-                embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
                 await channel.send(embed=embedVar)
             else:
-                message = "👥 Team: <b>{}</b>\n\n".format(dbChat.teamName)
-                for quest, score in zip(questList, questPoints):
-                    padding = " " * (len(longestName) - len(quest))
-                    message += "{}<code> {}: {}</code><b>{}</b> pts.\n".format(helpers.getStatIcon(score), quest, padding, score)
-                message += "\n📈 Total: <b>{}</b> / {}pts.".format(teamInfo["totalScore"], len(questPoints) * 100)
-                await channel.send(parseHTML(message))
+                await channel.send(message)
         else:
             if dbChat.viewEmbed:
                 embedVar = discord.Embed(title="👥 La tua squadra è {}.".format(dbChat.teamName),
@@ -383,85 +517,41 @@ async def partials(ctx):
 @bot.command(name="leaderboard")
 @async_db_session
 async def leaderboard(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if roundStarted:
-        teams = api.teams()
         if dbChat.viewEmbed:
-            embedVar = discord.Embed(title="🏆 Leaderboard", color=0x277ecd)
-            leftColumn = ""
-            rightColumn = ""
-            for pos in range(10):
-                teamInfo = api.teamInfo(teams[pos])
-                leftColumn += "{} {}\n".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"])
-                rightColumn += "{} pts.\n".format(teamInfo["totalScore"])
-            embedVar.add_field(name="Team", value=leftColumn, inline=True)
-            embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
-            await channel.send(embed=embedVar)
+            await channel.send(embed=renders.get(api, leaderboardEmbed))
         else:
-            message = "🏆 <b>Leaderboard</b>\n"
-            for pos in range(10):
-                teamInfo = api.teamInfo(teams[pos])
-                message += "\n{} <b>{}</b> ({} pts.)".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"],
-                                                             teamInfo["totalScore"])
-            await channel.send(parseHTML(message))
+            await channel.send(renders.get(api, leaderboardText))
     else:
         await channel.send(parseHTML("Nessuna gara è attualmente in corso!"))
 
 @bot.command(name="top")
 @async_db_session
 async def top(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if roundStarted:
-        teams = api.teams()
         if dbChat.viewEmbed:
-            embedVar = discord.Embed(title="🏆 Top Teams", color=0x277ecd)
-            leftColumn = ""
-            rightColumn = ""
-            for pos in range(3):
-                teamInfo = api.teamInfo(teams[pos])
-                leftColumn += "{} {}\n".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"])
-                rightColumn += "{} pts.\n".format(teamInfo["totalScore"])
-            if dbChat.teamName:
-                try:
-                    teamInfo = api.teamInfo(dbChat.teamName)
-                    leftColumn += "\n{} {}".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"])
-                    rightColumn += "\n{} pts.".format(teamInfo["totalScore"])
-                except TeamNameError:
-                    pass
-            embedVar.add_field(name="Team", value=leftColumn, inline=True)
-            embedVar.add_field(name="Punteggio", value=rightColumn, inline=True)
-            await channel.send(embed=embedVar)
+            await channel.send(embed=renders.get(api, topEmbed, dbChat.teamName))
         else:
-            message = "🏆 <b>Top Teams</b>\n"
-            for pos in range(3):
-                teamInfo = api.teamInfo(teams[pos])
-                message += "\n{} <b>{}</b> ({} pts.)".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"], teamInfo["totalScore"])
-            if dbChat.teamName:
-                try:
-                    teamInfo = api.teamInfo(dbChat.teamName)
-                    message += "\n\n{} <b>{}</b> ({} pts.)".format(helpers.getRankIcon(teamInfo["rank"]), teamInfo["name"], teamInfo["totalScore"])
-                except TeamNameError:
-                    pass
-            await channel.send(parseHTML(message))
+            await channel.send(renders.get(api, topText, dbChat.teamName))
     else:
         await channel.send(parseHTML("Nessuna gara è attualmente in corso!"))
 
 @bot.command(name="news")
 @async_db_session
 async def news(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
+    news = dbChat.news
     if dbChat.viewEmbed:
         embedVar = discord.Embed(title="📲 Notifiche attive", color=0x277ecd)
         embedVar.add_field(name="Notifica", value="⏰ Inizio gara:\n"
                                                   "📊 Nuova posizione in classifica:\n"
                                                   "📈 Punteggio modificato:", inline=True)
         embedVar.add_field(name="Attivo?", value="{}\n{}\n{}".format(
-                               "🔔 Attivo" if "eventStart" in dbChat.news else "🔕 Disattivo",
-                               "🔔 Attivo" if "rankChanged" in dbChat.news else "🔕 Disattivo",
-                               "🔔 Attivo" if "pointsChanged" in dbChat.news else "🔕 Disattivo"),
+                               "🔔 Attivo" if "eventStart" in news else "🔕 Disattivo",
+                               "🔔 Attivo" if "rankChanged" in news else "🔕 Disattivo",
+                               "🔔 Attivo" if "pointsChanged" in news else "🔕 Disattivo"),
                            inline=True)
         await channel.send(embed=embedVar)
     else:
@@ -469,30 +559,26 @@ async def news(ctx):
                                      "⏰ Inizio gara: {}\n"
                                      "📊 Nuova posizione in classifica: {}\n"
                                      "📈 Punteggio modificato: {}".format(
-            "🔔 Attivo" if "eventStart" in dbChat.news else "🔕 Disattivo",
-            "🔔 Attivo" if "rankChanged" in dbChat.news else "🔕 Disattivo",
-            "🔔 Attivo" if "pointsChanged" in dbChat.news else "🔕 Disattivo"
+            "🔔 Attivo" if "eventStart" in news else "🔕 Disattivo",
+            "🔔 Attivo" if "rankChanged" in news else "🔕 Disattivo",
+            "🔔 Attivo" if "pointsChanged" in news else "🔕 Disattivo"
         )))
 
 @bot.command(name="addnews")
 @async_db_session
 async def addnews(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     text = message.content.split(" ", 1)
     if len(text) > 1:
         name = text[1]
-        dbChat = DSChat.get(id=dbChatId)
         if name == "start":
-            if "eventStart" not in dbChat.news:
-                dbChat.news.append("eventStart")
+            dbChat.setNews("eventStart", True)
             await channel.send(parseHTML("🔔 Notifiche di inizio gara attivate!"))
         elif name == "rank":
-            if "rankChanged" not in dbChat.news:
-                dbChat.news.append("rankChanged")
+            dbChat.setNews("rankChanged", True)
             await channel.send(parseHTML("🔔 Notifiche per nuova posizione in classifica attivate!"))
         elif name == "points":
-            if "pointsChanged" not in dbChat.news:
-                dbChat.news.append("pointsChanged")
+            dbChat.setNews("pointsChanged", True)
             await channel.send(parseHTML("🔔 Notifiche per nuovo punteggio attivate!"))
         else:
             await channel.send(parseHTML("Errore: scegli una notifica tra start, rank o points."))
@@ -502,22 +588,18 @@ async def addnews(ctx):
 @bot.command(name="delnews")
 @async_db_session
 async def delnews(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     text = message.content.split(" ", 1)
     if len(text) > 1:
         name = text[1]
-        dbChat = DSChat.get(id=dbChatId)
         if name == "start":
-            if "eventStart" in dbChat.news:
-                dbChat.news.remove("eventStart")
+            dbChat.setNews("eventStart", False)
             await channel.send(parseHTML("🔕 Notifiche di inizio gara disattivate."))
         elif name == "rank":
-            if "rankChanged" in dbChat.news:
-                dbChat.news.remove("rankChanged")
+            dbChat.setNews("rankChanged", False)
             await channel.send(parseHTML("🔕 Notifiche per nuova posizione in classifica disattivate."))
         elif name == "points":
-            if "pointsChanged" in dbChat.news:
-                dbChat.news.remove("pointsChanged")
+            dbChat.setNews("pointsChanged", False)
             await channel.send(parseHTML("🔕 Notifiche per nuovo punteggio disattivate."))
         else:
             await channel.send(parseHTML("Errore: scegli una notifica tra start, rank o points."))
@@ -527,11 +609,10 @@ async def delnews(ctx):
 @bot.command(name="setteam")
 @async_db_session
 async def setteam(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
+    server, channel, user, message, dbChat = parseContext(ctx)
     text = message.content.split(" ", 1)
     if len(text) > 1:
         name = text[1]
-        dbChat = DSChat.get(id=dbChatId)
         dbChat.teamName = name
         await channel.send(parseHTML("✅ La tua squadra è <b>{}</b>!".format(dbChat.teamName)))
     else:
@@ -540,16 +621,14 @@ async def setteam(ctx):
 @bot.command(name="delteam")
 @async_db_session
 async def delteam(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     dbChat.teamName = ""
     await channel.send(parseHTML("❌ Il nome della squadra è stato rimosso."))
 
 @bot.command(name="toggleview")
 @async_db_session
 async def toggleview(ctx):
-    server, channel, user, message, dbChatId = parseContext(ctx)
-    dbChat = DSChat.get(id=dbChatId)
+    server, channel, user, message, dbChat = parseContext(ctx)
     if dbChat.viewEmbed:
         dbChat.viewEmbed = False
         await channel.send(parseHTML("❌ La modalità view Embed è stata disabilitata."))
@@ -558,4 +637,7 @@ async def toggleview(ctx):
         await channel.send(parseHTML("✅ La modalità view Embed è stata abilitata!"))
 
 
+# Every command coroutine, plus the refresh and broadcast loops
+profiler = SamplingProfiler({command.callback.__name__ for command in bot.commands} | {"runUpdates", "runBroadcast"},
+                            js_settings.get("profiler", {}).get("path", "profiles"))
 bot.run(js_settings["discord"]["token"])
@@ -1,10 +1,31 @@
-from requests import get
+from array import array
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from json import loads
+from time import monotonic, perf_counter
+from types import MappingProxyType
+import numpy as np
+from requests import Session
+from requests.adapters import HTTPAdapter
+from modules import metrics
+
+
+BUILD_SECONDS = metrics.histogram("snapshot_build_seconds", "Time to build a ranking snapshot from the judge payloads")
+DIFF_SECONDS = metrics.histogram("diff_seconds", "Time to diff two consecutive snapshots")
 
 
 class NoEventRunning(Exception):
     def __init__(self):
         self.message = "No event is currently running. The leaderboard is not active."
 
+class EndpointError(NoEventRunning):
+    def __init__(self, errors: dict):
+        super().__init__()
+        self.errors = errors
+        self.message = "Could not fetch the leaderboard: " + ", ".join(
+            f"/{endpoint} ({error.__class__.__name__})" for endpoint, error in errors.items())
+
 class TeamNameError(Exception):
     def __init__(self):
         self.message = "The team specified was not in the selected leaderboard."
@@ -14,56 +35,456 @@ class QuestionNameError(Exception):
         self.message = "The question specified is not part of this round."
 
 
-class OISRankingAPI:
-    baseUrl = "https://judge.science.unitn.it/ranking"
-    data = {}
-    oldData = {}
-
-    def __init__(self) -> None:
-        self.refresh()
+class _TeamView(Mapping):
+    # Read-only team -> value mapping computed from the score matrix on first access
+    __slots__ = ("snapshot", "build", "cache")
+    def __init__(self, snapshot, build) -> None:
+        self.snapshot = snapshot
+        self.build = build
+        self.cache = {}
 
-    def refresh(self) -> None:
-        self.oldData = self.data
+    def __getitem__(self, team: str):
         try:
-            self.data = {
-                "teams": get(f"{self.baseUrl}/teams", timeout=5).json(),
-                "users": get(f"{self.baseUrl}/users", timeout=5).json(),
-                "tasks": get(f"{self.baseUrl}/tasks", timeout=5).json(),
-                "scores": get(f"{self.baseUrl}/scores", timeout=5).json()
-            }
-        except Exception:
-            raise NoEventRunning
-
-    def questions(self, oldData: bool=False) -> list[str]:
-        data = self.data if not oldData else self.oldData
-        return sorted([x for x in data['tasks']], key=lambda x: data['tasks'][x]['order'])
-
-    def teams(self, oldData: bool=False) -> list[str]:
-        data = self.data if not oldData else self.oldData
-        scores = data['scores']
-        return sorted([x for x in data['users']], key=lambda x: sum(scores.get(x, {}).values()), reverse=True)
-
-    def teamInfo(self, teamName: str, oldData: bool=False) -> dict:
-        if teamName not in self.teams(oldData):
-            raise TeamNameError
+            return self.cache[team]
+        except KeyError:
+            value = self.cache[team] = self.build(self.snapshot.teamIndex[team])
+            return value
+
+    def __contains__(self, team) -> bool:
+        return team in self.snapshot.teamIndex
+
+    def __iter__(self):
+        return iter(self.snapshot.names)
+
+    def __len__(self) -> int:
+        return len(self.snapshot.names)
+
+
+class TeamRow(Mapping):
+    # One team of a snapshot, built the first time it is asked for and then shared by every reader of that snapshot.
+    # Read-only. row["rank"] and the rest of the Mapping interface keep the callers of the old dict rows working.
+    FIELDS = ("rank", "name", "partialScores", "totalScore")
+    __slots__ = FIELDS
+    def __init__(self, rank: int, name: str, partialScores: tuple, totalScore: float) -> None:
+        _setRank(self, rank)
+        _setName(self, name)
+        _setPartialScores(self, partialScores)
+        _setTotalScore(self, totalScore)
+
+    def __setattr__(self, field: str, value) -> None:
+        raise AttributeError(f"TeamRow is read-only: cannot set {field}")
+
+    def __delattr__(self, field: str) -> None:
+        raise AttributeError(f"TeamRow is read-only: cannot delete {field}")
+
+    def __getitem__(self, field: str):
+        if field in self.FIELDS:
+            return getattr(self, field)
+        raise KeyError(field)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"TeamRow(rank={self.rank!r}, name={self.name!r}, partialScores={self.partialScores!r}, " \
+               f"totalScore={self.totalScore!r})"
+
+# The slot setters themselves, as __setattr__ refuses; also twice as fast as object.__setattr__
+_setRank, _setName, _setPartialScores, _setTotalScore = (TeamRow.__dict__[field].__set__ for field in TeamRow.FIELDS)
+
+
+class _Row:
+    # Row number given to a team's scores while /scores is parsed; tells the outer object apart from the teams'
+    __slots__ = ("row",)
+    def __init__(self, row: int) -> None:
+        self.row = row
+
+
+class ScoreTable:
+    # /scores in compressed-row form: the scores of teams[i] are values[offsets[i]:offsets[i + 1]], for the tasks
+    # numbered in `columns` (positions in `tasks`). A few flat arrays instead of a dict per team.
+    __slots__ = ("teams", "tasks", "offsets", "columns", "values")
+    def __init__(self, teams: tuple=(), tasks: tuple=(), offsets=(0,), columns=(), values=()) -> None:
+        self.teams = teams
+        self.tasks = tasks
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.columns = np.asarray(columns, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float64)
+
+
+def parseScores(body) -> ScoreTable:
+    # Parses /scores ({team: {task: score}}) straight into a ScoreTable: each team's object is turned into array
+    # entries as soon as the decoder closes it, so the nested dicts are never built. Raises ValueError for anything
+    # else, JSON or not.
+    taskIndex = {}
+    column = taskIndex.__getitem__
+    offsets, columns, values = array("q", [0]), array("i"), array("d")
+    outer = None
+
+    def closeObject(pairs: list):
+        nonlocal outer
+        if outer is not None:
+            # An object closed after the one taken for the outer object: that was a team nested one level deeper
+            raise ValueError("/scores: objects nested deeper than team -> task -> score")
+        if pairs and type(pairs[0][1]) is _Row:
+            outer = pairs
+            return pairs
+        if pairs:
+            tasks, scores = zip(*pairs)
+            try:
+                # Numbers only: null, strings, lists and the _Row of a nested object are all refused here
+                values.extend(scores)
+            except TypeError:
+                raise ValueError("/scores: a score is not a number")
+            try:
+                columns.extend(list(map(column, tasks)))
+            except KeyError:
+                columns.extend([taskIndex.setdefault(task, len(taskIndex)) for task in tasks])
+        offsets.append(len(values))
+        return _Row(len(offsets) - 2)
+
+    parsed = loads(body, object_pairs_hook=closeObject)
+    if type(parsed) is _Row and len(offsets) == 2 and offsets[1] == 0:
+        # {}: the only object closed was the outer one
+        return ScoreTable()
+    if parsed is not outer or outer is None:
+        raise ValueError("/scores: not an object of teams")
+    teams = [None] * (len(offsets) - 1)
+    for team, row in parsed:
+        if type(row) is not _Row:
+            raise ValueError(f"/scores: the scores of {team!r} are not an object")
+        teams[row.row] = team
+    return ScoreTable(tuple(teams), tuple(taskIndex), np.frombuffer(offsets, dtype=np.int64),
+                      np.frombuffer(columns, dtype=np.int32), np.frombuffer(values, dtype=np.float64))
+
+
+class Snapshot:
+    # Ranking built once per refresh: scores live in a teams x tasks matrix (rows in name order, see `names`),
+    # totals and ranks are computed on it in one pass, and every accessor of OISRankingAPI is a view on top.
+    __slots__ = ("version", "questions", "questionPos", "names", "teamIndex", "matrix", "totalsArray", "order",
+                 "rankArray", "teams", "ranks", "partials", "totals", "rows")
+    def __init__(self, data: dict, version: int=0) -> None:
+        self.version = version
+        tasks = data.get("tasks", {})
+        scores = data.get("scores", {})
+
+        self.questions = tuple(sorted(tasks, key=lambda x: tasks[x]['order']))
+        self.questionPos = MappingProxyType({quest: pos for pos, quest in enumerate(self.questions)})
+
+        # Rows in team-name order, whatever order the judge lists users in: ties always break the same way
+        names = tuple(sorted(data.get("users", {})))
+        cells = (teamScores.get(quest, 0)
+                 for teamScores in (scores.get(team, {}) for team in names) for quest in self.questions)
+        matrix = np.fromiter(cells, dtype=np.float64, count=len(names) * len(self.questions))
+        self._index(names, matrix.reshape(len(names), len(self.questions)))
+
+    @classmethod
+    def fromTable(cls, names: tuple, questions: tuple, table: ScoreTable, version: int=0) -> "Snapshot":
+        # The same snapshot as Snapshot(data) for sorted(data["users"]), the tasks in order and parseScores() of
+        # data["scores"]; scores of teams or tasks not listed are left out
+        snapshot = cls.__new__(cls)
+        matrix = np.zeros((len(names), len(questions)))
+        if len(table.values):
+            rowOf = {team: row for row, team in enumerate(names)}
+            colOf = {quest: col for col, quest in enumerate(questions)}
+            rows = np.array([rowOf.get(team, -1) for team in table.teams], dtype=np.int64)
+            cols = np.array([colOf.get(task, -1) for task in table.tasks], dtype=np.int64)
+            rows = np.repeat(rows, np.diff(table.offsets))
+            cols = cols[table.columns]
+            known = (rows >= 0) & (cols >= 0)
+            matrix[rows[known], cols[known]] = table.values[known]
+        snapshot.__setstate__((version, questions, names, matrix))
+        return snapshot
+
+    def _index(self, names: tuple, matrix: np.ndarray) -> None:
+        matrix.flags.writeable = False
+        self.names = names
+        self.teamIndex = MappingProxyType({team: row for row, team in enumerate(names)})
+        self.matrix = matrix
+        # Rounded so that equal scores summed in a different order still tie
+        self.totalsArray = matrix.sum(axis=1).round(6)
+        self.order = np.argsort(-self.totalsArray, kind="stable")
+        # Competition ranking (1, 2, 2, 4): walking down the sorted totals, a team shares the rank of the first
+        # team with its total
+        sortedTotals = self.totalsArray[self.order]
+        firstOfTie = np.ones(len(names), dtype=bool)
+        firstOfTie[1:] = sortedTotals[1:] != sortedTotals[:-1]
+        positions = np.arange(1, len(names) + 1)
+        self.rankArray = np.empty(len(names), dtype=np.int64)
+        self.rankArray[self.order] = np.maximum.accumulate(np.where(firstOfTie, positions, 0))
+        self.teams = tuple(names[row] for row in self.order.tolist())
+        self.ranks = _TeamView(self, lambda row: int(self.rankArray[row]))
+        self.partials = _TeamView(self, lambda row: self.rows[names[row]].partialScores)
+        self.totals = _TeamView(self, lambda row: float(self.totalsArray[row]))
+        self.rows = _TeamView(self, lambda row: TeamRow(int(self.rankArray[row]), names[row],
+                                                        tuple(self.matrix[row].tolist()),
+                                                        float(self.totalsArray[row])))
 
-        data = self.data if not oldData else self.oldData
-        tasks = self.questions(oldData)
-        partials = data['scores'][teamName]
-        partials = [partials.get(task, 0) for task in tasks]
-        total = sum(partials)
-        rank = self.teams(oldData).index(teamName) + 1
+    # Pickled as the matrix and its row names only; totals, ranks and the views are rebuilt on load
+    def __getstate__(self) -> tuple:
+        return self.version, self.questions, self.names, self.matrix
 
-        return {
+    def __setstate__(self, state: tuple) -> None:
+        self.version, self.questions, names, matrix = state
+        self.questionPos = MappingProxyType({quest: pos for pos, quest in enumerate(self.questions)})
+        self._index(names, matrix)
+
+
+def diffSnapshots(old: Snapshot, new: Snapshot) -> MappingProxyType:
+    # Change set between two refreshes: only teams whose rank or partial scores moved are listed
+    if old is new:
+        return MappingProxyType({})
+    # Line the old matrix up with the new one: same row per team, same column per task (0 for new tasks)
+    if old.names == new.names:
+        oldRows = np.arange(len(new.names))
+    else:
+        oldRows = np.array([old.teamIndex.get(team, -1) for team in new.names], dtype=np.int64)
+    known = oldRows >= 0
+    oldRows = oldRows[known]
+    newRows = np.nonzero(known)[0]
+    oldScores = np.zeros((len(newRows), len(new.questions)))
+    for col, quest in enumerate(new.questions):
+        if quest in old.questionPos:
+            oldScores[:, col] = old.matrix[oldRows, old.questionPos[quest]]
+
+    rankGained = old.rankArray[oldRows] - new.rankArray[newRows]
+    gained = new.matrix[newRows] - oldScores
+    scoreChanged = (gained != 0).any(axis=1)
+    moved = np.nonzero((rankGained != 0) | scoreChanged)[0]
+
+    # Only the moved rows leave numpy, converted to Python values in bulk
+    rows = newRows[moved]
+    changes = {}
+    for row, rank, rankDelta, scores, delta, touched in zip(rows.tolist(), new.rankArray[rows].tolist(),
+                                                            rankGained[moved].tolist(), new.matrix[rows].tolist(),
+                                                            gained[moved].tolist(), scoreChanged[moved].tolist()):
+        team = new.names[row]
+        changes[team] = MappingProxyType({
+            "name": team,
             "rank": rank,
-            "name": teamName,
-            "partialScores": partials,
-            "totalScore": total
-        }
+            "rankGained": rankDelta,
+            "scores": tuple((quest, scores[col], delta[col]) for col, quest in enumerate(new.questions)
+                            if delta[col]) if touched else ()
+        })
+    return MappingProxyType(changes)
+
+
+class RankingView:
+    # Snapshot bookkeeping and the query surface shared by the blocking and the asyncio clients
+    baseUrl = "https://judge.science.unitn.it/ranking"
+    endpoints = ("teams", "users", "tasks", "scores")
+    # Fetched every `staticInterval` seconds, or as soon as /scores names a user or task they do not list
+    staticEndpoints = ("teams", "users", "tasks")
+    staticInterval = 900
+    timeout = 5
+    # Asked of the judge on every request; both HTTP clients decompress transparently
+    headers = {"Accept-Encoding": "gzip"}
+    snapshot = Snapshot({})
+    oldSnapshot = Snapshot({})
+    changeSet = MappingProxyType({})
+    # Judge requests made by the last refresh(), for the PollScheduler budget
+    requestsMade = 0
+    # Set by the admins' debug command: no "event started" notifications while on
+    debug = False
+    cyclesSkipped = 0
+    bytesSaved = 0
+    parseSeconds = 0.0
+    def __init__(self, history=None, baseUrl: str=None) -> None:
+        # history: optional HistoryStore that gets every new snapshot
+        self.history = history
+        if baseUrl:
+            self.baseUrl = baseUrl.rstrip("/")
+        self.validators = {endpoint: {} for endpoint in self.endpoints}
+        self.digests = {}
+        self.payloads = {}
+        self.staticFetched = None  # monotonic() of the last complete fetch of staticEndpoints
+
+    @staticmethod
+    def _fetchTimer(endpoint: str) -> metrics.Timer:
+        return metrics.histogram("judge_fetch_seconds", "Time to fetch one judge endpoint", endpoint=endpoint).time()
+
+    def _conditionalHeaders(self, endpoint: str) -> dict:
+        headers = {}
+        if endpoint not in self.payloads:
+            # Nothing to reuse on a 304
+            return headers
+        if "etag" in self.validators[endpoint]:
+            headers["If-None-Match"] = self.validators[endpoint]["etag"]
+        if "lastModified" in self.validators[endpoint]:
+            headers["If-Modified-Since"] = self.validators[endpoint]["lastModified"]
+        return headers
+
+    def _notModified(self, endpoint: str, status: int) -> bool:
+        return status == 304 and endpoint in self.payloads
+
+    @staticmethod
+    def _validatorsFrom(headers) -> dict:
+        validators = {}
+        if "ETag" in headers:
+            validators["etag"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            validators["lastModified"] = headers["Last-Modified"]
+        return validators
+
+    def _due(self) -> tuple[str, ...]:
+        # Endpoints to fetch this cycle
+        if self.staticFetched is None or monotonic() - self.staticFetched >= self.staticInterval:
+            return self.endpoints
+        return ("scores",)
+
+    def _store(self, results: dict) -> bool:
+        # results: endpoint -> (body, validators) or the exception raised while fetching it.
+        # A None body means the server answered 304 Not Modified. Returns whether any payload changed.
+        # Bodies are parsed before anything is kept: a body that does not parse fails its endpoint like a fetch
+        # error, and its validators and digest are not stored, so the next cycle fetches it in full.
+        errors = {endpoint: result for endpoint, result in results.items() if isinstance(result, Exception)}
+        parsed = {}
+        for endpoint, result in results.items():
+            if endpoint in errors or result[0] is None:
+                continue
+            body = result[0]
+            digest = blake2b(body, digest_size=16).digest()
+            if self.digests.get(endpoint, (None,))[0] == digest:
+                continue
+            start = perf_counter()
+            try:
+                parsed[endpoint] = self._parse(endpoint, body), (digest, len(body))
+            except Exception as error:
+                errors[endpoint] = error
+            self.parseSeconds += perf_counter() - start
+
+        for endpoint in errors:
+            metrics.counter("judge_fetch_errors_total", "Judge fetches that failed", endpoint=endpoint).inc()
+        if any(endpoint == "scores" or endpoint not in self.payloads for endpoint in errors):
+            # Whatever round comes next, its users and tasks are fetched again
+            self.staticFetched = None
+            raise EndpointError(errors)
+
+        for endpoint, result in results.items():
+            if endpoint in errors:
+                # A static endpoint we already hold: keep it and retry on the next cycle
+                continue
+            body, validators = result
+            self.validators[endpoint] = validators
+            if endpoint in parsed:
+                self.payloads[endpoint], self.digests[endpoint] = parsed[endpoint]
+            else:
+                self.bytesSaved += self.digests[endpoint][1] if body is None else len(body)
+        if not errors and all(endpoint in results for endpoint in self.staticEndpoints):
+            self.staticFetched = monotonic()
+        return bool(parsed)
+
+    @staticmethod
+    def _parse(endpoint: str, body: bytes):
+        # Only what the snapshot is built from is kept: the user names in order, the task names in order and
+        # /scores as a ScoreTable
+        if endpoint == "scores":
+            return parseScores(body)
+        data = loads(body)
+        if endpoint == "users":
+            return tuple(sorted(data))
+        if endpoint == "tasks":
+            return tuple(sorted(data, key=lambda x: data[x]['order']))
+        return data
+
+    def _unknownReferences(self) -> bool:
+        # /scores lists a user or a task missing from the cached /users and /tasks
+        scores = self.payloads.get("scores", ScoreTable())
+        return not set(scores.teams) <= set(self.payloads.get("users", ())) \
+            or not set(scores.tasks) <= set(self.payloads.get("tasks", ()))
+
+    def _build(self, version: int) -> Snapshot:
+        return Snapshot.fromTable(self.payloads.get("users", ()), self.payloads.get("tasks", ()),
+                                  self.payloads.get("scores", ScoreTable()), version)
+
+    def _publish(self, changed: bool) -> bool:
+        self.oldSnapshot = self.snapshot
+        if not changed:
+            # Nothing new: old and current snapshot are the same object, so any diff is empty
+            self.cyclesSkipped += 1
+            self.changeSet = MappingProxyType({})
+            return False
+        with BUILD_SECONDS.time():
+            self.snapshot = self._build(self.snapshot.version + 1)
+        with DIFF_SECONDS.time():
+            self.changeSet = diffSnapshots(self.oldSnapshot, self.snapshot)
+        if self.history is not None:
+            self.history.record(self.snapshot)
+        return True
+
+    def _snapshot(self, oldData: bool) -> Snapshot:
+        return self.oldSnapshot if oldData else self.snapshot
+
+    def changes(self) -> MappingProxyType:
+        return self.changeSet
+
+    def questions(self, oldData: bool=False) -> tuple[str, ...]:
+        return self._snapshot(oldData).questions
+
+    def teams(self, oldData: bool=False) -> tuple[str, ...]:
+        return self._snapshot(oldData).teams
+
+    def teamInfo(self, teamName: str, oldData: bool=False) -> TeamRow:
+        try:
+            return self._snapshot(oldData).rows[teamName]
+        except KeyError:
+            raise TeamNameError
 
     def getTeamPartial(self, teamName: str, questionName: str, oldData: bool=False) -> float:
-        if questionName not in self.questions(oldData):
+        snapshot = self._snapshot(oldData)
+        if questionName not in snapshot.questionPos:
             raise QuestionNameError
+        if teamName not in snapshot.partials:
+            raise TeamNameError
+        return snapshot.partials[teamName][snapshot.questionPos[questionName]]
+
+
+class OISRankingAPI(RankingView):
+    def __init__(self, history=None, baseUrl: str=None) -> None:
+        super().__init__(history, baseUrl)
+        # One keep-alive pool shared by the fetch workers, sized so every endpoint gets its own connection
+        self.session = Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=len(self.endpoints)))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=len(self.endpoints)))
+        self.executor = ThreadPoolExecutor(max_workers=len(self.endpoints), thread_name_prefix="ois-fetch")
+        try:
+            self.refresh()
+        except NoEventRunning:
+            pass
+
+    def _fetch(self, endpoint: str, conditional: bool=True) -> tuple[bytes, dict]:
+        with self._fetchTimer(endpoint):
+            response = self.session.get(f"{self.baseUrl}/{endpoint}", timeout=self.timeout,
+                                        headers=self._conditionalHeaders(endpoint) if conditional else {})
+        if response.status_code == 304:
+            if self._notModified(endpoint, response.status_code):
+                return None, self.validators[endpoint]
+            if conditional:
+                # Not modified, but there is no payload to reuse: ask for the whole body
+                return self._fetch(endpoint, False)
+        response.raise_for_status()
+        return response.content, self._validatorsFrom(response.headers)
+
+    def _fetchAll(self, endpoints: tuple) -> dict:
+        self.requestsMade += len(endpoints)
+        futures = {endpoint: self.executor.submit(self._fetch, endpoint) for endpoint in endpoints}
+        results = {}
+        for endpoint, future in futures.items():
+            try:
+                results[endpoint] = future.result()
+            except Exception as error:
+                results[endpoint] = error
+        return results
 
-        questionPos = self.questions(oldData).index(questionName)
-        return self.teamInfo(teamName, oldData)["partialScores"][questionPos]
+    def refresh(self) -> bool:
+        self.requestsMade = 0
+        due = self._due()
+        changed = self._store(self._fetchAll(due))
+        if changed and due != self.endpoints and self._unknownReferences():
+            # New contestants or tasks since the static endpoints were cached: fetch them now
+            changed = self._store(self._fetchAll(self.staticEndpoints)) or changed
+        return self._publish(changed)
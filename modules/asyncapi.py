@@ -0,0 +1,53 @@
+from asyncio import gather, get_event_loop
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from modules.api import RankingView
+
+
+class AsyncOISRankingAPI(RankingView):
+    # Same queries as OISRankingAPI, but refresh() is a coroutine: the fetches share one aiohttp session and
+    # parsing plus the snapshot build run in a worker thread, so the event loop keeps serving commands.
+    def __init__(self, history=None, baseUrl: str=None) -> None:
+        super().__init__(history, baseUrl)
+        self.session = None
+
+    def _session(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(timeout=ClientTimeout(total=self.timeout), headers=self.headers,
+                                         connector=TCPConnector(limit=len(self.endpoints)))
+        return self.session
+
+    async def _fetch(self, endpoint: str, conditional: bool=True) -> tuple[bytes, dict]:
+        headers = self._conditionalHeaders(endpoint) if conditional else {}
+        with self._fetchTimer(endpoint):
+            async with self._session().get(f"{self.baseUrl}/{endpoint}", headers=headers) as response:
+                if response.status == 304:
+                    if self._notModified(endpoint, response.status):
+                        return None, self.validators[endpoint]
+                    refetch = conditional
+                else:
+                    response.raise_for_status()
+                    return await response.read(), self._validatorsFrom(response.headers)
+        if refetch:
+            # Not modified, but there is no payload to reuse: ask for the whole body (with this connection released)
+            return await self._fetch(endpoint, False)
+        return b"", {}
+
+    async def _fetchAll(self, endpoints: tuple) -> dict:
+        self.requestsMade += len(endpoints)
+        bodies = await gather(*(self._fetch(endpoint) for endpoint in endpoints), return_exceptions=True)
+        return dict(zip(endpoints, bodies))
+
+    async def refresh(self) -> bool:
+        # Same steps as OISRankingAPI.refresh()
+        loop = get_event_loop()
+        self.requestsMade = 0
+        due = self._due()
+        changed = await loop.run_in_executor(None, self._store, await self._fetchAll(due))
+        if changed and due != self.endpoints and await loop.run_in_executor(None, self._unknownReferences):
+            changed = await loop.run_in_executor(None, self._store, await self._fetchAll(self.staticEndpoints)) \
+                      or changed
+        return await loop.run_in_executor(None, self._publish, changed)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,84 @@
+from time import monotonic
+from pony.orm import db_session, select, count, commit
+from modules.database import BroadcastJob, TGUser, DSChat
+
+PAGE_SIZE = 100
+
+
+def _recipients(platform: str, cursor: int):
+    # (cursor key, send target) pairs after `cursor`, in key order, one page at a time
+    if platform == "telegram":
+        query = select((u.chatId, u.chatId) for u in TGUser if u.chatId > cursor).order_by(1)
+    else:
+        query = select((ch.id, ch.chatId) for ch in DSChat if ch.id > cursor).order_by(1)
+    return query.limit(PAGE_SIZE)
+
+
+@db_session
+def createJob(platform: str, text: str, adminChat) -> int:
+    if platform == "telegram":
+        total = count(u for u in TGUser)
+        cursor = -2**63
+    else:
+        total = count(ch for ch in DSChat)
+        cursor = 0
+    job = BroadcastJob(platform=platform, text=text, adminChat=str(adminChat), cursor=cursor, total=total)
+    # Committed right away: the job runs outside the handler's session and must survive a crash from here on
+    commit()
+    return job.id
+
+
+@db_session
+def setProgressMessage(jobId: int, messageId) -> None:
+    BroadcastJob[jobId].progressMessage = str(messageId)
+
+
+@db_session
+def pendingJobs(platform: str) -> list[int]:
+    return select(j.id for j in BroadcastJob if j.platform == platform and j.status == "running")[:]
+
+
+@db_session
+def loadJob(jobId: int) -> dict:
+    return BroadcastJob[jobId].to_dict()
+
+
+@db_session
+def nextPage(jobId: int) -> list[tuple]:
+    job = BroadcastJob[jobId]
+    return _recipients(job.platform, job.cursor)[:]
+
+
+@db_session
+def advance(jobId: int, cursor: int, sent: int, failed: int) -> dict:
+    job = BroadcastJob[jobId]
+    job.cursor = cursor
+    job.sent += sent
+    job.failed += failed
+    return job.to_dict()
+
+
+@db_session
+def finish(jobId: int) -> dict:
+    job = BroadcastJob[jobId]
+    job.status = "done"
+    return job.to_dict()
+
+
+class ProgressRate:
+    def __init__(self, job: dict) -> None:
+        self.start = monotonic()
+        self.startDone = job["sent"] + job["failed"]
+
+    def __call__(self, job: dict) -> float:
+        return (job["sent"] + job["failed"] - self.startDone) / max(monotonic() - self.start, 1e-9)
+
+
+def progressText(job: dict, rate: float) -> str:
+    remaining = max(job["total"] - job["sent"] - job["failed"], 0)
+    status = "✅ <b>Broadcast completato</b>" if job["status"] == "done" else "📢 <b>Broadcast in corso...</b>"
+    return f"{status}\n\n" \
+           f"✉️ Inviati: <b>{job['sent']}</b>\n" \
+           f"⚠️ Falliti: <b>{job['failed']}</b>\n" \
+           f"⏳ Rimanenti: <b>{remaining}</b>\n" \
+           f"⚡️ Velocità: <b>{rate:.1f}</b> msg/s"
@@ -0,0 +1,179 @@
+import atexit
+from collections import OrderedDict
+from threading import Thread, Lock
+from time import sleep
+from traceback import print_exc
+from pony.orm import db_session, select
+from modules import subscriptions
+from modules.database import TGUser, DSChat
+
+FIELDS = ("status", "teamName", "viewEmbed", "news")
+FLUSH_PAGE = 500
+
+
+class ChatRecord:
+    # In-memory copy of a chat's settings. Assigning one of FIELDS marks the record dirty; ChatCache writes it back.
+    __slots__ = ("chatId", "status", "teamName", "viewEmbed", "news", "cache", "changed", "created")
+    def __init__(self, cache, chatId, status: str, teamName: str, viewEmbed: bool, news: frozenset,
+                 created: bool=False) -> None:
+        object.__setattr__(self, "cache", None)  # nothing to track while filling it in
+        self.chatId = chatId
+        self.status = status
+        self.teamName = teamName
+        self.viewEmbed = viewEmbed
+        self.news = news
+        self.changed = set()
+        self.created = created
+        self.cache = cache
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        if name in FIELDS and self.cache is not None:
+            self.cache.markDirty(self, name)
+
+    def setNews(self, newsType: str, active: bool) -> None:
+        self.news = self.news | {newsType} if active else self.news - {newsType}
+
+
+class ChatCache:
+    # Process-wide cache of chat settings for one platform. Reads hit SQLite only on a miss; changes are written
+    # back by a background thread every `flushInterval` seconds, all dirty chats in one transaction. At most
+    # `size` clean records are kept; dirty ones stay until written.
+    # Notification targeting still reads the subscription tables, so a change reaches it after the next flush.
+    def __init__(self, platform: str, size: int=50000, flushInterval: float=2.0) -> None:
+        self.platform = platform
+        self.entity = TGUser if platform == "telegram" else DSChat
+        self.size = size
+        self.flushInterval = flushInterval
+        self.records = OrderedDict()
+        self.dirty = {}
+        self.removed = set()
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "written": 0, "removed": 0, "evicted": 0}
+        Thread(target=self._flusher, name=f"{platform}-chatcache", daemon=True).start()
+        atexit.register(self.close)
+
+    def _load(self, chatId) -> ChatRecord:
+        with db_session:
+            chat = self.entity.get(chatId=chatId)
+            if chat is None:
+                # Created in the database by the next flush, with every notification on like before
+                return ChatRecord(self, chatId, "normal", "", False, frozenset(subscriptions.NEWS_TYPES), True)
+            return ChatRecord(self, chatId, chat.status, chat.teamName,
+                              chat.viewEmbed if self.platform == "discord" else False,
+                              frozenset(subscriptions.newsOf(chat)))
+
+    def get(self, chatId) -> ChatRecord:
+        with self.lock:
+            record = self.records.get(chatId)
+            if record is not None:
+                self.records.move_to_end(chatId)
+                self.stats["hits"] += 1
+                return record
+            self.stats["misses"] += 1
+            # Writing again before its removal was flushed: the chat stays
+            self.removed.discard(chatId)
+        loaded = self._load(chatId)
+        with self.lock:
+            # Another thread may have loaded it meanwhile: keep the first copy
+            record = self.records.setdefault(chatId, loaded)
+            if record is loaded and record.created:
+                self.dirty[chatId] = record
+            self._evict()
+        return record
+
+    def markDirty(self, record: ChatRecord, field: str) -> None:
+        with self.lock:
+            record.changed.add(field)
+            self.dirty[record.chatId] = record
+
+    def remove(self, chatId) -> None:
+        # Deletes the chat (e.g. it blocked the bot) and its subscriptions with the next flush
+        with self.lock:
+            self.records.pop(chatId, None)
+            self.dirty.pop(chatId, None)
+            self.removed.add(chatId)
+
+    def _evict(self) -> None:
+        # Drops the least recently used clean records; dirty ones stay until flushed
+        while len(self.records) > self.size:
+            for chatId in self.records:
+                if chatId not in self.dirty:
+                    break
+            else:
+                return
+            del self.records[chatId]
+            self.stats["evicted"] += 1
+
+    def _flusher(self) -> None:
+        while True:
+            sleep(self.flushInterval)
+            try:
+                self.flush()
+            except Exception:
+                print_exc()
+
+    def flush(self) -> int:
+        # Writes every dirty chat and deletes every removed one in one transaction; returns how many were written
+        with self.lock:
+            if not self.dirty and not self.removed:
+                return 0
+            removed = list(self.removed)
+            self.removed = set()
+            pending = []
+            for record in self.dirty.values():
+                pending.append((record, record.created, set(record.changed),
+                                {name: getattr(record, name) for name in FIELDS}))
+                record.changed.clear()
+                record.created = False
+            self.dirty = {}
+
+        try:
+            with db_session:
+                # Chats and their subscriptions are read in bulk, a page at a time
+                for start in range(0, len(pending), FLUSH_PAGE):
+                    page = pending[start:start + FLUSH_PAGE]
+                    chatIds = [record.chatId for record, _, _, _ in page]
+                    query = select(chat for chat in self.entity if chat.chatId in chatIds)
+                    loaded = {chat.chatId: chat for chat in query.prefetch(self.entity.subscriptions)}
+                    for record, created, changed, values in page:
+                        self._write(loaded.get(record.chatId), record.chatId, created, changed, values)
+                for start in range(0, len(removed), FLUSH_PAGE):
+                    chatIds = removed[start:start + FLUSH_PAGE]
+                    for chat in select(chat for chat in self.entity if chat.chatId in chatIds):
+                        chat.delete()
+        except Exception:
+            # Nothing was committed: queue the changes again for the next flush
+            with self.lock:
+                self.removed.update(removed)
+                for record, created, changed, _ in pending:
+                    record.changed |= changed
+                    record.created = record.created or created
+                    if record.chatId in self.records:
+                        self.dirty[record.chatId] = record
+            raise
+        with self.lock:
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(pending)
+            self.stats["removed"] += len(removed)
+            self._evict()
+        return len(pending)
+
+    def _write(self, chat, chatId, created: bool, changed: set, values: dict) -> None:
+        if chat is None:
+            if not created:
+                return
+            chat = self.entity(chatId=chatId)
+            changed = set(FIELDS)
+        if "status" in changed:
+            chat.status = values["status"]
+        if "viewEmbed" in changed and self.platform == "discord":
+            chat.viewEmbed = values["viewEmbed"]
+        if "teamName" in changed:
+            subscriptions.setTeam(chat, values["teamName"])
+        if "news" in changed:
+            for newsType in subscriptions.NEWS_TYPES:
+                subscriptions.setNews(chat, newsType, newsType in values["news"])
+
+    def close(self) -> None:
+        self.flush()
@@ -1,13 +1,56 @@
-from pony.orm import Database, PrimaryKey, Required, Optional, StrArray
+import os
+import sqlite3
+from datetime import datetime
+from pony.orm import Database, PrimaryKey, Required, Optional, Set, StrArray, composite_key, composite_index
+from modules import metrics
 
-db = Database("sqlite", "../oisrankingbot.db", create_db=True)
+# Set on every connection. WAL lets readers run while one process writes, so tgbot, dsbot and their worker
+# threads only wait for each other's commits; synchronous=NORMAL skips the fsync on every commit, which WAL
+# keeps crash-safe (a power loss may drop the last few transactions).
+PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -16000, "temp_store": "MEMORY"}
+# Seconds a writer waits for another process' transaction before "database is locked"
+BUSY_TIMEOUT = 15
 
+db = Database()
 
+QUERY_SECONDS = {statement: metrics.histogram("db_query_seconds", "Time to run one SQL statement, or to commit",
+                                              statement=statement)
+                 for statement in ("SELECT", "INSERT", "UPDATE", "DELETE", "COMMIT", "OTHER")}
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Pony runs every statement through connection.cursor().execute(); time them by their first keyword
+    def execute(self, sql: str, *args):
+        with QUERY_SECONDS.get(sql.lstrip()[:6].upper(), QUERY_SECONDS["OTHER"]).time():
+            return super().execute(sql, *args)
+
+    def executemany(self, sql: str, *args):
+        with QUERY_SECONDS.get(sql.lstrip()[:6].upper(), QUERY_SECONDS["OTHER"]).time():
+            return super().executemany(sql, *args)
+
+
+class TunedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        for name, value in PRAGMAS.items():
+            self.execute(f"PRAGMA {name}={value}")
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def commit(self) -> None:
+        with QUERY_SECONDS["COMMIT"].time():
+            super().commit()
+
+
+# Notification settings live in TGSubscription / DSSubscription (see modules/subscriptions.py). The old `news`
+# arrays are only read once by subscriptions.migrateNews(), which empties them.
 class TGUser(db.Entity):
     chatId = PrimaryKey(int, sql_type="BIGINT", size=64)
     status = Required(str, default="normal")
     teamName = Optional(str)
-    news = Required(StrArray, default=["eventStart", "rankChanged", "pointsChanged"])
+    news = Required(StrArray, default=[])
+    subscriptions = Set("TGSubscription", cascade_delete=True)
 
 
 class DSChat(db.Entity):
@@ -15,9 +58,49 @@ class DSChat(db.Entity):
     status = Required(str, default="normal")
     teamName = Optional(str)
     viewEmbed = Required(bool, default=False)
-    news = Required(StrArray, default=["eventStart", "rankChanged", "pointsChanged"])
+    news = Required(StrArray, default=[])
+    subscriptions = Set("DSSubscription", cascade_delete=True)
+
+
+# One row per (chat, notification type), with the chat's team copied in so that "who follows team X for this
+# notification" is a lookup on (newsType, teamName); the index also holds the chat, so it answers it on its own
+class TGSubscription(db.Entity):
+    chat = Required(TGUser)
+    newsType = Required(str)
+    teamName = Optional(str)
+    composite_key(chat, newsType)
+    composite_index(newsType, teamName, chat)
+
+
+class DSSubscription(db.Entity):
+    chat = Required(DSChat)
+    newsType = Required(str)
+    teamName = Optional(str)
+    composite_key(chat, newsType)
+    composite_index(newsType, teamName, chat)
+
+
+class BroadcastJob(db.Entity):
+    platform = Required(str)
+    text = Required(str)
+    adminChat = Required(str)
+    progressMessage = Optional(str)
+    cursor = Required(int, size=64)
+    total = Required(int, default=0)
+    sent = Required(int, default=0)
+    failed = Required(int, default=0)
+    status = Required(str, default="running")
+    created = Required(datetime, default=datetime.now)
 
 
-db.generate_mapping(create_tables=True)
+def connect(path: str=None) -> None:
+    # Binds the entities to a database file: `path` (settings.json "database": {"path"}), else the
+    # OISRANKINGBOT_DB environment variable, else ../oisrankingbot.db as before
+    if path:
+        path = os.path.abspath(path)
+    else:
+        path = os.environ.get("OISRANKINGBOT_DB", "../oisrankingbot.db")
+    db.bind("sqlite", path, create_db=True, timeout=BUSY_TIMEOUT, factory=TunedConnection)
+    db.generate_mapping(create_tables=True)
 
 ##trollato!
\ No newline at end of file
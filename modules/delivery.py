@@ -0,0 +1,160 @@
+from collections import deque
+from queue import Queue, Empty
+from threading import Thread, Lock, Event
+from time import monotonic, sleep
+from telepotpro.exception import TelegramError, BotWasBlockedError
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.pausedUntil = 0.0
+        self.lock = Lock()
+
+    def take(self) -> float:
+        # Takes a token if one is available, otherwise returns how long to wait before trying again
+        with self.lock:
+            now = monotonic()
+            if now < self.pausedUntil:
+                return self.pausedUntil - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, monotonic() + seconds)
+            self.tokens = 0
+
+
+class DeliveryBatch:
+    def __init__(self) -> None:
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.closed = False
+        self.lock = Lock()
+        self.done = Event()
+
+    def _add(self) -> None:
+        with self.lock:
+            self.pending += 1
+
+    def _finish(self, ok: bool) -> None:
+        with self.lock:
+            self.pending -= 1
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            if self.closed and self.pending == 0:
+                self.done.set()
+
+    def wait(self, timeout: float=None) -> tuple[int, int]:
+        with self.lock:
+            self.closed = True
+            if self.pending == 0:
+                self.done.set()
+        self.done.wait(timeout)
+        return self.sent, self.failed
+
+
+class DeliveryQueue:
+    # Telegram allows about 30 messages per second overall and one message per second to the same chat
+    def __init__(self, bot, workers: int=8, globalRate: float=30, chatInterval: float=1.0,
+                 maxRetries: int=5, onBlocked=None) -> None:
+        self.bot = bot
+        self.globalBucket = TokenBucket(globalRate, globalRate)
+        self.chatInterval = chatInterval
+        self.maxRetries = maxRetries
+        self.onBlocked = onBlocked
+        self.queue = Queue()
+        self.chatSlots = {}
+        self.chatLock = Lock()
+        self.latencies = deque(maxlen=10000)
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "blocked": 0, "retried": 0}
+        self.statsLock = Lock()
+        self.started = monotonic()
+        for num in range(workers):
+            Thread(target=self._worker, name=f"tg-delivery-{num}", daemon=True).start()
+
+    def send(self, chatId: int, text: str, batch: DeliveryBatch=None, **kwargs) -> None:
+        # Never blocks: the message is delivered by the worker pool
+        if batch is not None:
+            batch._add()
+        with self.statsLock:
+            self.stats["queued"] += 1
+        self.queue.put((monotonic(), 0, chatId, text, kwargs, batch))
+
+    def join(self) -> None:
+        self.queue.join()
+
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    def throughput(self) -> float:
+        return self.stats["sent"] / max(monotonic() - self.started, 1e-9)
+
+    def _count(self, key: str) -> None:
+        with self.statsLock:
+            self.stats[key] += 1
+
+    def _reserveChat(self, chatId: int) -> float:
+        with self.chatLock:
+            now = monotonic()
+            slot = max(self.chatSlots.get(chatId, 0.0), now)
+            self.chatSlots[chatId] = slot + self.chatInterval
+            if len(self.chatSlots) > 50000:
+                self.chatSlots = {chat: t for chat, t in self.chatSlots.items() if t > now}
+            return slot - now
+
+    def _worker(self) -> None:
+        while True:
+            try:
+                job = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
+                self._deliver(*job)
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, queuedAt: float, attempt: int, chatId: int, text: str, kwargs: dict, batch: DeliveryBatch) -> None:
+        wait = self._reserveChat(chatId)
+        if wait > 0:
+            sleep(wait)
+        wait = self.globalBucket.take()
+        while wait > 0:
+            sleep(wait)
+            wait = self.globalBucket.take()
+
+        try:
+            self.bot.sendMessage(chatId, text, **kwargs)
+        except BotWasBlockedError:
+            self._finish("blocked", batch)
+            if self.onBlocked:
+                self.onBlocked(chatId)
+        except TelegramError as error:
+            retryAfter = (error.json or {}).get("parameters", {}).get("retry_after") if error.error_code == 429 else None
+            if retryAfter is not None and attempt < self.maxRetries:
+                self._count("retried")
+                self.globalBucket.pause(retryAfter)
+                self.queue.put((queuedAt, attempt + 1, chatId, text, kwargs, batch))
+            else:
+                self._finish("failed", batch)
+        except Exception:
+            self._finish("failed", batch)
+        else:
+            self.latencies.append(monotonic() - queuedAt)
+            self._finish("sent", batch)
+
+    def _finish(self, outcome: str, batch: DeliveryBatch) -> None:
+        self._count(outcome)
+        if batch is not None:
+            batch._finish(outcome == "sent")
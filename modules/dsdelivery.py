@@ -0,0 +1,57 @@
+from asyncio import Semaphore, Lock, gather, sleep
+import discord
+
+
+class ChannelFanout:
+    # Sends to many channels at once: at most `concurrency` requests in flight, one at a time per channel
+    # (Discord rate-limits message creation per channel route), and a failing channel never stops the others.
+    def __init__(self, bot, concurrency: int=10, maxRetries: int=3) -> None:
+        self.bot = bot
+        self.concurrency = concurrency
+        self.maxRetries = maxRetries
+        self.semaphore = None
+        self.routes = {}  # channel id -> [lock, sends holding or waiting for it]; dropped when that reaches 0
+        self.stats = {"sent": 0, "failed": 0, "missing": 0, "retried": 0}
+
+    async def send(self, chatId: str, **kwargs) -> bool:
+        if self.semaphore is None:
+            self.semaphore = Semaphore(self.concurrency)
+        chat = self.bot.get_channel(int(chatId))
+        if chat is None:
+            self.stats["missing"] += 1
+            return False
+
+        route = self.routes.get(chat.id)
+        if route is None:
+            route = self.routes[chat.id] = [Lock(), 0]
+        route[1] += 1
+        try:
+            # Channel first: sends queued behind a busy channel do not take concurrency slots from the others
+            async with route[0], self.semaphore:
+                return await self._deliver(chat, kwargs)
+        finally:
+            route[1] -= 1
+            if route[1] == 0:
+                del self.routes[chat.id]
+
+    async def _deliver(self, chat, kwargs: dict) -> bool:
+        for attempt in range(self.maxRetries + 1):
+            try:
+                await chat.send(**kwargs)
+                self.stats["sent"] += 1
+                return True
+            except discord.HTTPException as error:
+                if error.status != 429 or attempt == self.maxRetries:
+                    break
+                self.stats["retried"] += 1
+                await sleep(float(error.response.headers.get("Retry-After", 1)))
+            except Exception:
+                break
+        self.stats["failed"] += 1
+        return False
+
+    async def sendAll(self, jobs) -> tuple[int, int]:
+        # jobs: iterable of (chatId, kwargs for channel.send)
+        results = await gather(*(self.send(chatId, **kwargs) for chatId, kwargs in jobs))
+        sent = sum(results)
+        return sent, len(results) - sent
@@ -0,0 +1,135 @@
+import os
+from struct import Struct
+from time import time
+from modules.api import Snapshot
+
+# Append-only score history. Every record is a header (kind, timestamp, count) followed by its body:
+#   b"T" team name (count = utf-8 length)       -> next team index
+#   b"Q" task order + name (count = utf-8 len)   -> next task index
+#   b"D" delta: `count` cells (team, task, score) that changed since the previous record
+#   b"K" keyframe: `count` cells holding every non-zero score, written every `keyframeEvery` deltas
+# Rebuilding time T reads headers only up to the last keyframe before T, then applies the deltas after it.
+RECORD = Struct("<cdI")
+CELL = Struct("<IHd")
+ORDER = Struct("<i")
+
+
+class HistoryStore:
+    def __init__(self, path: str, keyframeEvery: int=30) -> None:
+        self.path = path
+        self.keyframeEvery = keyframeEvery
+        self.teamIds = {}
+        self.taskIds = {}
+        self.cells = {}
+        self.sinceKeyframe = 0
+        self.bytesWritten = 0
+        if os.path.exists(path):
+            self.teamIds, self.taskIds, _, self.cells, self.sinceKeyframe, end = self._replay(float("inf"))
+            # A crash mid-write leaves a partial record at the end: cut it off, or every record appended after it
+            # would be read from the wrong offset
+            if end < os.path.getsize(path):
+                os.truncate(path, end)
+        self.file = open(path, "ab")
+
+    def _records(self, until: float) -> tuple[bytes, list, int]:
+        # Walks the record headers up to `until`: (kind, timestamp, body offset, body size), plus the offset just
+        # past the last complete record
+        with open(self.path, "rb") as file:
+            data = file.read()
+        records = []
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            kind, timestamp, count = RECORD.unpack_from(data, offset)
+            size = count * CELL.size if kind in (b"D", b"K") else count + (ORDER.size if kind == b"Q" else 0)
+            if offset + RECORD.size + size > len(data) or timestamp > until:
+                break
+            records.append((kind, timestamp, offset + RECORD.size, size))
+            offset += RECORD.size + size
+        return data, records, offset
+
+    @staticmethod
+    def _scan(data: bytes, records: list):
+        # Yields (kind, timestamp, body) for every record of `records`, skipping straight to the last keyframe
+        lastKeyframe = max((pos for pos, record in enumerate(records) if record[0] == b"K"), default=0)
+        for pos, (kind, timestamp, start, size) in enumerate(records):
+            if kind in (b"D", b"K") and pos < lastKeyframe:
+                continue
+            yield kind, timestamp, memoryview(data)[start:start + size]
+
+    def span(self) -> tuple[float, float]:
+        # First and last recorded timestamps
+        _, records, _ = self._records(float("inf"))
+        if not records:
+            return 0.0, 0.0
+        return records[0][1], records[-1][1]
+
+    def _replay(self, until: float) -> tuple[dict, dict, dict, dict, int, int]:
+        data, records, end = self._records(until)
+        teamIds, taskIds, taskOrder, cells = {}, {}, {}, {}
+        sinceKeyframe = 0
+        for kind, timestamp, body in self._scan(data, records):
+            if kind == b"T":
+                teamIds[bytes(body).decode()] = len(teamIds)
+            elif kind == b"Q":
+                name = bytes(body[ORDER.size:]).decode()
+                taskOrder[name] = ORDER.unpack_from(body)[0]
+                taskIds[name] = len(taskIds)
+            else:
+                if kind == b"K":
+                    cells = {}
+                    sinceKeyframe = 0
+                else:
+                    sinceKeyframe += 1
+                for team, task, score in CELL.iter_unpack(body):
+                    cells[(team, task)] = score
+        return teamIds, taskIds, taskOrder, cells, sinceKeyframe, end
+
+    def _write(self, kind: bytes, timestamp: float, count: int, body: bytes) -> None:
+        record = RECORD.pack(kind, timestamp, count) + body
+        self.file.write(record)
+        self.bytesWritten += len(record)
+
+    def record(self, snapshot: Snapshot, timestamp: float=None) -> int:
+        # Appends what changed in `snapshot`; returns the number of changed cells
+        timestamp = time() if timestamp is None else timestamp
+        for pos, quest in enumerate(snapshot.questions):
+            if quest not in self.taskIds:
+                self.taskIds[quest] = len(self.taskIds)
+                name = quest.encode()
+                self._write(b"Q", timestamp, len(name), ORDER.pack(pos) + name)
+        changed = []
+        taskIds = [self.taskIds[quest] for quest in snapshot.questions]
+        for team, partials in zip(snapshot.names, snapshot.matrix.tolist()):
+            if team not in self.teamIds:
+                self.teamIds[team] = len(self.teamIds)
+                name = team.encode()
+                self._write(b"T", timestamp, len(name), name)
+            teamId = self.teamIds[team]
+            for taskId, score in zip(taskIds, partials):
+                if self.cells.get((teamId, taskId), 0) != score:
+                    self.cells[(teamId, taskId)] = score
+                    changed.append((teamId, taskId, score))
+
+        if self.sinceKeyframe >= self.keyframeEvery:
+            cells = [(team, task, score) for (team, task), score in self.cells.items() if score]
+            self._write(b"K", timestamp, len(cells), b"".join(CELL.pack(*cell) for cell in cells))
+            self.sinceKeyframe = 0
+        elif changed:
+            self._write(b"D", timestamp, len(changed), b"".join(CELL.pack(*cell) for cell in changed))
+            self.sinceKeyframe += 1
+        self.file.flush()
+        return len(changed)
+
+    def at(self, timestamp: float) -> Snapshot:
+        # Leaderboard as it was at `timestamp`
+        teamIds, taskIds, taskOrder, cells, _, _ = self._replay(timestamp)
+        teamNames = list(teamIds)
+        taskNames = list(taskIds)
+        tasks = {name: {"order": taskOrder[name]} for name in taskNames}
+        scores = {}
+        for (team, task), score in cells.items():
+            scores.setdefault(teamNames[team], {})[taskNames[task]] = score
+        return Snapshot({"users": dict.fromkeys(teamIds), "tasks": tasks, "scores": scores})
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import perf_counter
+
+# Counters and latency histograms shared by everything in the process, served in the Prometheus text format by
+# serve(). Recording is a lock and an addition (plus a bisect for histograms); the text is only built on a scrape.
+PREFIX = "oisbot_"
+# Upper bounds in seconds, from a cached render to a slow judge
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount: float=1) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "lock")
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, seconds: float) -> None:
+        bucket = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += seconds
+
+    def time(self, errors: Counter=None) -> "Timer":
+        return Timer(self, errors)
+
+
+class Timer:
+    # `with histogram.time():` observes the time spent in the block, also when it raises; `errors` counts the raises
+    __slots__ = ("histogram", "errors", "start")
+    def __init__(self, histogram: Histogram, errors: Counter=None) -> None:
+        self.histogram = histogram
+        self.errors = errors
+
+    def __enter__(self) -> "Timer":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, traceback) -> None:
+        self.histogram.observe(perf_counter() - self.start)
+        if excType is not None and self.errors is not None:
+            self.errors.inc()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labelText(labels: tuple, extra: str="") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.families = {}  # name -> (type, help, {labels: metric})
+        self.collectors = []
+        self.lock = Lock()
+
+    def _get(self, kind: str, cls, name: str, help: str, labels: dict):
+        key = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family is not None:
+            metric = family[2].get(key)
+            if metric is not None:
+                return metric
+        with self.lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            return family[2].setdefault(key, cls())
+
+    def counter(self, name: str, help: str, **labels) -> Counter:
+        # Returns the same Counter for the same name and labels; keep it around on hot paths
+        return self._get("counter", Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str, **labels) -> Histogram:
+        return self._get("histogram", Histogram, name, help, labels)
+
+    def gauges(self, name: str, help: str, read, label: str="key") -> None:
+        # Exports a stats dict: read() is called on every scrape and each key becomes a `label` value
+        with self.lock:
+            self.collectors.append((name, help, read, label))
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in sorted(self.families.items())]
+            collectors = list(self.collectors)
+        for name, kind, help, metrics in families:
+            name = PREFIX + name
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "counter":
+                    lines.append(f"{name}{_labelText(labels)} {metric.value}")
+                    continue
+                with metric.lock:
+                    counts, total = list(metric.counts), metric.sum
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labelText(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labelText(labels)} {total}")
+                lines.append(f"{name}_count{_labelText(labels)} {cumulative}")
+        for name, help, read, label in collectors:
+            name = PREFIX + name
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in read().items():
+                lines.append(f"{name}{_labelText(((label, key),))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+gauges = registry.gauges
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(port: int, host: str="127.0.0.1") -> ThreadingHTTPServer:
+    # Serves GET /metrics from a daemon thread; bound to localhost unless told otherwise
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
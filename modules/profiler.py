@@ -0,0 +1,116 @@
+import os
+import sys
+from collections import Counter
+from threading import Thread, Lock, get_ident, enumerate as threads
+from time import perf_counter, sleep, strftime
+
+# Phase of a sample, from the innermost frame whose path contains one of the markers; the first rule that matches
+# wins. Anything else inside a handler is the handler's own code.
+def _modules(*names) -> tuple:
+    return tuple(os.path.join("modules", name) for name in names)
+
+def _packages(*names) -> tuple:
+    return tuple(f"{os.sep}{name}{os.sep}" for name in names)
+
+PHASES = (
+    ("db", _packages("pony", "sqlite3") + _modules("database.py", "subscriptions.py", "chatcache.py")),
+    ("network", _packages("telepotpro", "requests", "urllib3", "aiohttp", "discord", "http")
+                + ("ssl.py", "socket.py") + _modules("delivery.py", "dsdelivery.py")),
+    ("render", _modules("render.py", "helpers.py", "keyboards.py")),
+    ("api", _packages("numpy") + _modules("api.py", "asyncapi.py", "shared.py")),
+)
+MAX_SECONDS = 600
+
+
+def _phase(filename: str) -> str:
+    for phase, markers in PHASES:
+        if any(marker in filename for marker in markers):
+            return phase
+    return None
+
+
+def _label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+    # Samples the stack of every thread every `interval` seconds while a run is active, and keeps the samples that
+    # are inside one of `handlers` (function names: reply, runUpdates, the discord commands...). Nothing is hooked
+    # into the interpreter, so there is no cost at all between runs. For coroutines only time spent running on
+    # the event loop is seen: a command waiting on Discord is not on any stack.
+    def __init__(self, handlers, directory: str=".", interval: float=0.005) -> None:
+        self.handlers = frozenset(handlers)
+        self.directory = directory
+        self.interval = interval
+        self.lock = Lock()
+        self.running = False
+
+    def start(self, seconds: float, done) -> bool:
+        # Profiles in a background thread and calls done(path, summary) at the end; False if a run is active
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+        Thread(target=self._run, args=[seconds, done], name="profiler", daemon=True).start()
+        return True
+
+    def _run(self, seconds: float, done) -> None:
+        try:
+            path, summary = self.profile(seconds)
+        finally:
+            with self.lock:
+                self.running = False
+        done(path, summary)
+
+    def _sample(self, names: dict, weight: float, stacks: Counter, phases: Counter) -> None:
+        me = get_ident()
+        for threadId, frame in sys._current_frames().items():
+            if threadId == me:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame.f_code)
+                frame = frame.f_back
+            # Outermost handler frame: nested handlers (sendTeamNews inside runUpdates) count for the outer one
+            handler = next((code.co_name for code in reversed(frames) if code.co_name in self.handlers), None)
+            if handler is None:
+                continue
+            phase = next((phase for phase in map(_phase, (code.co_filename for code in frames)) if phase), "handler")
+            stacks[f"{names.get(threadId, threadId)};" + ";".join(map(_label, reversed(frames)))] += 1
+            phases[handler, phase] += weight
+
+    def profile(self, seconds: float) -> tuple[str, dict]:
+        # Blocks for `seconds`; writes the samples in collapsed-stack format (flamegraph.pl, speedscope, inferno)
+        # and returns the file path and {handler: {phase: seconds}}
+        seconds = min(seconds, MAX_SECONDS)
+        stacks, phases = Counter(), Counter()
+        last = perf_counter()
+        end = last + seconds
+        while last < end:
+            sleep(self.interval)
+            now = perf_counter()
+            names = {thread.ident: thread.name.replace(";", "_").replace(" ", "_") for thread in threads()}
+            # Each sample stands for the time since the previous one, sampling included
+            self._sample(names, now - last, stacks, phases)
+            last = now
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+        with open(path, "w") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        summary = {}
+        for (handler, phase), spent in phases.items():
+            summary.setdefault(handler, {})[phase] = spent
+        return path, summary
+
+
+def formatSummary(summary: dict, seconds: float) -> str:
+    # Plain-text table for the admin chat: approximate seconds per handler, split by phase
+    if not summary:
+        return f"Nessun handler attivo nei {seconds:.0f} s campionati."
+    lines = [f"Profilo di {seconds:.0f} s (secondi stimati per fase):"]
+    for handler, phases in sorted(summary.items(), key=lambda item: -sum(item[1].values())):
+        split = ", ".join(f"{phase} {value:.2f}" for phase, value in sorted(phases.items(), key=lambda item: -item[1]))
+        lines.append(f"{handler}: {sum(phases.values()):.2f} ({split})")
+    return "\n".join(lines)
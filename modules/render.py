@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from threading import Lock
+from modules import helpers
+from modules.api import RankingView, TeamNameError
+
+# Message bodies shared by tgbot and dsbot. Text is Telegram HTML (dsbot runs it through parseHTML);
+# the *Columns variants return the (left, right) field values of dsbot's two-column embeds.
+
+
+class RenderCache:
+    # LRU of rendered output for the snapshot the api currently holds. A key is (snapshot version, view, view
+    # arguments), where the view is any function of (api, *args): the ones below, or a bot's own embed builders.
+    # Entries are dropped as soon as the api moves to another snapshot; `budget` caps the cached characters.
+    def __init__(self, budget: int=2_000_000) -> None:
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.snapshot = None
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeOf(value) -> int:
+        # str, discord.Embed (len() is its character count) or a tuple of those
+        return sum(map(len, value)) if isinstance(value, tuple) else len(value)
+
+    def get(self, api: RankingView, view, *args):
+        snapshot = api.snapshot
+        key = (snapshot.version, view, args)
+        with self.lock:
+            if snapshot is not self.snapshot:
+                self.entries.clear()
+                self.size = 0
+                self.snapshot = snapshot
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        # Rendered outside the lock; a TeamNameError is raised to the caller and nothing is cached
+        value = view(api, *args)
+        size = self._sizeOf(value)
+        with self.lock:
+            if snapshot is self.snapshot and key not in self.entries and size <= self.budget:
+                self.entries[key] = (value, size)
+                self.size += size
+                while self.size > self.budget:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.size -= evicted
+                    self.evictions += 1
+        return value
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "size": self.size}
+
+
+def leaderboard(api: RankingView, page: int=1) -> str:
+    message = "🏆 <b>Leaderboard</b>\n"
+    for name in api.teams()[10*(page-1):10*page]:
+        team = api.teamInfo(name)
+        message += f"\n{helpers.getRankIcon(team.rank)} <b>{team.name}</b> ({team.totalScore} pts.)"
+    return message
+
+
+def leaderboardColumns(api: RankingView, page: int=1) -> tuple[str, str]:
+    leftColumn = ""
+    rightColumn = ""
+    for name in api.teams()[10*(page-1):10*page]:
+        team = api.teamInfo(name)
+        leftColumn += f"{helpers.getRankIcon(team.rank)} {team.name}\n"
+        rightColumn += f"{team.totalScore} pts.\n"
+    return leftColumn, rightColumn
+
+
+def top(api: RankingView, teamName: str=None) -> str:
+    message = "🏆 <b>Top Teams</b>\n"
+    for name in api.teams()[:3]:
+        team = api.teamInfo(name)
+        message += f"\n{helpers.getRankIcon(team.rank)} <b>{team.name}</b> ({team.totalScore} pts.)"
+    if teamName:
+        try:
+            team = api.teamInfo(teamName)
+            message += f"\n\n{helpers.getRankIcon(team.rank)} <b>{team.name}</b> ({team.totalScore} pts.)"
+        except TeamNameError:
+            pass
+    return message
+
+
+def topColumns(api: RankingView, teamName: str=None) -> tuple[str, str]:
+    leftColumn = ""
+    rightColumn = ""
+    for name in api.teams()[:3]:
+        team = api.teamInfo(name)
+        leftColumn += f"{helpers.getRankIcon(team.rank)} {team.name}\n"
+        rightColumn += f"{team.totalScore} pts.\n"
+    if teamName:
+        try:
+            team = api.teamInfo(teamName)
+            leftColumn += f"\n{helpers.getRankIcon(team.rank)} {team.name}"
+            rightColumn += f"\n{team.totalScore} pts."
+        except TeamNameError:
+            pass
+    return leftColumn, rightColumn
+
+
+def team(api: RankingView, teamName: str, prefix: str="/") -> str:
+    info = api.teamInfo(teamName)
+    return f"👥 Team: <b>{info.name}</b>\n\n" \
+           f"📊 Rank: <b>{info.rank}°</b> / {len(api.teams())}\n" \
+           f"📈 Total Score: <b>{info.totalScore}</b> / {len(api.questions())*100}pts.\n\n" \
+           f"<i>Usa </i>{prefix}partials<i> per vedere i punteggi singoli dei quesiti.</i>"
+
+
+def teamColumns(api: RankingView, teamName: str) -> tuple[str, str]:
+    info = api.teamInfo(teamName)
+    return "👥 Team:\n📊 Rank:\n📈 Total Score:", \
+           f"{info.name}\n{info.rank}° / {len(api.teams())}\n{info.totalScore} / {len(api.questions())*100}pts."
+
+
+def partials(api: RankingView, teamName: str) -> str:
+    team = api.teamInfo(teamName)
+    questList = api.questions()
+    longestName = max(questList, key=len, default="")
+    message = f"👥 Team: <b>{teamName}</b>\n\n"
+    for quest, score in zip(questList, team.partialScores):
+        padding = " " * (len(longestName) - len(quest))
+        message += f"{helpers.getStatIcon(score)}<code> {quest}: {padding}</code><b>{score}</b> pts.\n"
+    message += f"\n📈 Total: <b>{team.totalScore}</b> / {len(team.partialScores)*100}pts."
+    return message
+
+
+def partialsColumns(api: RankingView, teamName: str) -> tuple[str, str]:
+    team = api.teamInfo(teamName)
+    leftColumn = ""
+    rightColumn = ""
+    for quest, score in zip(api.questions(), team.partialScores):
+        leftColumn += f"{helpers.getStatIcon(score)} {quest}:\n"
+        rightColumn += f"{score} pts.\n"
+    leftColumn += "\n📈 Total:"
+    rightColumn += f"\n{team.totalScore} / {len(team.partialScores)*100}pts."
+    return leftColumn, rightColumn
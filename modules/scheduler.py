@@ -0,0 +1,64 @@
+from time import monotonic
+
+
+class PollScheduler:
+    # Decides how long to wait before the next refresh, from what the last one saw:
+    #  - no event running: back off from `idleInterval`, doubling up to `maxIdleInterval`; a poll that made no
+    #    request (reading the poller's file) stays at `idleInterval`, as the poller already backs off
+    #  - event just detected or the leaderboard changed: poll every `fastInterval`
+    #  - event running, nothing new: relax by `relax` per poll back to `interval`
+    # A poll costs the requests its refresh reports, or `requestCost` when it does not say (0 when reading the
+    # poller's file). Requests are paced by a token bucket refilled at `budget` per `budgetWindow` seconds, holding
+    # at most `burst` requests, so a fast stretch slows down to the budget instead of stalling once it is spent.
+    def __init__(self, interval: float=60, fastInterval: float=15, idleInterval: float=60,
+                 maxIdleInterval: float=300, relax: float=1.5, budget: float=720, budgetWindow: float=3600,
+                 burst: float=None, requestCost: int=4, clock=monotonic) -> None:
+        self.interval = interval
+        self.fastInterval = fastInterval
+        self.idleInterval = idleInterval
+        self.maxIdleInterval = maxIdleInterval
+        self.relax = relax
+        self.rate = budget / budgetWindow
+        self.burst = burst if burst is not None else budget / 12
+        self.requestCost = requestCost
+        self.clock = clock
+        self.tokens = self.burst
+        self.lastPoll = None
+        self.running = None
+        self.current = interval
+        self.stats = {"polls": 0, "requests": 0, "idlePolls": 0, "changedPolls": 0, "budgetWaits": 0}
+
+    def _spend(self, cost: float) -> float:
+        # Takes this poll's requests from the bucket; returns the seconds until it holds another poll's worth,
+        # taking the next poll to cost as much as this one
+        now = self.clock()
+        if self.lastPoll is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.lastPoll) * self.rate)
+        self.lastPoll = now
+        self.tokens -= cost
+        if cost == 0 or self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def record(self, running: bool, changed: bool=False, requests: int=None) -> float:
+        # Call after every refresh (NoEventRunning means running=False) with the judge requests it made, e.g.
+        # api.requestsMade; returns the seconds to sleep
+        cost = self.requestCost if requests is None else requests
+        if not running:
+            self.current = self.idleInterval if self.running is not False or cost == 0 \
+                else min(self.current * 2, self.maxIdleInterval)
+        elif changed or not self.running:
+            self.current = self.fastInterval
+        else:
+            self.current = min(self.current * self.relax, self.interval)
+        self.running = running
+
+        self.stats["polls"] += 1
+        self.stats["requests"] += cost
+        self.stats["idlePolls"] += not running
+        self.stats["changedPolls"] += changed
+        wait = self._spend(cost)
+        if wait > self.current:
+            self.stats["budgetWaits"] += 1
+            return wait
+        return self.current
@@ -0,0 +1,113 @@
+import os
+from asyncio import get_event_loop
+from mmap import mmap, ACCESS_READ
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from struct import Struct
+from time import time
+from types import MappingProxyType
+from modules.api import RankingView, NoEventRunning, diffSnapshots, DIFF_SECONDS
+
+# Snapshot file: magic, epoch (poller start time), snapshot version, payload length, number of buffers, then the
+# pickled payload. The score matrix is pickled out of band: each buffer follows as its length and its bytes, aligned
+# to 8 bytes, so readers map it as a read-only array over the file instead of unpickling a copy of it.
+# The poller replaces the whole file atomically, so readers never see a half-written snapshot.
+HEADER = Struct("<8sdQQQ")
+BUFFER = Struct("<Q")
+MAGIC = b"OISSNAP3"
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // 8) * 8
+
+
+class SnapshotPublisher:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.epoch = time()
+        self.published = 0
+
+    def publish(self, api: RankingView, running: bool) -> None:
+        buffers = []
+        payload = dumps({
+            "running": running,
+            "snapshot": api.snapshot,
+            "fromVersion": api.oldSnapshot.version,
+            "changes": {team: dict(change) for team, change in api.changes().items()}
+        }, protocol=HIGHEST_PROTOCOL, buffer_callback=buffers.append)
+        tmpPath = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmpPath, "wb") as file:
+            file.write(HEADER.pack(MAGIC, self.epoch, api.snapshot.version, len(payload), len(buffers)))
+            file.write(payload)
+            for buffer in buffers:
+                with buffer.raw() as data:
+                    file.write(BUFFER.pack(data.nbytes))
+                    file.write(bytes(_aligned(file.tell()) - file.tell()))
+                    file.write(data)
+        os.replace(tmpPath, self.path)
+        self.published += 1
+
+
+class SharedRankingAPI(RankingView):
+    # Reads the snapshots published by poller.py instead of polling the judge. The file is only decoded when the
+    # poller replaced it, straight from the memory map; the score matrix stays in the map, shared by every reader.
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self.fileId = None
+        self.epoch = None
+        self.running = False
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise NoEventRunning
+        fileId = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if fileId == self.fileId:
+            return None
+        # The map is not closed here: the snapshot's matrix is a view on it, and it is unmapped with the snapshot
+        with open(self.path, "rb") as file:
+            mapped = mmap(file.fileno(), 0, access=ACCESS_READ)
+        magic, epoch, version, length, count = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            raise NoEventRunning
+        view = memoryview(mapped)
+        offset = HEADER.size + length
+        buffers = []
+        for _ in range(count):
+            size, = BUFFER.unpack_from(mapped, offset)
+            offset = _aligned(offset + BUFFER.size)
+            buffers.append(view[offset:offset + size])
+            offset += size
+        published = loads(view[HEADER.size:HEADER.size + length], buffers=buffers)
+        self.fileId = fileId
+        return epoch, published
+
+    def refresh(self) -> bool:
+        loaded = self._load()
+        if loaded is not None:
+            epoch, published = loaded
+            self.running = published["running"]
+        if not self.running:
+            raise NoEventRunning
+
+        self.oldSnapshot = self.snapshot
+        if loaded is None or (epoch == self.epoch and published["snapshot"].version == self.snapshot.version):
+            self.cyclesSkipped += 1
+            self.changeSet = MappingProxyType({})
+            return False
+
+        self.snapshot = published["snapshot"]
+        if epoch == self.epoch and published["fromVersion"] == self.oldSnapshot.version:
+            self.changeSet = MappingProxyType({team: MappingProxyType(change) for team, change in published["changes"].items()})
+        else:
+            # We missed a publication (or the poller restarted): diff against what this process last saw
+            with DIFF_SECONDS.time():
+                self.changeSet = diffSnapshots(self.oldSnapshot, self.snapshot)
+        self.epoch = epoch
+        return True
+
+
+class AsyncSharedRankingAPI(SharedRankingAPI):
+    async def refresh(self) -> bool:
+        return await get_event_loop().run_in_executor(None, super().refresh)
@@ -0,0 +1,65 @@
+from pony.orm import db_session, select
+from modules.database import TGUser, DSChat, TGSubscription, DSSubscription
+
+NEWS_TYPES = ("eventStart", "rankChanged", "pointsChanged")
+# Longer team lists read the whole newsType range of the index instead of an IN list; kept under the 999 host
+# parameters older SQLite builds allow per statement
+TEAM_LIST_LIMIT = 900
+
+
+def newsOf(chat) -> set:
+    return {sub.newsType for sub in chat.subscriptions}
+
+
+def setNews(chat, newsType: str, active: bool) -> None:
+    entity = TGSubscription if isinstance(chat, TGUser) else DSSubscription
+    sub = next((sub for sub in chat.subscriptions if sub.newsType == newsType), None)
+    if active and sub is None:
+        entity(chat=chat, newsType=newsType, teamName=chat.teamName)
+    elif not active and sub is not None:
+        sub.delete()
+
+
+def setTeam(chat, teamName: str) -> None:
+    chat.teamName = teamName
+    for sub in chat.subscriptions:
+        sub.teamName = teamName
+
+
+def _followersQuery(platform: str, newsType: str):
+    if platform == "telegram":
+        query = select((sub.chat.chatId, sub.teamName) for sub in TGSubscription if sub.newsType == newsType)
+    else:
+        query = select((sub.chat.chatId, sub.teamName, sub.chat.viewEmbed) for sub in DSSubscription
+                       if sub.newsType == newsType)
+    # A chat has one row per newsType, so the DISTINCT Pony adds to tuple queries is never needed
+    return query.without_distinct()
+
+
+@db_session
+def followers(platform: str, newsType: str, teams=None) -> list[tuple]:
+    # Chats subscribed to `newsType`, only those following one of `teams` if given.
+    # Rows are (chatId, teamName) for telegram and (chatId, teamName, viewEmbed) for discord.
+    query = _followersQuery(platform, newsType)
+    if teams is None:
+        return query[:]
+    teams = set(teams)
+    if len(teams) <= TEAM_LIST_LIMIT:
+        teamList = list(teams)
+        return query.where(lambda sub: sub.teamName in teamList)[:]
+    return [row for row in query[:] if row[1] in teams]
+
+
+@db_session
+def migrateNews(platform: str) -> int:
+    # Moves the old `news` arrays into the subscription table; an emptied array marks a chat as done.
+    # Each bot runs it for its own platform at startup.
+    chatEntity, entity = (TGUser, TGSubscription) if platform == "telegram" else (DSChat, DSSubscription)
+    migrated = 0
+    for chat in select(chat for chat in chatEntity if len(chat.news) > 0):
+        # The whole migration is one transaction: a chat with a non-empty array has no subscriptions yet
+        for newsType in set(chat.news) & set(NEWS_TYPES):
+            entity(chat=chat, newsType=newsType, teamName=chat.teamName)
+        chat.news = []
+        migrated += 1
+    return migrated
@@ -0,0 +1,64 @@
+# Python Libraries
+from time import sleep
+from json import load as jsload
+from traceback import print_exc
+
+# Custom Modules
+from modules.api import OISRankingAPI, NoEventRunning
+from modules.shared import SnapshotPublisher
+from modules.history import HistoryStore
+from modules.scheduler import PollScheduler
+from modules import metrics
+
+with open("settings.json") as settings_file:
+    js_settings = jsload(settings_file)
+
+history = HistoryStore(js_settings["history"]["path"]) if "history" in js_settings else None
+api = OISRankingAPI(history, js_settings.get("api", {}).get("baseUrl"))
+publisher = SnapshotPublisher(js_settings["poller"]["path"])
+# "poller": {"interval"} is the interval while an event runs and nothing changes, as before
+scheduler = PollScheduler(**{"interval": js_settings["poller"].get("interval", 60), **js_settings.get("polling", {})})
+running = None
+REFRESH_SECONDS = metrics.histogram("refresh_seconds", "Time for api.refresh()")
+
+if "poller" in js_settings.get("metrics", {}):
+    metrics.gauges("scheduler", "Refresh scheduler counters", lambda: scheduler.stats, "stat")
+    metrics.gauges("api", "Refresh counters", lambda: {"version": api.snapshot.version,
+                                                       "cyclesSkipped": api.cyclesSkipped,
+                                                       "bytesSaved": api.bytesSaved,
+                                                       "published": publisher.published}, "stat")
+    metrics.serve(js_settings["metrics"]["poller"], js_settings["metrics"].get("host", "127.0.0.1"))
+
+
+def publish(nowRunning: bool) -> None:
+    # `running` is what the readers were last told; after a failed publication it is unknown, so the next refresh
+    # publishes again whatever it finds
+    global running
+    try:
+        publisher.publish(api, running=nowRunning)
+        running = nowRunning
+    except Exception:
+        print_exc()
+        running = None
+
+
+def runUpdates() -> float:
+    # Returns how long to wait before the next refresh
+    try:
+        with REFRESH_SECONDS.time():
+            changed = api.refresh()
+        if changed or not running:
+            publish(True)
+    except NoEventRunning:
+        if running is not False:
+            publish(False)
+        return scheduler.record(running=False, requests=api.requestsMade)
+    except Exception:
+        # e.g. the history file could not be written: still a poll, paced and charged like any other
+        print_exc()
+        return scheduler.record(running=True, requests=api.requestsMade)
+    return scheduler.record(running=True, changed=changed, requests=api.requestsMade)
+
+
+while True:
+    sleep(runUpdates())
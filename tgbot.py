@@ -1,96 +1,169 @@
 # Python Libraries
 from time import sleep
 from telepotpro import Bot, glance
-from telepotpro.exception import TelegramError, BotWasBlockedError
+from telepotpro.exception import TelegramError
 from threading import Thread
 from pony.orm import db_session, select
 from json import load as jsload
+from traceback import print_exc
 
 # Custom Modules
-from modules import keyboards, helpers
-from modules.database import TGUser
+from modules import keyboards, broadcast, render, subscriptions, metrics
+from modules.database import TGUser, connect
 from modules.api import OISRankingAPI, NoEventRunning, TeamNameError
+from modules.history import HistoryStore
+from modules.shared import SharedRankingAPI
+from modules.delivery import DeliveryQueue, DeliveryBatch
+from modules.dispatcher import Dispatcher
+from modules.chatcache import ChatCache
+from modules.scheduler import PollScheduler
+from modules.profiler import SamplingProfiler, formatSummary, MAX_SECONDS
 
 with open("settings.json") as settings_file:
     js_settings = jsload(settings_file)
 
+connect(js_settings.get("database", {}).get("path"))
 bot = Bot(js_settings["telegram"]["token"])
 adminIds = js_settings["telegram"]["admins"]
-api = OISRankingAPI()
+if "poller" in js_settings:
+    api = SharedRankingAPI(js_settings["poller"]["path"])
+else:
+    history = HistoryStore(js_settings["history"]["path"]) if "history" in js_settings else None
+    api = OISRankingAPI(history, js_settings.get("api", {}).get("baseUrl"))
+# Each poll is charged the judge requests its refresh made (api.requestsMade): none when reading the poller's file
+scheduler = PollScheduler(**js_settings.get("polling", {}))
+renders = render.RenderCache()
+chats = ChatCache("telegram")
 roundStarted = False
 
+# Chats that blocked the bot are deleted in batches by the cache's next flush
+delivery = DeliveryQueue(bot, onBlocked=chats.remove)
+
+# Label values for the command and button metrics; anything else is counted as "other"
+COMMANDS = ("/about", "/help", "/annulla", "/broadcast", "/users", "/profile", "/start", "/team", "/partials",
+            "/leaderboard", "/top", "/settings", "/support")
+BUTTONS = ("settings_main", "settings_team", "settings_news", "settings_changeTeam", "settings_removeTeam",
+           "leaderboard_page")
+REFRESH_SECONDS = metrics.histogram("refresh_seconds", "Time for api.refresh()")
+profiler = SamplingProfiler(("reply", "button_press", "runUpdates", "runBroadcast"),
+                            js_settings.get("profiler", {}).get("path", "profiles"))
+
+
+def notifyTimer(newsType: str) -> metrics.Timer:
+    return metrics.histogram("notification_seconds",
+                             "Time to select the recipients of one kind of notification and send it",
+                             type=newsType).time()
+
 
 @db_session
 def sendRoundStarted():
-    users = select(user for user in TGUser if "eventStart" in user.news)[:]
-    for user in users:
-        try:
-            bot.sendMessage(user.chatId,
-                            "🔔 <b>Gara iniziata!</b>\n"
-                                 "La classifica è attiva, puoi visualizzare le informazioni della tua squadra con /team.\n"
-                                 "Buona fortuna!", parse_mode="HTML")
-        except BotWasBlockedError:
-            user.delete()
-        except TelegramError:
-            pass
+    with notifyTimer("eventStart"):
+        users = subscriptions.followers("telegram", "eventStart")
+        for chatId, _ in users:
+            delivery.send(chatId, "🔔 <b>Gara iniziata!</b>\n"
+                                  "La classifica è attiva, puoi visualizzare le informazioni della tua squadra con /team.\n"
+                                  "Buona fortuna!", parse_mode="HTML")
 
 
 @db_session
 def sendLeaderboardNews():
-    teams = api.teams()
+    changes = api.changes()
+    if not changes:
+        return
 
     # Send team rank changed
-    users = select(user for user in TGUser if ("rankChanged" in user.news) and (user.teamName in teams))[:]
-    for user in users:
-        team = api.teamInfo(user.teamName)
-        prevTeam = api.teamInfo(user.teamName, oldData=True)
-        newRank = team["rank"]
-        gained = prevTeam["rank"] - newRank
-        try:
-            if gained > 0:
-                bot.sendMessage(user.chatId, f"📈 La squadra <b>{team['name']}</b> è salita di <b>{gained}</b> posizioni!\n"
-                                             f"📊 Rank attuale: {newRank}", parse_mode="HTML")
-            elif gained < 0:
-                bot.sendMessage(user.chatId, f"📉 La squadra <b>{team['name']}</b> è scesa di <b>{-gained}</b> posizioni.\n"
-                                             f"📊 Rank attuale: {newRank}", parse_mode="HTML")
-        except BotWasBlockedError:
-            user.delete()
-        except TelegramError:
-            pass
+    messages = {}
+    for team, change in changes.items():
+        gained = change["rankGained"]
+        if gained > 0:
+            messages[team] = f"📈 La squadra <b>{team}</b> è salita di <b>{gained}</b> posizioni!\n" \
+                             f"📊 Rank attuale: {change['rank']}"
+        elif gained < 0:
+            messages[team] = f"📉 La squadra <b>{team}</b> è scesa di <b>{-gained}</b> posizioni.\n" \
+                             f"📊 Rank attuale: {change['rank']}"
+    sendTeamNews("rankChanged", messages)
 
     # Send team points changed
-    users = select(user for user in TGUser if ("pointsChanged" in user.news) and (user.teamName in teams))[:]
-    for user in users:
+    messages = {}
+    for team, change in changes.items():
         message = ""
-        for quest in api.questions():
-            score = api.getTeamPartial(user.teamName, quest)
-            oldScore = api.getTeamPartial(user.teamName, quest, oldData=True)
-            gained = score - oldScore
+        for quest, score, gained in change["scores"]:
             if gained > 0:
                 message += f"🟢 <code>{quest}</code>: {score}/100 (+{gained})\n"
             elif gained < 0:
                 message += f"🔴 <code>{quest}</code>: {score}/100 ({gained})\n"
-
         if message != "":
-            try:
-                bot.sendMessage(user.chatId, f"📊 <b>Nuovi punteggi!</b>\n\n{message}", parse_mode="HTML")
-            except BotWasBlockedError:
-                user.delete()
-            except TelegramError:
-                pass
+            messages[team] = f"📊 <b>Nuovi punteggi!</b>\n\n{message}"
+    sendTeamNews("pointsChanged", messages)
+
+
+def sendTeamNews(newsType: str, messages: dict):
+    # Fan out one pre-rendered message per changed team to the users following it
+    if not messages:
+        return
+    with notifyTimer(newsType):
+        users = subscriptions.followers("telegram", newsType, messages)
+        for chatId, teamName in users:
+            delivery.send(chatId, messages[teamName], parse_mode="HTML")
+
+
+def runBroadcast(jobId: int):
+    # Pages through the recipients, saving the cursor after each page so a restart resumes where it stopped
+    job = broadcast.loadJob(jobId)
+    adminChat = int(job["adminChat"])
+    rate = broadcast.ProgressRate(job)
+    if not job["progressMessage"]:
+        try:
+            sent = bot.sendMessage(adminChat, broadcast.progressText(job, 0), parse_mode="HTML")
+            broadcast.setProgressMessage(jobId, sent["message_id"])
+            job["progressMessage"] = sent["message_id"]
+        except TelegramError:
+            # No progress message: the broadcast goes on without one
+            pass
+    progressMessage = (adminChat, int(job["progressMessage"])) if job["progressMessage"] else None
+
+    page = broadcast.nextPage(jobId)
+    while page:
+        batch = DeliveryBatch()
+        for _, target in page:
+            delivery.send(target, job["text"], batch, parse_mode="HTML", disable_web_page_preview=True)
+        sent, failed = batch.wait()
+        job = broadcast.advance(jobId, page[-1][0], sent, failed)
+        editProgress(progressMessage, job, rate)
+        page = broadcast.nextPage(jobId)
 
+    job = broadcast.finish(jobId)
+    editProgress(progressMessage, job, rate)
 
-def runUpdates():
+
+def editProgress(progressMessage: tuple, job: dict, rate):
+    if progressMessage is not None:
+        try:
+            bot.editMessageText(progressMessage, broadcast.progressText(job, rate(job)), parse_mode="HTML")
+        except TelegramError:
+            pass
+
+
+def runUpdates() -> float:
+    # Returns how long to wait before the next refresh
     global roundStarted
     try:
-        api.refresh()
+        with REFRESH_SECONDS.time():
+            changed = api.refresh()
         if not roundStarted:
             # TODO: fix bug // sendRoundStarted()
             roundStarted = True
-        else:
-            sendLeaderboardNews()
+        elif changed:
+            with notifyTimer("leaderboard"):
+                sendLeaderboardNews()
     except NoEventRunning:
         roundStarted = False
+        return scheduler.record(running=False, requests=api.requestsMade)
+    except Exception:
+        # The judge answered but notifying failed: still a poll, paced and charged like any other
+        print_exc()
+        return scheduler.record(running=True, requests=api.requestsMade)
+    return scheduler.record(running=True, changed=changed, requests=api.requestsMade)
 
 
 @db_session
@@ -104,9 +177,7 @@ def reply(msg):
         bot.sendMessage(chatId, "🤨 Formato file non supportato. /help")
         return
 
-    if not TGUser.exists(lambda u: u.chatId == chatId):
-        TGUser(chatId=chatId)
-    user = TGUser.get(chatId=chatId)
+    user = chats.get(chatId)
 
     if text == "/about":
         bot.sendMessage(chatId, "ℹ️ <b>Informazioni sul bot</b>\n"
@@ -157,19 +228,25 @@ def reply(msg):
 
     elif text.startswith("/broadcast ") and chatId in adminIds:
         bdText = text.split(" ", 1)[1]
-        pendingUsers = select(u.chatId for u in TGUser)[:]
-        userCount = len(pendingUsers)
-        for u in pendingUsers:
-            try:
-                bot.sendMessage(u, bdText, parse_mode="HTML", disable_web_page_preview=True)
-            except (TelegramError, BotWasBlockedError):
-                userCount -= 1
-        bot.sendMessage(chatId, f"📢 Messaggio inviato correttamente a {userCount} utenti!")
+        jobId = broadcast.createJob("telegram", bdText, chatId)
+        Thread(target=runBroadcast, args=[jobId]).start()
 
     elif text == "/users" and chatId in adminIds:
         totalUsers = len(select(u for u in TGUser)[:])
         bot.sendMessage(chatId, f"👤 Utenti totali: <b>{totalUsers}</b>", parse_mode="HTML")
 
+    elif text.split(" ", 1)[0] == "/profile" and chatId in adminIds:
+        args = text.split(" ", 1)
+        seconds = max(1, min(int(args[1]), MAX_SECONDS)) if len(args) > 1 and args[1].isdigit() else 60
+
+        def profiled(path: str, summary: dict):
+            bot.sendMessage(chatId, f"{formatSummary(summary, seconds)}\n\n📄 {path}")
+
+        if profiler.start(seconds, profiled):
+            bot.sendMessage(chatId, f"⏱ Profilazione in corso per {seconds} secondi...")
+        else:
+            bot.sendMessage(chatId, "❌ Una profilazione è già in corso.")
+
     elif "reply_to_message" in msg:
         if chatId in adminIds:
             try:
@@ -200,17 +277,12 @@ def reply(msg):
         if user.teamName:
             if roundStarted:
                 try:
-                    team = api.teamInfo(user.teamName)
+                    message = renders.get(api, render.team, user.teamName)
                 except TeamNameError:
                     bot.sendMessage(chatId, "⚠️ La squadra che hai inserito non è presente nella classifica!\n"
                                             "Premi /settings per cambiare il nome della squadra.", parse_mode="HTML")
                     return
-                teams = api.teams()
-                bot.sendMessage(chatId, f"👥 Team: <b>{team['name']}</b>\n\n"
-                                        f"📊 Rank: <b>{team['rank']}°</b> / {len(teams)}\n"
-                                        f"📈 Total Score: <b>{team['totalScore']}</b> / {len(api.questions())*100}pts.\n\n"
-                                        f"<i>Usa </i>/partials<i> per vedere i punteggi singoli dei quesiti.</i>",
-                                parse_mode="HTML")
+                bot.sendMessage(chatId, message, parse_mode="HTML")
             else:
                 bot.sendMessage(chatId, f"👥 La tua squadra è <b>{user.teamName}</b>.\n"
                                         f"Posso visualizzare più informazioni quando è attiva una gara.",
@@ -223,20 +295,12 @@ def reply(msg):
     elif text == "/partials":
         if user.teamName:
             if roundStarted:
-                questList = api.questions()
                 try:
-                    team = api.teamInfo(user.teamName)
+                    message = renders.get(api, render.partials, user.teamName)
                 except TeamNameError:
                     bot.sendMessage(chatId, "⚠️ La squadra che hai inserito non è presente nella classifica!\n"
                                             "Premi /settings per cambiare il nome della squadra.", parse_mode="HTML")
                     return
-                longestName = max(questList, key=len)
-                questPoints = team["partialScores"]
-                message = f"👥 Team: <b>{user.teamName}</b>\n\n"
-                for quest, score in zip(questList, questPoints):
-                    padding = " " * (len(longestName) - len(quest))
-                    message += f"{helpers.getStatIcon(score)}<code> {quest}: {padding}</code><b>{score}</b> pts.\n"
-                message += f"\n📈 Total: <b>{team['totalScore']}</b> / {len(questPoints)*100}pts."
                 bot.sendMessage(chatId, message, parse_mode="HTML")
             else:
                 bot.sendMessage(chatId, f"👥 La tua squadra è <b>{user.teamName}</b>.\n"
@@ -249,29 +313,14 @@ def reply(msg):
 
     elif text == "/leaderboard":
         if roundStarted:
-            teams = api.teams()
-            message = "🏆 <b>Leaderboard</b>\n"
-            for pos in range(10):
-                team = api.teamInfo(teams[pos])
-                message += f"\n{helpers.getRankIcon(team['rank'])} <b>{team['name']}</b> ({team['totalScore']} pts.)"
-            bot.sendMessage(chatId, message, parse_mode="HTML", reply_markup=keyboards.leaderboard(1, len(teams)))
+            bot.sendMessage(chatId, renders.get(api, render.leaderboard, 1), parse_mode="HTML",
+                            reply_markup=keyboards.leaderboard(1, len(api.teams())))
         else:
             bot.sendMessage(chatId, "Nessuna gara è attualmente in corso!")
 
     elif text == "/top":
         if roundStarted:
-            teams = api.teams()
-            message = "🏆 <b>Top Teams</b>\n"
-            for pos in range(3):
-                team = api.teamInfo(teams[pos])
-                message += f"\n{helpers.getRankIcon(team['rank'])} <b>{team['name']}</b> ({team['totalScore']} pts.)"
-            if user.teamName:
-                try:
-                    team = api.teamInfo(user.teamName)
-                    message += f"\n\n{helpers.getRankIcon(team['rank'])} <b>{team['name']}</b> ({team['totalScore']} pts.)"
-                except TeamNameError:
-                    pass
-            bot.sendMessage(chatId, message, parse_mode="HTML")
+            bot.sendMessage(chatId, renders.get(api, render.top, user.teamName), parse_mode="HTML")
         else:
             bot.sendMessage(chatId, "Nessuna gara è attualmente in corso!")
 
@@ -299,18 +348,19 @@ def button_press(msg):
     msgId = int(msg["message"]["message_id"])
     button = str(query_split[0])
     data = str(query_split[1]) if len(query_split) > 1 else None
-    user = TGUser.get(chatId=chatId)
+    user = chats.get(chatId)
 
     def editNotifSelection():
+        news = user.news
         bot.editMessageText((chatId, msgId), "📲 <b>Gestione Notifiche</b>\n\n"
                                              "⏰ Inizio gara: {}\n"
                                              "📊 Nuova posizione in classifica: {}\n"
                                              "📈 Punteggio modificato: {}\n\n"
                                              "Quali notifiche vuoi ricevere? (Clicca per cambiare)"
                                              "".format(
-                                             "🔔 Attivo" if "eventStart" in user.news else "🔕 Disattivo",
-                                             "🔔 Attivo" if "rankChanged" in user.news else "🔕 Disattivo",
-                                             "🔔 Attivo" if "pointsChanged" in user.news else "🔕 Disattivo"),
+                                             "🔔 Attivo" if "eventStart" in news else "🔕 Disattivo",
+                                             "🔔 Attivo" if "rankChanged" in news else "🔕 Disattivo",
+                                             "🔔 Attivo" if "pointsChanged" in news else "🔕 Disattivo"),
                             parse_mode="HTML", reply_markup=keyboards.settings_selectnews())
 
     if button == "settings_main":
@@ -336,10 +386,7 @@ def button_press(msg):
 
     elif button.startswith("news_"):
         newsId = button.replace("news_", "")
-        if newsId in user.news:
-            user.news.remove(newsId)
-        else:
-            user.news.append(newsId)
+        user.setNews(newsId, newsId not in user.news)
         editNotifSelection()
 
     elif button == "settings_changeTeam":
@@ -356,26 +403,48 @@ def button_press(msg):
     elif button == "leaderboard_page":
         page = int(data)
         if roundStarted:
-            teams = api.teams()
-            message = "🏆 <b>Leaderboard</b>\n"
-            for pos in range(10):
-                pos += 10*(page-1)
-                team = api.teamInfo(teams[pos])
-                message += f"\n{helpers.getRankIcon(team['rank'])} <b>{team['name']}</b> ({team['totalScore']} pts.)"
-            bot.editMessageText((chatId, msgId), message, parse_mode="HTML", reply_markup=keyboards.leaderboard(page, len(teams)))
+            bot.editMessageText((chatId, msgId), renders.get(api, render.leaderboard, page), parse_mode="HTML",
+                                reply_markup=keyboards.leaderboard(page, len(api.teams())))
         else:
             bot.editMessageText((chatId, msgId), "Nessuna gara è attualmente in corso!",
                                 parse_mode="HTML", reply_markup=None)
 
 
-def accept_message(msg):
-    Thread(target=reply, args=[msg]).start()
+dispatcher = Dispatcher()
 
-def accept_button(msg):
-    Thread(target=button_press, args=[msg]).start()
+def timed(handler, kind: str, label: str, msg):
+    # Latency and failures per command or button; the dispatcher still logs the traceback
+    with metrics.histogram(f"{kind}_seconds", f"Time to handle a {kind}", **{kind: label}).time(
+            metrics.counter(f"{kind}_errors_total", f"Handlers of a {kind} that raised", **{kind: label})):
+        handler(msg)
 
-bot.message_loop(callback={'chat': accept_message, 'callback_query': accept_button})
+def accept_message(msg):
+    command = msg.get("text", "").split(" ", 1)[0]
+    dispatcher.submit(msg["chat"]["id"], timed, reply, "command", command if command in COMMANDS else "other", msg)
 
-while True:
-    runUpdates()
-    sleep(60)
+def accept_button(msg):
+    button = msg.get("data", "").split("#", 1)[0]
+    dispatcher.submit(msg["from"]["id"], timed, button_press, "button", button if button in BUTTONS else "other", msg)
+
+# Startup. Importing tgbot instead (benchmarks/load_dispatcher.py) only sets up the handlers and their state
+if __name__ == "__main__":
+    # "metrics": {"telegram": port, "discord": port, "poller": port, "host"}: one endpoint per process
+    if "telegram" in js_settings.get("metrics", {}):
+        metrics.gauges("delivery", "Telegram delivery queue counters", lambda: delivery.stats, "outcome")
+        metrics.gauges("dispatcher", "Update dispatcher counters", lambda: dispatcher.stats, "stat")
+        metrics.gauges("render_cache", "Rendered message cache counters", renders.stats, "stat")
+        metrics.gauges("chat_cache", "Chat settings cache counters", lambda: chats.stats, "stat")
+        metrics.gauges("scheduler", "Refresh scheduler counters", lambda: scheduler.stats, "stat")
+        metrics.gauges("api", "Refresh counters", lambda: {"version": api.snapshot.version,
+                                                           "cyclesSkipped": api.cyclesSkipped,
+                                                           "bytesSaved": api.bytesSaved}, "stat")
+        metrics.serve(js_settings["metrics"]["telegram"], js_settings["metrics"].get("host", "127.0.0.1"))
+
+    subscriptions.migrateNews("telegram")
+    for pendingJob in broadcast.pendingJobs("telegram"):
+        Thread(target=runBroadcast, args=[pendingJob]).start()
+
+    bot.message_loop(callback={'chat': accept_message, 'callback_query': accept_button})
+
+    while True:
+        sleep(runUpdates())